@@ -1,19 +1,33 @@
-from aiohttp import web
-from chatbot.config import ServiceConfig
-from prometheus_client import CollectorRegistry
-from pydantic_yaml import to_yaml_str
-import logging
-from chatbot.hams import Hams, hams_app_create
-
-# from chatbot.service import service_app_create
-from chatbot.azurebot import azure_app_create
-from .mcp_client import mcp_app_create
-from chatbot.langgraph import langgraph_app_create
-from chatbot import keys
+import time
+
+# Taken before the other imports so they are timed as the imports phase of startup
+IMPORT_START = time.perf_counter()
+
+from aiohttp import web  # noqa: E402
+from chatbot.config import ServiceConfig  # noqa: E402
+from prometheus_client import CollectorRegistry  # noqa: E402
+from pydantic_yaml import to_yaml_str  # noqa: E402
+import logging  # noqa: E402
+
+# The subsystems are imported by app_init when the config enables them
+# so the CLI and disabled subsystems do not pay for their imports
+from chatbot import keys  # noqa: E402
+from chatbot.startup import StartupTimings, startup_hooks_begin, startup_hooks_end  # noqa: E402
+
+IMPORT_END = time.perf_counter()
 
 logger = logging.getLogger(__name__)
 
 
+def startup_timings() -> StartupTimings:
+    """
+    Timings for a start of the service, beginning with the imports of the service
+    """
+    timings = StartupTimings(IMPORT_START)
+    timings.record("imports", IMPORT_END - IMPORT_START)
+    return timings
+
+
 def config_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
     """
     Create the service configuration from the given YAML file and secrets directory
@@ -32,32 +46,62 @@ def metrics_app_create(app: web.Application) -> web.Application:
     return app
 
 
-def app_init(app: web.Application, config: ServiceConfig):
+def app_init(app: web.Application, config: ServiceConfig, timings: StartupTimings | None = None):
     """
     Initialize the service with the given configuration file
     This is seperated from service_init as it is also used from the adev dev server
+
+    The phases of startup are recorded to timings and exported as metrics
     """
+    timings = timings or startup_timings()
+
+    with timings.phase("app_init"):
+        logger.info(f"CONFIG\n{to_yaml_str(config, indent=2)}")
+
+        config_app_create(app, config)
+        metrics_app_create(app)
+        app[keys.startup_timings] = timings
+        timings.export(app[keys.metrics])
+        # Before the other cleanup contexts so all the startup hooks are timed
+        app.cleanup_ctx.append(startup_hooks_begin)
+
+        from chatbot.hams import hams_app_create
+
+        hams_app_create(app, config.hams)
+
+        from chatbot.service import events_app_create
+
+        events_app_create(app)
+
+        if config.myai.toolbox.mcps:
+            from chatbot.mcp_client import mcp_app_create
+
+            mcp_app_create(app, config)
+
+        # from chatbot.service import service_app_create
+        # service_app_create(app, config)
+
+        from chatbot.langgraph import langgraph_app_create
+
+        langgraph_app_create(app, config)
+
+        if config.bot is not None:
+            from chatbot.azurebot import azure_app_create
 
-    logger.info(f"CONFIG\n{to_yaml_str(config, indent=2)}")
+            azure_app_create(app, config)
 
-    config_app_create(app, config)
-    metrics_app_create(app)
-    hams_app_create(app, config.hams)
-    mcp_app_create(app, config)
-    # service_app_create(app, config)
-    langgraph_app_create(app, config)
-    azure_app_create(app, config)
+        app.on_startup.append(startup_hooks_end)
 
     return app
 
 
-def app_start(config: ServiceConfig):
+def app_start(config: ServiceConfig, timings: StartupTimings | None = None):
     """
     Start the service with the given configuration file
     """
     app = web.Application()
 
-    app_init(app, config)
+    app_init(app, config, timings)
 
     web.run_app(
         app,
@@ -5,10 +5,12 @@ import traceback
 import re
 from chatbot.chathistory import ChatHistory
 from chatbot.azurebot.webview import AzureBotView
+from chatbot.azurebot.streaming import ThrottledStream
 from chatbot.config import ChatBotConfig
 from chatbot import keys
 
 from chatbot.langgraph.handler import LanggraphHandler
+from chatbot.service.state import Events
 from microsoft_agents.hosting.core import (
     Authorization,
     AgentApplication,
@@ -103,7 +105,6 @@ def azure_app_create(app: web.Application, config: ServiceConfig) -> web.Applica
 
     @AGENT_APP.activity("message")
     async def on_message(context: TurnContext, state: TurnState):
-        context.streaming_response.queue_informative_update("Working on a response for you...")
         chat_history_store_item = state.get_value(
             "ConversationState.chatHistory",
             lambda: ChatHistoryStoreItem(),
@@ -111,21 +112,38 @@ def azure_app_create(app: web.Application, config: ServiceConfig) -> web.Applica
         )
 
         # Check whether langgraph_handler has attribute 'graph'
-        if not hasattr(langgraph_handler, "graph"):
-            await context.send_activity("LanggraphHandler LLM is not loaded correctly")
+        if not langgraph_handler.ready:
+            await context.send_activity("The agent is still starting, please try again shortly")
             return
         else:
             graph = getattr(langgraph_handler, "graph")
             logger.debug("langgraph_handler.graph found: %s", type(graph))
             # await context.send_activity("I was able to find the hanlder and graph")
 
-        print(f"chat_history in on_message: {type(chat_history_store_item.chat_history)} = {chat_history_store_item.chat_history}")
-        response = await langgraph_handler.ainvoke_agent(context.activity.text, chat_history_store_item.chat_history)
-        print(f"chat_history at end of on_message: {type(chat_history_store_item.chat_history)} = {chat_history_store_item.chat_history}")
+        # Reply at once when overloaded rather than queue the turn behind the others
+        events: Events | None = app.get(keys.events)
+        if events is not None and not events.admit():
+            await context.send_activity("The agent is busy, please try again in a moment")
+            return
+
+        context.streaming_response.queue_informative_update("Working on a response for you...")
+
+        stream = ThrottledStream(context.streaming_response, config.bot.stream_interval.total_seconds()) if config.aiclient.streaming else None
+
+        response = await langgraph_handler.ainvoke_agent(
+            context.activity.conversation.id,
+            context.activity.from_property.id,
+            context.activity.text,
+            chat_history_store_item.chat_history,
+            on_token=stream.write if stream else None,
+        )
 
         state.set_value("ConversationState.chatHistory", chat_history_store_item)
 
-        await context.send_activity(response)
+        if stream:
+            await stream.close(response)
+        else:
+            await context.send_activity(response)
 
         # await context.send_activity("This is where you would integrate with the LLMConversationHandler.")
 
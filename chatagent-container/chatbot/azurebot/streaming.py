@@ -0,0 +1,55 @@
+from collections.abc import Callable
+import logging
+import time
+
+from microsoft_agents.hosting.aiohttp import StreamingResponse
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class ThrottledStream:
+    """
+    Buffers streamed tokens and forwards them to a StreamingResponse in chunks.
+
+    The StreamingResponse reprocesses the whole message on every queued chunk, so
+    tokens are collected and queued at most once per interval rather than one at a time.
+    """
+
+    def __init__(
+        self,
+        streaming_response: StreamingResponse,
+        interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.streaming_response = streaming_response
+        self.interval = interval
+        self.clock = clock
+        self.buffer: list[str] = []
+        self.last_flush = clock()
+        self.written = False
+
+    def write(self, text: str) -> None:
+        """Add streamed text, flushing if the interval has passed since the last chunk"""
+        self.buffer.append(text)
+        self.written = True
+        if self.clock() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Queue any buffered text as a single chunk"""
+        if self.buffer:
+            self.streaming_response.queue_text_chunk("".join(self.buffer))
+            self.buffer.clear()
+        self.last_flush = self.clock()
+
+    async def close(self, final_text: str) -> None:
+        """Send the remaining text and end the stream.
+
+        Args:
+            final_text: reply to send if nothing was streamed (eg the model did not stream or the turn failed)
+        """
+        if not self.written:
+            self.buffer.append(final_text)
+        self.flush()
+        await self.streaming_response.end_stream()
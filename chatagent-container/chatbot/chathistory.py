@@ -28,4 +28,6 @@ MessageType = Annotated[
 
 class ChatHistory(BaseModel):
     messages: list[MessageType] = []
+    # Summary of the turns before messages, when the conversation has been summarised
+    summary: str = ""
     current_tool_name: str = ""
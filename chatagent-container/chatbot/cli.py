@@ -73,16 +73,39 @@ def parse(ctx, config, secrets):
 @shared_options
 def start(ctx, config, secrets):
     """Start the service"""
-    from chatbot import app_start
+    from chatbot import app_start, startup_timings
 
-    configObj: ServiceConfig = ServiceConfig.from_yaml_and_secrets_dir(config.name, secrets)
+    timings = startup_timings()
+    with timings.phase("config"):
+        configObj: ServiceConfig = ServiceConfig.from_yaml_and_secrets_dir(config.name, secrets)
 
     # Load logging configuration from YAML file
     logging.config.dictConfig(configObj.logging)
 
     print(to_yaml_str(configObj, indent=2))
 
-    app_start(configObj)
+    app_start(configObj, timings)
+
+
+@cli.command("profile-startup")
+@shared_options
+@click.option("--stub/--no-stub", default=True, help="Remove the MCP servers and HaMS checks from the config to start without external services")
+@click.option("--min-import-ms", default=20.0, help="Only show imports taking at least this long including their own imports")
+def profile_startup(ctx, config, secrets, stub, min_import_ms):
+    """Profile the startup of the service, reporting the time of each phase and the slowest imports"""
+    import asyncio
+    from chatbot.startup import SERVICE_MODULES, import_times, profile_startup
+
+    timings = asyncio.run(profile_startup(config.name, secrets, stub=stub))
+
+    click.echo("Startup phases:")
+    for phase, seconds in timings.phases.items():
+        click.echo(f"  {phase:<16} {seconds:8.3f}s")
+
+    click.echo(f"Imports taking at least {min_import_ms}ms (cumulative, self):")
+    for module in import_times(*SERVICE_MODULES):
+        if module.cumulative_us >= min_import_ms * 1000:
+            click.echo(f"  {module.cumulative_us / 1000:9.1f}ms {module.self_us / 1000:8.1f}ms  {'  ' * module.depth}{module.module}")
 
 
 # ------------- CLI commands above here -------------
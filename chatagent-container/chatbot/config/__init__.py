@@ -49,6 +49,10 @@ class ChatBotConfig(BaseModel):
     azure_bot_client: AzureBotClientConfig = Field(
         description="Azure Bot Client configuration",
     )
+    stream_interval: timedelta = Field(
+        default=timedelta(milliseconds=250),
+        description="Minimum time between streamed chunks of a reply, streamed tokens are buffered in between",
+    )
 
 
 # TODO: Look here in future: https://github.com/pydantic/pydantic/discussions/2928#discussioncomment-4744841
@@ -70,6 +74,7 @@ class EventConfig(BaseModel):
     maxChunks: int = Field(description="Max number of chunks that can be processed after which cannot take more load")
     chunkDuration: timedelta = Field(description="Duration of events")
     checkTime: timedelta = Field(description="Time between checking for new events")
+    turnChunks: int = Field(default=1, gt=0, description="Chunks of capacity reserved by each conversation turn, turns are shed once maxChunks are reserved")
 
 
 class AIPromptConfig(BaseModel):
@@ -78,6 +83,32 @@ class AIPromptConfig(BaseModel):
     )
 
 
+class CheckpointConfig(BaseModel):
+    """
+    Limits for the in memory conversation checkpointer
+    """
+
+    max_threads: int = Field(default=1000, description="Maximum number of conversation threads held in memory")
+    idle_ttl: timedelta = Field(default=timedelta(hours=1), description="Conversation threads idle for longer than this are evicted")
+    max_bytes: int = Field(default=256 * 1024 * 1024, description="Approximate maximum serialised size of all conversation threads")
+    history_turns: int = Field(
+        default=10,
+        gt=0,
+        description="Number of recent turns kept in the bot storage, with the summary, to reseed a conversation the checkpointer has evicted",
+    )
+
+
+class SummaryConfig(BaseModel):
+    """
+    Rolling summarisation of long conversations
+    """
+
+    enabled: bool = Field(default=False, description="Whether to replace older turns of long conversations with a running summary")
+    trigger_messages: int = Field(default=40, description="Number of messages in a conversation after which older turns are summarised")
+    keep_messages: int = Field(default=10, description="Minimum number of recent messages kept verbatim when summarising")
+    max_concurrent: int = Field(default=2, description="Maximum number of summarisation calls to the LLM in flight at once")
+
+
 class MyAiConfig(BaseModel):
     """
     Configuration for the MyAI bot
@@ -91,6 +122,62 @@ class MyAiConfig(BaseModel):
         description="Default configuration for tool execution, including limits and enabled status",
     )
 
+    checkpoint: CheckpointConfig = Field(
+        default_factory=CheckpointConfig,
+        description="Limits for the conversation memory held by the graph checkpointer",
+    )
+
+    summary: SummaryConfig = Field(
+        default_factory=SummaryConfig,
+        description="Rolling summarisation of long conversations",
+    )
+
+
+class ResponseCacheConfig(BaseModel):
+    """
+    Cache of model responses for identical conversations, tools and model settings
+    """
+
+    enabled: bool = Field(default=False, description="Whether to answer repeated identical calls to the model from the cache")
+    max_entries: int = Field(default=1000, gt=0, description="Maximum number of responses held, the least recently used are evicted")
+    ttl: timedelta = Field(default=timedelta(hours=1), description="Responses older than this are not served")
+    allow_nondeterministic: bool = Field(
+        default=False,
+        description="Cache responses when the temperature is above 0, otherwise the cache is bypassed as the model would not repeat itself",
+    )
+
+
+class SemanticCacheConfig(BaseModel):
+    """
+    Cache of answers to first turn questions matched on the similarity of their embeddings, requires numpy
+    """
+
+    enabled: bool = Field(default=False, description="Whether to answer first turn questions similar to earlier ones from the cache")
+    threshold: float = Field(default=0.92, gt=0, le=1, description="Cosine similarity at or above which a cached answer is served")
+    max_entries: int = Field(default=1000, gt=0, description="Maximum number of answers held, the oldest are replaced")
+    ttl: timedelta = Field(default=timedelta(hours=1), description="Answers older than this are not served")
+    dimensions: int = Field(default=1024, gt=0, description="Dimensions of the vectors of the default hashing embedder")
+    ngram: int = Field(default=3, gt=0, description="Length of the character n-grams hashed by the default embedder")
+    cache_tool_answers: bool = Field(
+        default=False,
+        description="Cache answers the model gave after calling tools, the data they were built from may be stale when served",
+    )
+
+
+class LlmDeploymentConfig(BaseModel):
+    """
+    An Azure OpenAI deployment equivalent to the others, calls to the model are routed across the deployments
+    """
+
+    name: str = Field(description="Name of the deployment in logs and metrics")
+    azure_endpoint: HttpUrl = Field(description="Azure OpenAI endpoint of the deployment")
+    azure_api_key: SecretStr | None = Field(default=None, description="API key of the deployment, defaults to the azure_api_key of the aiclient")
+    azure_deployment: str | None = Field(default=None, description="Azure OpenAI deployment name, defaults to the azure_deployment of the aiclient")
+    azure_api_version: str | None = Field(default=None, description="API version of the deployment, defaults to the azure_api_version of the aiclient")
+    weight: float = Field(default=1.0, gt=0, description="Relative share of the calls, a deployment of weight 2 takes twice the load of one of weight 1")
+
+    model_config = ConfigDict(extra="forbid")
+
 
 class LangchainConfig(BaseModel):
     """
@@ -135,10 +222,55 @@ class LangchainConfig(BaseModel):
         description="Temperature for the model, controlling randomness in responses",
     )
     context_length: int = Field(default=4096, description="Maximum context length for the model")
+    context_fraction: float = Field(
+        default=0.75,
+        gt=0,
+        le=1,
+        description="Fraction of context_length that the conversation sent to the model is trimmed to, leaving room for the reply",
+    )
     stop_sequences: list[str] = Field(default_factory=list, description="List of sequences that will stop generation")
-    timeout: int = Field(default=60, description="Timeout in seconds for model API calls")
+    timeout: int = Field(default=60, description="Timeout in seconds for model API calls, the read timeout of the HTTP pool")
+    connect_timeout: float = Field(default=5, gt=0, description="Timeout in seconds to connect to the model API")
+
+    # Process wide HTTP connection pool for the model API
+    max_connections: int = Field(default=100, gt=0, description="Maximum connections to the model API, further calls queue for a connection")
+    max_keepalive_connections: int = Field(default=20, ge=0, description="Maximum idle connections kept open to the model API")
+    keepalive_expiry: float = Field(default=30, ge=0, description="Seconds an idle connection to the model API is kept open")
+    http2: bool = Field(default=False, description="Use HTTP/2 to the model API, requires httpx to be installed with the http2 extra")
+    max_concurrent_calls: int = Field(
+        default=16,
+        gt=0,
+        description="Maximum calls in flight to the model across the process, further calls queue with interactive turns ahead of summaries",
+    )
+
     streaming: bool = Field(default=True, description="Whether to stream responses from the model")
 
+    response_cache: ResponseCacheConfig = Field(
+        default_factory=ResponseCacheConfig,
+        description="Cache of model responses for repeated identical calls",
+    )
+
+    semantic_cache: SemanticCacheConfig = Field(
+        default_factory=SemanticCacheConfig,
+        description="Cache of answers to first turn questions similar to earlier ones",
+    )
+
+    # Routing across equivalent Azure OpenAI deployments
+    deployments: list[LlmDeploymentConfig] = Field(
+        default_factory=list,
+        description="Equivalent Azure OpenAI deployments to route calls across, used in place of azure_endpoint when given",
+    )
+    deployment_cooldown: float = Field(
+        default=30,
+        gt=0,
+        description="Seconds a deployment is taken out of routing after it throttles with a 429, unless it sends a Retry-After",
+    )
+    deployment_retries: int = Field(
+        default=2,
+        ge=0,
+        description="Retries of a routed call that fails with a connection error, timeout or 5xx, on another deployment when there is one",
+    )
+
     model_config = ConfigDict(extra="forbid")
 
     @field_validator("model_provider")
@@ -158,7 +290,7 @@ class ServiceConfig(BaseSettings):
     """
 
     logging: dict[str, Any] = Field(description="Logging configuration")
-    bot: ChatBotConfig = Field(description="Bot configuration")
+    bot: ChatBotConfig | None = Field(default=None, description="Bot configuration, the Azure bot is not started without it")
     aiclient: LangchainConfig = Field(description="AI Client configuration")
     myai: MyAiConfig = Field(description="MyAI bot configuration")
 
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from pathlib import Path
 from pydantic import BaseModel, Field, field_validator
 from pydantic import HttpUrl
 from enum import Enum
@@ -17,6 +18,17 @@ class ToolModeEnum(str, Enum):
     dynamic = "dynamic"
 
 
+class ToolCacheConfig(BaseModel):
+    """Configuration of the result cache for an idempotent tool."""
+
+    ttl: timedelta = Field(description="How long a tool result is reused for calls with the same arguments")
+    max_entries: int = Field(default=1000, gt=0, description="Maximum number of results cached for the tool, least recently used are evicted")
+    include_identity: bool = Field(
+        default=False,
+        description="Cache results per user identity, required if the tool result depends on who is asking",
+    )
+
+
 class ToolConfig(BaseModel):
     """Configuration for tool execution."""
 
@@ -27,8 +39,30 @@ class ToolConfig(BaseModel):
         description="Maximum number of concurrent instances for this tool",
     )
 
+    max_queue: int = Field(
+        default=50,
+        description="Maximum number of calls waiting for an instance of this tool, further calls are rejected",
+    )
+
     timeout: timedelta = Field(default=timedelta(seconds=30), description="Timeout for tool execution")
 
+    cache: ToolCacheConfig | None = Field(default=None, description="Cache results of the tool, only for tools without side effects")
+
+    coalesce: bool = Field(
+        default=False,
+        description="Merge concurrent calls with identical arguments into one invocation, only for tools without side effects (implied by cache)",
+    )
+
+
+class McpPoolConfig(BaseModel):
+    """Configuration of the persistent sessions held open to an MCP server"""
+
+    size: int = Field(default=4, gt=0, description="Maximum number of sessions open to the MCP server, calls beyond this wait for a free session")
+    keepalive: timedelta = Field(
+        default=timedelta(seconds=30),
+        description="Idle sessions are pinged after this long unused, sessions failing the ping are closed and reopened on demand",
+    )
+
 
 class McpConfig(BaseModel):
     """Configuration of MCP Endpoints"""
@@ -41,6 +75,18 @@ class McpConfig(BaseModel):
 
     mode: ToolModeEnum = Field(description="Mode for handling tools: 'strict' requires all tools to be configured, 'dynamic' uses defaults for unconfigured tools")
 
+    pool: McpPoolConfig = Field(default_factory=McpPoolConfig, description="Persistent session pool for calls to the MCP server")
+
+    startup_timeout: timedelta = Field(
+        default=timedelta(seconds=30),
+        description="Time allowed at startup to discover the MCP server's tools, resources and prompts",
+    )
+
+    tool_refresh: timedelta | None = Field(
+        default=timedelta(minutes=5),
+        description="Interval to poll the MCP server for changes to its tools, as well as reloading on tools/list_changed notifications. None only reloads on notifications",
+    )
+
     default_tool_config: ToolConfig | None = Field(
         default=None,
         description="Default configuration for tools not explicitly listed (required if mode is 'dynamic')",
@@ -63,3 +109,8 @@ class ToolBoxConfig(BaseModel):
     max_concurrent: int = Field(description="Default maximum number of concurrent instances for tools")
 
     mcps: list[McpConfig] = Field(description="MCP configuration")
+
+    snapshot_dir: Path | None = Field(
+        default=None,
+        description="Directory to keep a snapshot of each MCP server's tools in, a restart binds from the snapshot while the server is revalidated in the background. None disables snapshots",
+    )
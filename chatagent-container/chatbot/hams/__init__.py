@@ -10,6 +10,7 @@ from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from prometheus_client import Summary
 from prometheus_client import Info
 import importlib.metadata
+from chatbot.startup import startup_phase
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -37,7 +38,8 @@ async def hams_app_cleanup(app: web.Application):
 
     logger.info("Executing startup scripts")
     logger.debug(f"prestart = {app[keys.config].hams.checks}")
-    await app[keys.config].hams.checks.run_preflights()
+    with startup_phase(app, "preflights"):
+        await app[keys.config].hams.checks.run_preflights()
 
     yield
 
@@ -132,8 +134,14 @@ class Hams:
         return True
 
     def ready(self) -> bool:
-        return True
-        return self.app[keys.events].spareCapacity()
+        # Not ready until the graph is compiled, MCP discovery and compilation run in the background
+        handler = self.app.get(keys.langgraph_handler)
+        if handler is None or not handler.ready:
+            return False
+
+        # An overloaded pod is taken out of the load balancer until its reserved capacity is processed
+        events = self.app.get(keys.events)
+        return events is None or events.spareCapacity()
 
 
 def hams_app_create(base_app: web.Application, config: HamsConfig) -> web.Application:
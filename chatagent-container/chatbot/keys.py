@@ -22,3 +22,12 @@ agent_app = aiohttp.web.AppKey("agent_app")
 langgraph_handler = aiohttp.web.AppKey("langgraph_handler")
 
 mcpobjects = aiohttp.web.AppKey("mcptools")
+
+# Process wide HTTP clients for the model API
+llm_http_client = aiohttp.web.AppKey("llm_http_client")
+
+# Background startup tasks, MCP discovery then binding the tools and compiling the graph
+mcp_discovery = aiohttp.web.AppKey("mcp_discovery")
+graph_startup = aiohttp.web.AppKey("graph_startup")
+
+startup_timings = aiohttp.web.AppKey("startup_timings")
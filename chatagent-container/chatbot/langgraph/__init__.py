@@ -1,16 +1,26 @@
-from chatbot.config import ServiceConfig, LangchainConfig
+from chatbot.config import ServiceConfig, LangchainConfig, LlmDeploymentConfig
 from aiohttp import web
 from chatbot import keys
 from chatbot.langgraph.handler import LanggraphHandler
+from chatbot.langgraph.httpclient import LlmHttpClient
+from chatbot.langgraph.router import Deployment, LlmRouter
 from chatbot.langgraph.toolregistry import ToolRegistrationContext
-from chatbot.mcp_client import MCPObjects
+from chatbot.config.tool import McpConfig
+from chatbot.hams import shutdownSig
+from chatbot.startup import startup_phase, startup_reached
+from prometheus_client import CollectorRegistry
 
 
 from chatbot.tools import mytools
-import httpx
 
+from typing import TYPE_CHECKING
+import asyncio
 import logging
 
+if TYPE_CHECKING:
+    # Only imported by mcp_app_create when MCP servers are configured
+    from chatbot.mcp_client import MCPObjects
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
@@ -19,66 +29,199 @@ async def bind_tools_when_ready(app: web.Application):
     """
     Wait for the mcptools to be constructed then bind to them
     """
-    # TODO: Do we need to wait for the mcpobjects to be ready?
-    # This is called on startup, so we expect the mcpobjects to be set by
-    # the mcp_app_create function before this is called.
+    # The MCP discovery runs in the background, started by mcp_app_create when MCP servers are configured
+    if keys.mcp_discovery in app:
+        await app[keys.mcp_discovery]
+
+    config: ServiceConfig = app[keys.config]
+    langgraph_handler: LanggraphHandler = app[keys.langgraph_handler]
 
-    if keys.mcpobjects not in app:
+    if config.myai.toolbox.mcps and keys.mcpobjects not in app:
         # If the mcpobjects key is not in the app, we cannot proceed
         logger.error("MCPObjects not found in app context. Cannot bind tools.")
         raise ValueError("MCPObjects not found in app context.")
 
-    config: ServiceConfig = app[keys.config]
-    langgraph_handler: LanggraphHandler = app[keys.langgraph_handler]
-    mcpObjects: MCPObjects = app[keys.mcpobjects]
-
     # Register tools from each MCP server with appropriate context
     for mcp_config in config.myai.toolbox.mcps:
-        mcp_tools = mcpObjects.get_tools_for_mcp(mcp_config.name)
+        mcp_tools = app[keys.mcpobjects].get_tools_for_mcp(mcp_config.name)
 
         if not mcp_tools:
             logger.debug(f"No tools to register from MCP '{mcp_config.name}'")
             continue
 
-        # Create context for this MCP
-        mcp_context = ToolRegistrationContext(
-            source="mcp",
-            mcp_name=mcp_config.name,
-            mcp_mode=mcp_config.mode,
-            default_config=mcp_config.default_tool_config,
-        )
-
         logger.info(f"Registering {len(mcp_tools)} tools from MCP '{mcp_config.name}' " f"in {mcp_config.mode.value} mode")
 
-        langgraph_handler.register_tools(mcp_tools, context=mcp_context)
+        langgraph_handler.register_tools(mcp_tools, context=mcp_registration_context(mcp_config))
+
+    if config.myai.toolbox.mcps:
+        langgraph_handler.set_instructions(mcp_instructions(app[keys.mcpobjects], config.myai.toolbox.mcps))
+
+    with startup_phase(app, "bind_tools"):
+        langgraph_handler.bind_tools()
+    with startup_phase(app, "compile"):
+        langgraph_handler.compile()
+
+
+def mcp_instructions(mcpObjects: "MCPObjects", mcps: list[McpConfig]) -> list[str]:
+    """
+    Text of the configured prompts of the MCP servers, in the order they are configured so the instructions are stable
+    """
+    return [message.text for mcp in mcps for prompt in mcp.prompts for message in mcpObjects.prompts.get(mcp.name, {}).get(prompt, [])]
+
+
+def mcp_registration_context(mcp_config: McpConfig) -> ToolRegistrationContext:
+    """
+    Context to register the tools of an MCP server with
+    """
+    return ToolRegistrationContext(
+        source="mcp",
+        mcp_name=mcp_config.name,
+        mcp_mode=mcp_config.mode,
+        default_config=mcp_config.default_tool_config,
+    )
+
+
+async def watch_mcp_tools(app: web.Application, mcp_config: McpConfig):
+    """
+    Reload the tools of an MCP server when it announces they changed, or when polling finds they changed,
+    and swap in a graph compiled with them.
+    A reload that fails keeps the current tools and is retried at the next change or poll.
+    """
+    from chatbot.mcp_client import load_changed_tools
+
+    langgraph_handler: LanggraphHandler = app[keys.langgraph_handler]
+    mcpObjects: "MCPObjects" = app[keys.mcpobjects]
+    pool = mcpObjects.sessions.get(mcp_config.name)
+    refresh = mcp_config.tool_refresh.total_seconds() if mcp_config.tool_refresh is not None else None
+
+    while True:
+        await pool.wait_tools_changed(refresh)
+
+        # Prompts of servers started from a tool snapshot arrive with their revalidation
+        config: ServiceConfig = app[keys.config]
+        langgraph_handler.set_instructions(mcp_instructions(mcpObjects, config.myai.toolbox.mcps))
+
+        try:
+            mcp_tools = await load_changed_tools(mcpObjects, mcp_config)
+            if mcp_tools is None:
+                langgraph_handler.tool_reload_metric.labels(mcp_config.name, "unchanged").inc()
+                continue
+
+            langgraph_handler.reload_tools(mcp_tools, context=mcp_registration_context(mcp_config))
+            mcpObjects.set_tools_for_mcp(mcp_config.name, mcp_tools)
+        except Exception as e:
+            logger.error(f"Failed to reload tools from MCP '{mcp_config.name}', keeping the current tools: {e}")
+            langgraph_handler.tool_reload_metric.labels(mcp_config.name, "error").inc()
+            continue
+
+        logger.info(f"Reloaded {len(mcp_tools)} tools from MCP '{mcp_config.name}'")
+        langgraph_handler.tool_reload_metric.labels(mcp_config.name, "reloaded").inc()
+
+
+def startup_failed(task: asyncio.Task):
+    """
+    Stop the service if the graph could not be built, it cannot serve without its MCP tools
+    """
+    if task.cancelled() or task.exception() is None:
+        return
+
+    logger.error(f"Startup failed, shutting down: {task.exception()}")
+    shutdownSig()
+
+
+async def startup_in_background(app: web.Application):
+    """
+    Bind the tools and compile the graph in the background once MCP discovery completes,
+    then keep watching the MCP servers for changes to their tools.
+    HaMS reports not ready until the graph is compiled.
+    """
+
+    async def startup():
+        await bind_tools_when_ready(app)
+        startup_reached(app, "graph_ready")
+
+        config: ServiceConfig = app[keys.config]
+        await asyncio.gather(*[watch_mcp_tools(app, mcp_config) for mcp_config in config.myai.toolbox.mcps])
+
+    app[keys.graph_startup] = asyncio.create_task(startup())
+    app[keys.graph_startup].add_done_callback(startup_failed)
+
+    yield
+
+    app[keys.graph_startup].cancel()
+    await asyncio.gather(app[keys.graph_startup], return_exceptions=True)
+
+
+async def close_langgraph_handler(app: web.Application):
+    """
+    Stop background work of the langgraph handler
+    """
+    await app[keys.langgraph_handler].aclose()
 
-    langgraph_handler.bind_tools()
-    langgraph_handler.compile()
 
+async def close_llm_http_client(app: web.Application):
+    """
+    Close the connections to the model API, after the handler has stopped calling it
+    """
+    await app[keys.llm_http_client].aclose()
+
+
+def azure_model(config: LangchainConfig, http_client: LlmHttpClient, deployment: LlmDeploymentConfig | None = None, **kwargs):
+    """
+    Create the Azure OpenAI chat model, for the deployment if given else for the endpoint of the config
+    """
+    from langchain_openai import AzureChatOpenAI
+
+    if deployment is None:
+        deployment = LlmDeploymentConfig(name="default", azure_endpoint=config.azure_endpoint)
+
+    api_key = deployment.azure_api_key or config.azure_api_key
+
+    # https://python.langchain.com/api_reference/openai/llms/langchain_openai.llms.azure.AzureOpenAI.html#langchain_openai.llms.azure.AzureOpenAI.http_client
+    return AzureChatOpenAI(
+        model=config.model,
+        azure_endpoint=str(deployment.azure_endpoint),
+        azure_deployment=deployment.azure_deployment or config.azure_deployment,
+        api_version=deployment.azure_api_version or config.azure_api_version,
+        api_key=api_key.get_secret_value(),
+        temperature=config.temperature,
+        # Report usage, including the tokens read from the prompt cache, when streaming too
+        stream_usage=True,
+        timeout=http_client.timeout,
+        http_client=http_client.client,
+        http_async_client=http_client.async_client,
+        **kwargs,
+    )
+
+
+def llm_model(config: LangchainConfig, http_client: LlmHttpClient | None = None, registry: CollectorRegistry | None = None):
+    """
+    Create the chat model of the provider, calling it through the process wide HTTP clients.
+    When deployments are configured the model is a router across them.
+    """
+    http_client = http_client or LlmHttpClient(config, registry=None)
 
-def llm_model(config: LangchainConfig):
-    httpx_client = httpx.Client(verify=config.httpx_verify_ssl)
+    if config.deployments and config.model_provider != "azure_openai":
+        raise ValueError(f"Routing across deployments is only supported for azure_openai, not {config.model_provider}")
 
     match config.model_provider:
         case "google_genai":
             from langchain_google_genai import ChatGoogleGenerativeAI
 
+            # The async Gemini client calls over gRPC rather than httpx, so only the timeout applies to it
             model = ChatGoogleGenerativeAI(
                 model=config.model,
                 google_api_key=config.google_api_key.get_secret_value(),
-                # http_client=httpx_client,
+                temperature=config.temperature,
+                timeout=config.timeout,
             )
+        case "azure_openai" if config.deployments:
+            # The router retries in place of the clients, moving a throttled or failed call to another deployment
+            # rather than retrying the same one
+            deployments = [Deployment(deployment.name, azure_model(config, http_client, deployment, max_retries=0), weight=deployment.weight) for deployment in config.deployments]
+            model = LlmRouter(deployments, cooldown=config.deployment_cooldown, registry=registry, max_retries=config.deployment_retries)
         case "azure_openai":
-            from langchain_openai import AzureChatOpenAI
-
-            # https://python.langchain.com/api_reference/openai/llms/langchain_openai.llms.azure.AzureOpenAI.html#langchain_openai.llms.azure.AzureOpenAI.http_client
-            model = AzureChatOpenAI(
-                model=config.model,
-                azure_endpoint=str(config.azure_endpoint),
-                api_version=config.azure_api_version,
-                api_key=config.azure_api_key.get_secret_value(),
-                http_client=httpx_client,
-            )
+            model = azure_model(config, http_client)
         case _:
             raise ValueError(f"Unsupported model provider: {config.model_provider}")
 
@@ -93,15 +236,20 @@ def langgraph_app_create(app: web.Application, config: ServiceConfig):
         logger.error("Metrics registry not found in app context. Cannot initialize LLMConversationHandler.")
         raise ValueError("Metrics registry not found in app context.")
 
-    model = llm_model(config.aiclient)
+    app[keys.llm_http_client] = LlmHttpClient(config.aiclient, registry=app[keys.metrics])
+    model = llm_model(config.aiclient, app[keys.llm_http_client], registry=app[keys.metrics])
 
     # use bind_tools_when_ready to move some of the constructions funtions to an async runtime
-    app.on_startup.append(bind_tools_when_ready)
+    # it runs in the background so the service does not wait on the MCP servers to start listening
+    app.cleanup_ctx.append(startup_in_background)
 
-    langgraph_handler = LanggraphHandler(config.myai, model, registry=app[keys.metrics])
+    langgraph_handler = LanggraphHandler(config.myai, model, registry=app[keys.metrics], llm_config=config.aiclient)
 
     # Register local tools with strict mode context
     local_context = ToolRegistrationContext(source="local")
     langgraph_handler.register_tools(mytools, context=local_context)
 
     app[keys.langgraph_handler] = langgraph_handler
+
+    app.on_cleanup.append(close_langgraph_handler)
+    app.on_cleanup.append(close_llm_http_client)
@@ -1,8 +1,33 @@
 from typing import Annotated
+import uuid
 from chatbot.chathistory import ChatHistory
 from langchain.messages import AnyMessage
+from langchain_core.messages import RemoveMessage, convert_to_messages, message_chunk_to_message
 from langgraph.graph.message import add_messages
-from pydantic import BaseModel
+from pydantic import BaseModel, SkipValidation
+
+
+def append_messages(left: list[AnyMessage], right: list[AnyMessage] | AnyMessage) -> list[AnyMessage]:
+    """
+    Reducer for the conversation where nodes only emit the messages they add.
+
+    New messages are appended without revisiting the existing history so the cost of a graph
+    step depends on the size of the update, not the length of the conversation.
+    Updates that contain a RemoveMessage are delegated to add_messages, so to replace a message
+    remove it and add the new version.
+    """
+    if not isinstance(right, list):
+        right = [right]
+    right = [message_chunk_to_message(message) for message in convert_to_messages(right)]
+
+    if any(isinstance(message, RemoveMessage) for message in right):
+        return add_messages(left, right)
+
+    for message in right:
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+
+    return left + right
 
 
 class AgentState(BaseModel):
@@ -10,10 +35,13 @@ class AgentState(BaseModel):
     Represents the state of our graph.
 
     Attributes:
-        messages: The list of messages that have been exchanged in the conversation.
+        messages: The list of messages that have been exchanged in the conversation, nodes return only new messages.
+        summary: Running summary of earlier messages that have been removed from the conversation.
     """
 
-    messages: Annotated[list[AnyMessage], add_messages]
+    # Messages are normalised by the reducer so pydantic does not revalidate the whole history on every step
+    messages: Annotated[SkipValidation[list[AnyMessage]], append_messages]
+    summary: str = ""
 
     @classmethod
     def from_chat_history(cls, chat_history: ChatHistory) -> "AgentState":
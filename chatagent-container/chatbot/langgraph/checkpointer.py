@@ -0,0 +1,219 @@
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from typing import Any
+import logging
+import time
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+from chatbot.config import CheckpointConfig
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    In memory checkpointer with a bounded footprint.
+
+    Threads are tracked in least-recently-used order and evicted when there are
+    more than max_threads resident, when the approximate serialised size of all
+    threads exceeds max_bytes or when a thread has been idle for longer than idle_ttl.
+    The thread currently being written and threads pinned while a turn runs on them are never
+    evicted, as with durability "exit" the final put of a turn only writes the channels it changed.
+
+    Only the latest checkpoint of a thread is ever read, so each put drops the earlier
+    checkpoints of the thread with their writes and the blobs no longer referenced.
+    A thread therefore holds one copy of its state rather than one per turn.
+    """
+
+    def __init__(
+        self,
+        config: CheckpointConfig,
+        registry: CollectorRegistry | None = REGISTRY,
+        clock: Callable[[], float] = time.monotonic,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.config = config
+        self.clock = clock
+
+        # thread_id -> last access time, ordered oldest first
+        self.last_access: OrderedDict[str, float] = OrderedDict()
+        self.thread_bytes: dict[str, int] = {}
+        self.total_bytes = 0
+        # Keys owned by each thread so eviction does not have to scan every write and blob
+        self.thread_blob_keys: dict[str, set[tuple]] = {}
+        self.thread_write_keys: dict[str, set[tuple]] = {}
+        # thread_id -> number of turns running on it
+        self.pinned: dict[str, int] = {}
+
+        self.eviction_metric = Counter(
+            "checkpoint_evictions",
+            "Count of conversation threads evicted from the checkpointer",
+            ["reason"],
+            registry=registry,
+        )
+        self.threads_metric = Gauge("checkpoint_threads", "Number of conversation threads resident in the checkpointer", registry=registry)
+        self.bytes_metric = Gauge("checkpoint_bytes", "Approximate serialised bytes resident in the checkpointer", registry=registry)
+
+    def pin(self, thread_id: str) -> None:
+        """Protect a thread from eviction while a turn runs on it"""
+        self.pinned[thread_id] = self.pinned.get(thread_id, 0) + 1
+
+    def unpin(self, thread_id: str) -> None:
+        self.pinned[thread_id] -= 1
+        if not self.pinned[thread_id]:
+            del self.pinned[thread_id]
+
+    def _touch(self, thread_id: str) -> None:
+        self.last_access[thread_id] = self.clock()
+        self.last_access.move_to_end(thread_id)
+
+    def _account(self, thread_id: str, size: int) -> None:
+        self.thread_bytes[thread_id] = self.thread_bytes.get(thread_id, 0) + size
+        self.total_bytes += size
+
+    def _update_metrics(self) -> None:
+        self.threads_metric.set(len(self.last_access))
+        self.bytes_metric.set(self.total_bytes)
+
+    def _drop_thread(self, thread_id: str) -> None:
+        """Remove every checkpoint, write and blob held for a thread"""
+        self.storage.pop(thread_id, None)
+        for key in self.thread_blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+        for key in self.thread_write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+
+        self.total_bytes -= self.thread_bytes.pop(thread_id, 0)
+        self.last_access.pop(thread_id, None)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Drop the checkpoints of a namespace before the latest, their writes and the blobs only they reference"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        latest = max(checkpoints)
+        size = 0
+
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id != latest]:
+            saved_checkpoint, saved_metadata, _ = checkpoints.pop(checkpoint_id)
+            size += len(saved_checkpoint[1]) + len(saved_metadata[1])
+            outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+            writes = self.writes.pop(outer_key, None)
+            if writes is not None:
+                size += sum(len(value[2][1]) for value in writes.values())
+            self.thread_write_keys.get(thread_id, set()).discard(outer_key)
+
+        versions = self.serde.loads_typed(checkpoints[latest][0])["channel_versions"]
+        blob_keys = self.thread_blob_keys.get(thread_id, set())
+        for key in [key for key in blob_keys if key[1] == checkpoint_ns and versions.get(key[2]) != key[3]]:
+            blob_keys.discard(key)
+            blob = self.blobs.pop(key, None)
+            if blob is not None:
+                size += len(blob[1])
+
+        self._account(thread_id, -size)
+
+    def _evict(self, reason: str, thread_id: str) -> None:
+        logger.debug(f"Evicting checkpoint thread {thread_id} ({reason})")
+        self._drop_thread(thread_id)
+        self.eviction_metric.labels(reason).inc()
+
+    def evict(self, keep: str | None = None) -> None:
+        """Evict threads until the configured limits are satisfied.
+
+        Args:
+            keep: thread that must survive eviction (the one currently in use), pinned threads also survive
+        """
+        idle_ttl = self.config.idle_ttl.total_seconds()
+        cutoff = self.clock() - idle_ttl
+
+        def evictable(thread_id: str) -> bool:
+            return thread_id != keep and thread_id not in self.pinned
+
+        # Idle threads first, the oldest are at the front of the ordered dict
+        idle = []
+        for thread_id, last_access in self.last_access.items():
+            if last_access > cutoff:
+                break
+            if evictable(thread_id):
+                idle.append(thread_id)
+        for thread_id in idle:
+            self._evict("idle", thread_id)
+
+        while len(self.last_access) > self.config.max_threads:
+            victim = next((t for t in self.last_access if evictable(t)), None)
+            if victim is None:
+                break
+            self._evict("threads", victim)
+
+        while self.total_bytes > self.config.max_bytes:
+            victim = next((t for t in self.last_access if evictable(t)), None)
+            if victim is None:
+                break
+            self._evict("bytes", victim)
+
+        self._update_metrics()
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id not in self.last_access:
+            # Avoid the defaultdict in the base class creating entries for unknown threads
+            return None
+        self._touch(thread_id)
+        return super().get_tuple(config)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+        result = super().put(config, checkpoint, metadata, new_versions)
+
+        blob_keys = self.thread_blob_keys.setdefault(thread_id, set())
+        size = 0
+        for channel, version in new_versions.items():
+            key = (thread_id, checkpoint_ns, channel, version)
+            blob_keys.add(key)
+            size += len(self.blobs[key][1])
+        saved_checkpoint, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+        size += len(saved_checkpoint[1]) + len(saved_metadata[1])
+
+        self._account(thread_id, size)
+        self._prune(thread_id, checkpoint_ns)
+        self._touch(thread_id)
+        self.evict(keep=thread_id)
+
+        return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+
+        before = sum(len(value[2][1]) for value in self.writes.get(outer_key, {}).values())
+        super().put_writes(config, writes, task_id, task_path)
+        after = sum(len(value[2][1]) for value in self.writes.get(outer_key, {}).values())
+
+        self.thread_write_keys.setdefault(thread_id, set()).add(outer_key)
+        self._account(thread_id, after - before)
+        self._touch(thread_id)
+        self._update_metrics()
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._drop_thread(thread_id)
+        self._update_metrics()
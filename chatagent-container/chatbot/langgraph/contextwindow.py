@@ -0,0 +1,132 @@
+from collections.abc import Sequence
+import logging
+
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from prometheus_client import REGISTRY, CollectorRegistry, Summary
+
+logger = logging.getLogger(__name__)
+
+# Key used to cache the token count of a message in its response_metadata.
+# response_metadata is persisted by the checkpointer but not sent to the model.
+TOKEN_COUNT_KEY = "chatbot_token_count"
+PREFIX_TOKENS_KEY = "chatbot_prefix_tokens"
+
+
+def message_tokens(message: AnyMessage) -> int:
+    """Token count for a single message, cached on the message so it is only computed once"""
+    cached = message.response_metadata.get(TOKEN_COUNT_KEY)
+    if cached is not None:
+        return cached
+
+    tokens = count_tokens_approximately([message])
+    message.response_metadata[TOKEN_COUNT_KEY] = tokens
+    return tokens
+
+
+def prefix_tokens(messages: Sequence[AnyMessage], end: int) -> int:
+    """Tokens in messages[:end].
+
+    The running total is cached on messages[end - 1] together with the id of the first message,
+    so later calls only count the messages added since. Conversations only lose messages from the
+    front (summarisation) which changes the first message and invalidates the cached totals.
+    """
+    if end == 0:
+        return 0
+
+    origin = messages[0].id
+    total = 0
+    index = end
+    while index > 0:
+        cached = messages[index - 1].response_metadata.get(PREFIX_TOKENS_KEY)
+        if cached is not None and cached[0] == origin:
+            total += cached[1]
+            break
+        total += message_tokens(messages[index - 1])
+        index -= 1
+
+    messages[end - 1].response_metadata[PREFIX_TOKENS_KEY] = (origin, total)
+    return total
+
+
+def message_blocks(messages: Sequence[AnyMessage]) -> list[list[AnyMessage]]:
+    """Group messages so that tool results stay with the AI message that requested them"""
+    blocks: list[list[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and blocks:
+            blocks[-1].append(message)
+        else:
+            blocks.append([message])
+    return blocks
+
+
+class ContextWindow:
+    """
+    Trims the conversation sent to the model so that it fits a token budget.
+
+    Leading system messages are always kept. The rest of the conversation is kept
+    newest first in whole blocks (an AI tool call plus its tool results is one block)
+    until the budget is used. The most recent block is always kept, even if it alone
+    exceeds the budget, so the model always sees the latest prompt.
+    """
+
+    def __init__(
+        self,
+        context_length: int,
+        fraction: float,
+        registry: CollectorRegistry | None = REGISTRY,
+    ):
+        self.budget = int(context_length * fraction)
+        self.tokens_sent_metric = Summary("context_tokens_sent", "Estimated prompt tokens sent to the LLM per call", registry=registry)
+        self.tokens_dropped_metric = Summary("context_tokens_dropped", "Estimated prompt tokens trimmed from the context per call", registry=registry)
+
+    def trim(self, messages: Sequence[AnyMessage], reserved: int = 0) -> list[AnyMessage]:
+        """Select the messages to send to the model.
+        Only the messages that are kept (and any added since the last call) are visited, so the cost
+        does not grow with the length of the conversation.
+
+        Args:
+            messages: The full conversation
+            reserved: Tokens already committed elsewhere in the prompt (eg a system prefix)
+
+        Returns:
+            The messages that fit in the budget, in their original order
+        """
+        start = 0
+        while start < len(messages) and isinstance(messages[start], SystemMessage):
+            start += 1
+        system_tokens = sum(message_tokens(message) for message in messages[:start])
+
+        remaining = self.budget - reserved - system_tokens
+
+        # Walk back over whole blocks, messages[cut:] are kept
+        cut = len(messages)
+        human_cut = None
+        while cut > start:
+            block_start = cut - 1
+            while block_start > start and isinstance(messages[block_start], ToolMessage):
+                block_start -= 1
+
+            block_tokens = sum(message_tokens(message) for message in messages[block_start:cut])
+            if cut < len(messages) and block_tokens > remaining:
+                break
+            remaining -= block_tokens
+            cut = block_start
+            if isinstance(messages[cut], HumanMessage):
+                human_cut = cut
+
+        # Start the window on a user turn where possible so providers see a well formed conversation
+        if cut > start and human_cut is not None:
+            cut = human_cut
+
+        selected = list(messages[:start]) + list(messages[cut:])
+
+        sent = system_tokens + sum(message_tokens(message) for message in messages[cut:])
+        dropped = prefix_tokens(messages, cut) - prefix_tokens(messages, start)
+        self.tokens_sent_metric.observe(sent)
+        self.tokens_dropped_metric.observe(dropped)
+
+        if cut > start:
+            logger.debug(f"Context trimmed from {len(messages)} to {len(selected)} messages ({dropped} tokens dropped)")
+
+        return selected
@@ -1,30 +1,47 @@
-from collections.abc import Sequence
+from collections.abc import Callable, Sequence
 from chatbot.chathistory import ChatHistory
 from langchain_core.messages import (
+    AnyMessage,
     HumanMessage,
     AIMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
 )
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
 
 
 from langgraph.graph import StateGraph, END, START
-from prometheus_client import REGISTRY, CollectorRegistry, Summary
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Summary
 import langgraph
-from langgraph.checkpoint.memory import InMemorySaver
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import ToolNode
 from langchain_core.tools.structured import StructuredTool
 
 from .agentstate import AgentState
+from .checkpointer import BoundedMemorySaver
+from .contextwindow import ContextWindow, message_tokens
+from .limiter import LlmLimiter, Priority
+from .responsecache import ResponseCache
+from .summariser import ConversationSummariser
 
 from chatbot.langgraph import toolregistry
-from chatbot.config import MyAiConfig
+from chatbot.config import LangchainConfig, MyAiConfig
 
+from contextlib import nullcontext
+import asyncio
 import logging
+import time
+import uuid
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Checkpoint the conversation once at the end of a turn rather than after every step.
+# Each checkpoint serialises the whole conversation so per step checkpoints make every step O(history).
+GRAPH_DURABILITY = "exit"
+
 
 class LanggraphHandler:
     """
@@ -45,34 +62,45 @@ class LanggraphHandler:
         config: MyAiConfig,
         client: BaseChatModel,
         registry: CollectorRegistry | None = REGISTRY,
+        llm_config: LangchainConfig | None = None,
+        embedder: Embeddings | None = None,
     ):
         self.config = config
+        self.llm_config = llm_config
         self.function_registry = toolregistry.ToolRegistry(config.toolbox, registry=registry)
+        # The model without tools, each bind_tools binds the current tools to it
+        self.model = client
         self.client = client
         self.llm_summary_metric = Summary("llm_usage", "Summary of LLM usage", registry=registry)
+        self.input_tokens_metric = Counter("llm_input_tokens", "Count of input tokens sent to the LLM", registry=registry)
+        self.cached_tokens_metric = Counter("llm_cached_input_tokens", "Count of input tokens the LLM provider read from its prompt cache", registry=registry)
+        self.first_token_metric = Summary("llm_first_token", "Time from the start of a turn to the first streamed token", registry=registry)
+        self.tool_reload_metric = Counter("mcp_tool_reloads", "Count of checks for changed MCP tools by result", ["mcp_server", "result"], registry=registry)
+        self.streaming = llm_config.streaming if llm_config else False
+        self.context_window = ContextWindow(llm_config.context_length, llm_config.context_fraction, registry=registry) if llm_config else None
+        # Calls to the model from every conversation share the limit, summaries wait behind turns
+        self.limiter = LlmLimiter(llm_config.max_concurrent_calls, registry=registry) if llm_config else None
+        # Summaries use the model before tools are bound to it
+        self.summariser = ConversationSummariser(config.summary, client, registry=registry, limiter=self.limiter) if config.summary.enabled else None
 
-        # Initialize the graph
-        workflow = StateGraph(AgentState)
-        workflow.add_node("chatbot", self._call_llm)
-        # workflow.add_node("my_tools", self._call_tool)
+        # Conversations with a turn running on the graph and conversations with a summary pending
+        self.active_threads: dict[str, int] = {}
+        self.pending_summaries: set[str] = set()
+        self.background_tasks: set[asyncio.Task] = set()
 
-        workflow.add_edge(START, "chatbot")
-        workflow.add_edge("my_tools", "chatbot")
-        workflow.add_edge("chatbot", END)
+        self.memory = BoundedMemorySaver(config.checkpoint, registry=registry)
 
-        # Add edges
-        workflow.add_conditional_edges(
-            "chatbot",
-            self._should_call_tool,
-            {
-                "call_tool": "my_tools",
-                END: END,
-            },
-        )
+        self.response_cache = ResponseCache(llm_config, registry=registry) if llm_config and llm_config.response_cache.enabled else None
+
+        self.semantic_cache = None
+        if llm_config and llm_config.semantic_cache.enabled:
+            # Imported only when enabled as it requires numpy
+            from .semanticcache import SemanticCache
 
-        self.workflow = workflow
+            self.semantic_cache = SemanticCache(llm_config.semantic_cache, embedder, registry=registry)
 
-        self.memory = InMemorySaver()
+        self.instructions: SystemMessage | None = None
+        self.set_instructions()
 
     @staticmethod
     def get_graph_config(conversation_id: str, **kwargs) -> RunnableConfig:
@@ -92,28 +120,139 @@ class LanggraphHandler:
         # return config_dict
         return RunnableConfig(configurable={"thread_id": conversation_id, **kwargs})
 
-    async def _call_llm(self, state: AgentState) -> dict:
+    def _build_workflow(self, client: BaseChatModel, toolnode: ToolNode) -> StateGraph:
+        """
+        Builds the graph for the given bound model and tools.
+        Each compile builds a new graph so turns running on an earlier graph keep its model and tools.
+        """
+
+        async def call_llm(state: AgentState, config: RunnableConfig) -> dict:
+            # Carried as a plain int as the configurable is written to the checkpoint metadata
+            return await self._call_llm(state, client, Priority(config["configurable"].get("priority", Priority.interactive.value)))
+
+        workflow = StateGraph(AgentState)
+        workflow.add_node("chatbot", call_llm)
+        # workflow.add_node("my_tools", self._call_tool)
+        workflow.add_node("my_tools", toolnode)
+
+        if self.semantic_cache is None:
+            workflow.add_edge(START, "chatbot")
+            end = END
+        else:
+            # First turn questions similar to earlier ones are answered without calling the model
+            workflow.add_node("semantic_cache", self._semantic_lookup)
+            workflow.add_node("semantic_store", self._semantic_store)
+            workflow.add_edge(START, "semantic_cache")
+            workflow.add_conditional_edges("semantic_cache", self._semantic_route, {"hit": END, "miss": "chatbot"})
+            workflow.add_edge("semantic_store", END)
+            end = "semantic_store"
+
+        workflow.add_edge("my_tools", "chatbot")
+        workflow.add_edge("chatbot", END)
+
+        # Add edges
+        workflow.add_conditional_edges(
+            "chatbot",
+            self._should_call_tool,
+            {
+                "call_tool": "my_tools",
+                END: end,
+            },
+        )
+
+        return workflow
+
+    def set_instructions(self, extra: Sequence[str] = ()) -> None:
+        """
+        Sets the instructions sent ahead of every conversation, the system instructions of the config then extra, eg MCP prompts.
+
+        The instructions are the same message on every call so the start of every prompt is byte identical,
+        letting the provider serve it from its prompt cache. They are only replaced when their text changes.
+        """
+        texts = [instruction.text.strip() for instruction in self.config.system_instruction] + [text.strip() for text in extra]
+        content = "\n\n".join(text for text in texts if text)
+
+        current = self.instructions.content if self.instructions is not None else ""
+        if content == current:
+            return
+
+        logger.info(f"Instructions set, {len(content)} characters")
+        self.instructions = SystemMessage(content=content) if content else None
+        if self.semantic_cache is not None:
+            # Cached answers were given under the previous instructions
+            self.semantic_cache.clear()
+
+    async def _call_llm(self, state: AgentState, client: BaseChatModel, priority: Priority = Priority.interactive) -> dict:
         """
         Node to call the language model.
+        The instructions lead, followed by the summary which changes as the conversation grows.
+        The call waits for a slot from the limiter at the priority of the turn.
         """
+        instructions = [self.instructions] if self.instructions is not None else []
+        summary = [SystemMessage(content=f"Summary of the earlier conversation:\n{state.summary}")] if state.summary else []
+
         messages = state.messages
-        with self.llm_summary_metric.time():
-            response = await self.client.ainvoke(messages)
+        if self.context_window:
+            messages = self.context_window.trim(messages, reserved=sum(message_tokens(message) for message in instructions + summary))
+        messages = instructions + summary + messages
+
+        async with self.limiter.slot(priority) if self.limiter else nullcontext():
+            with self.llm_summary_metric.time():
+                response = await client.ainvoke(messages)
+
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.input_tokens_metric.inc(usage.get("input_tokens", 0))
+            self.cached_tokens_metric.inc(usage.get("input_token_details", {}).get("cache_read") or 0)
         # The response from ainvoke is already an AIMessage if no tool calls,
         # or an AIMessage with tool_calls if tools are called.
-        # We append it to the list of messages to be included in the state.
+        # Only the new message is returned, the reducer appends it to the conversation.
+        return {"messages": [response]}
 
-        new_state = state.model_copy(update={"messages": state.messages + [response]})
-        return new_state
+    @staticmethod
+    def _first_turn_question(state: AgentState) -> str | None:
+        """The question of the first turn of the conversation, None if the state is past the first turn"""
+        first = state.messages[0] if state.messages else None
+        if state.summary or not isinstance(first, HumanMessage) or not isinstance(first.content, str):
+            return None
+        if any(isinstance(message, HumanMessage) for message in state.messages[1:]):
+            return None
+        return first.content
+
+    async def _semantic_lookup(self, state: AgentState) -> dict:
+        """
+        Node answering the first question of a conversation from the semantic cache
+        """
+        if len(state.messages) != 1:
+            return {}
+        question = self._first_turn_question(state)
+        if question is None:
+            return {}
 
-    async def _call_tool(self, state: AgentState) -> dict:
+        answer = await self.semantic_cache.lookup(question)
+        return {"messages": [answer]} if answer is not None else {}
+
+    def _semantic_route(self, state: AgentState) -> str:
+        return "hit" if isinstance(state.messages[-1], AIMessage) else "miss"
+
+    async def _semantic_store(self, state: AgentState) -> dict:
         """
-        Node to execute tool calls.
+        Node adding the answer to the first question of a conversation to the semantic cache
         """
+        question = self._first_turn_question(state)
+        answer = state.messages[-1]
+        if question is None or not isinstance(answer, AIMessage) or not answer.text:
+            return {}
+        if not self.semantic_cache.config.cache_tool_answers and any(isinstance(message, ToolMessage) for message in state.messages):
+            return {}
 
-        print(f"ToolNode called with state: {state}")
+        await self.semantic_cache.add(question, answer)
+        return {}
 
-        logger.error(f"State is {state}")
+    async def _call_tool(self, state: AgentState, config: RunnableConfig) -> dict:
+        """
+        Node to execute tool calls.
+        """
 
         messages = state.messages
         last_message = messages[-1]
@@ -123,9 +262,13 @@ class LanggraphHandler:
             # todo: Handle this case more gracefully
             return {}
 
-        tool_responses = await self.function_registry.perform_tool_actions(last_message.tool_calls)
-        # Append tool responses to the messages list
-        return {"messages": messages + tool_responses}
+        tool_responses = await self.function_registry.perform_tool_actions(
+            last_message.tool_calls,
+            config["configurable"]["thread_id"],
+            config["configurable"].get("identity"),
+        )
+        # Only the tool responses are returned, the reducer appends them to the conversation
+        return {"messages": tool_responses}
 
     def _should_call_tool(self, state: AgentState) -> str:
         """
@@ -151,34 +294,53 @@ class LanggraphHandler:
 
         logger.info(f"Binding tools: {[tool.name for tool in all_tools]}")
 
-        self.client = self.client.bind_tools(all_tools)
-        self.toolnode = ToolNode(tools=all_tools, name="my_tools")
-
-        # self.workflow.add_node("my_tools", self._call_tool)
-        self.workflow.add_node("my_tools", self.toolnode)
+        self.client = self.model.bind_tools(all_tools)
+        if self.response_cache is not None:
+            self.client = self.response_cache.wrap(self.client, all_tools)
+        self.toolnode = ToolNode(tools=all_tools, name="my_tools", awrap_tool_call=self.function_registry.awrap_tool_call)
 
     def compile(self) -> StateGraph:
         """
         Compiles the graph with the current configuration.
         This is essentiall as we want to add some tools and generate the ToolNode dynamically.
         This is useful if you want to change the graph dynamically.
+
+        The new graph replaces the current one in a single assignment, turns already running finish on the graph they started on.
+        The checkpointer is shared so conversations continue across graphs.
         """
 
+        self.workflow = self._build_workflow(self.client, self.toolnode)
         self.graph = self.workflow.compile(checkpointer=self.memory)
 
-        print(self.graph.get_graph().draw_ascii())
-
-        print("Workflow as Mermaid")
-        print(self.graph.get_graph().draw_mermaid())
+        # Rendering imports grandalf and walks the graph, only pay for it when it is logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Workflow\n{self.graph.get_graph().draw_ascii()}")
+            logger.debug(f"Workflow as Mermaid\n{self.graph.get_graph().draw_mermaid()}")
 
         logger.info("Graph compiled successfully.")
 
         return self.graph
 
+    @property
+    def ready(self) -> bool:
+        """The graph is compiled and can take conversations"""
+        return hasattr(self, "graph")
+
     def register_tools(self, tools: Sequence[StructuredTool], context=None):
         """Registers the tools with the client."""
         self.function_registry.register_tools(tools, context=context)
 
+    def reload_tools(self, tools: Sequence[StructuredTool], context: toolregistry.ToolRegistrationContext) -> None:
+        """Replaces the tools of an MCP server then rebinds the model and recompiles the graph with them.
+        Raises and keeps the current tools and graph if the new tools cannot be registered.
+        """
+        self.function_registry.replace_mcp_tools(tools, context=context)
+        if self.semantic_cache is not None:
+            # Cached answers were given with the previous tools
+            self.semantic_cache.clear()
+        self.bind_tools()
+        self.compile()
+
     # async def upload(
     #     self,
     #     conversation: ConversationAccount,
@@ -213,49 +375,58 @@ class LanggraphHandler:
     #     logger.debug("File added to conversation but not sent to LLM yet.")
     #     return None
 
-    async def ainvoke_agent(self, prompt: str, chat_history: ChatHistory) -> str:
-        """Invoke the agent with the given prompt and chat history.
-        This method prepares the messages, calls the graph, and returns the response.
+    async def ainvoke_agent(
+        self,
+        conversation_id: str,
+        identity: str,
+        prompt: str,
+        chat_history: ChatHistory,
+        on_token: Callable[[str], None] | None = None,
+        priority: Priority = Priority.interactive,
+    ) -> str:
+        """Invoke the agent for a Bot Framework conversation.
+        The conversation id is used as the graph thread so only the new prompt is sent to the graph,
+        the checkpointer holds the rest of the conversation.
+
+        The chat history is a bounded copy of the conversation held in the bot storage, the summary
+        and the prompts and replies of the last history_turns turns without tool calls or results.
+        It is used to reseed the graph thread if the checkpointer has evicted it, and on a new pod
+        when the bot storage outlives the pod, and is rewritten from the thread after each turn.
 
         Args:
+            conversation_id (str): The Bot Framework conversation id
+            identity (str): The identity of the user in the conversation
             prompt (str): The user prompt
-            chat_history (list[BaseMessage]): The chat history
+            chat_history (ChatHistory): The chat history from the bot storage
+            on_token (Callable[[str], None] | None): Called with each piece of reply text as the model streams it,
+                only used when streaming is enabled in the aiclient config
+            priority (Priority): Priority of the calls to the model in the turn, background work waits behind interactive turns
 
         Returns:
             str: The response from the agent
         """
-        print(f"ainvoke_agent called with prompt: {prompt} for chat_history: {chat_history}")
-
         if not hasattr(self, "graph"):
             raise ValueError("Graph not yet compiled")
 
-        # Update the messages object to add the new prompt as a human message (this is necessary for the store function later)
-        chat_history.messages.append(HumanMessage(content=prompt))
-
-        agent_state = AgentState.from_chat_history(chat_history)
+        graph_config = self.get_graph_config(conversation_id, identity=identity, priority=priority.value)
 
-        temp_graph_config = RunnableConfig(configurable={"thread_id": "ABC"})
+        prompt_message = HumanMessage(content=prompt, id=str(uuid.uuid4()))
+        new_messages = [prompt_message]
 
-        final_graph_state = await self.graph.ainvoke(agent_state, config=temp_graph_config)
+        graph_input = {"messages": new_messages}
+        if chat_history.messages or chat_history.summary:
+            snapshot = await self.graph.aget_state(graph_config)
+            if not snapshot.values.get("messages"):
+                logger.info(f"Reseeding conversation {conversation_id} with {len(chat_history.messages)} messages from chat history")
+                graph_input = {"messages": list(chat_history.messages) + new_messages, "summary": chat_history.summary}
 
-        # Extract the final messages from the graph's output state
-        final_messages = final_graph_state["messages"]
+        final_state = await self._ainvoke_graph(graph_config, graph_input, on_token=on_token)
 
-        # The last message in the final_messages list should be the AI's response
-        final_response_message = final_messages[-1] if final_messages else None
+        self._record_history(chat_history, final_state)
 
-        logger.debug(f"Final response from graph: {final_response_message}")
+        return self._response_text(final_state["messages"])
 
-        if isinstance(final_response_message, AIMessage):
-            return final_response_message.content
-        elif final_response_message is None:
-            logger.error("Graph execution resulted in no messages.")
-            return "Sorry, I encountered an issue and couldn't generate a response."
-        else:
-            logger.error(f"Unexpected final response type from graph: {type(final_response_message)}")
-            return "Sorry, I encountered an error processing your request."
-
-    async def chat(self, conversation_id: str, identity: str, prompt: str) -> str:
+    async def chat(self, conversation_id: str, identity: str, prompt: str, priority: Priority = Priority.interactive) -> str:
         """Make a chat request to the AI model with the provided prompt.
         This method sends a prompt to the model and processes the response.
         It handles tool calls made by the model, executes the corresponding tool,
@@ -265,23 +436,147 @@ class LanggraphHandler:
             conversation (Conversation): The conversation context
             identity (str): The identity of the user or bot in the conversation
             prompt (str): Prompt from the user
+            priority (Priority): Priority of the calls to the model in the turn
 
         Returns:
             str: text response for the bot
         """
+        if not hasattr(self, "graph"):
+            raise ValueError("Graph not yet compiled")
+
+        graph_config = self.get_graph_config(conversation_id, identity=identity, priority=priority.value)
 
-        graph_config = self.get_graph_config(conversation_id, identity=identity)
+        final_state = await self._ainvoke_graph(graph_config, {"messages": [HumanMessage(content=prompt)]})
+
+        return self._response_text(final_state["messages"])
+
+    async def _ainvoke_graph(
+        self,
+        graph_config: RunnableConfig,
+        graph_input: dict,
+        on_token: Callable[[str], None] | None = None,
+    ) -> dict:
+        """Run one turn of the graph on the thread in graph_config and return the resulting state"""
         logger.debug(f"Graph config: {graph_config}")
 
-        agent_state = {"messages": [HumanMessage(content=prompt)]}
+        thread_id = graph_config["configurable"]["thread_id"]
+        self.active_threads[thread_id] = self.active_threads.get(thread_id, 0) + 1
+        # The final put of the turn only writes the channels it changed, so the thread must not be evicted under it
+        self.memory.pin(thread_id)
+        try:
+            if on_token is not None and self.streaming:
+                final_graph_state = await self._astream_graph(graph_input, graph_config, on_token)
+            else:
+                final_graph_state = await self.graph.ainvoke(graph_input, config=graph_config, durability=GRAPH_DURABILITY)
+        finally:
+            self.memory.unpin(thread_id)
+            self.active_threads[thread_id] -= 1
+            if not self.active_threads[thread_id]:
+                del self.active_threads[thread_id]
+
+        self._schedule_summary(graph_config, final_graph_state["messages"])
+
+        return final_graph_state
+
+    async def _astream_graph(self, graph_input: dict, graph_config: RunnableConfig, on_token: Callable[[str], None]) -> dict:
+        """Run the graph streaming the text generated by the chatbot node to on_token.
+        Returns the final graph state as ainvoke would.
+        """
+        final_graph_state = None
+        start = time.perf_counter()
+        first_token = True
 
-        if not hasattr(self, "graph"):
-            raise ValueError("Graph not yet compiled")
+        async for mode, chunk in self.graph.astream(graph_input, config=graph_config, stream_mode=["messages", "values"], durability=GRAPH_DURABILITY):
+            if mode == "values":
+                final_graph_state = chunk
+                continue
 
-        final_graph_state = await self.graph.ainvoke(agent_state, config=graph_config)
+            message, metadata = chunk
+            if metadata.get("langgraph_node") not in ("chatbot", "semantic_cache") or not isinstance(message, AIMessage) or not message.text:
+                continue
 
-        # Extract the final messages from the graph's output state
-        final_messages = final_graph_state["messages"]
+            if first_token:
+                self.first_token_metric.observe(time.perf_counter() - start)
+                first_token = False
+            on_token(message.text)
+
+        return final_graph_state
+
+    def _schedule_summary(self, graph_config: RunnableConfig, messages: list[AnyMessage]) -> None:
+        """Start a background summary of the conversation if it has grown past the trigger size.
+        The summary runs after the reply is returned so the user never waits for it.
+        """
+        if self.summariser is None:
+            return
+
+        thread_id = graph_config["configurable"]["thread_id"]
+        if thread_id in self.pending_summaries or not self.summariser.split(messages):
+            return
+
+        self.pending_summaries.add(thread_id)
+        task = asyncio.create_task(self._summarise(graph_config))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def _summarise(self, graph_config: RunnableConfig) -> None:
+        """Replace the older messages of a conversation with a running summary"""
+        thread_id = graph_config["configurable"]["thread_id"]
+        self.memory.pin(thread_id)
+        try:
+            snapshot = await self.graph.aget_state(graph_config)
+            messages = snapshot.values.get("messages", [])
+            split = self.summariser.split(messages)
+            if not split:
+                self.summariser.summary_result_metric.labels("skipped").inc()
+                return
+
+            summary = await self.summariser.summarise(snapshot.values.get("summary", ""), messages[:split])
+
+            if thread_id in self.active_threads:
+                # A new turn started from the old state and would write the summarised messages back
+                logger.info(f"Conversation {thread_id} became active while summarising, summary discarded")
+                self.summariser.summary_result_metric.labels("skipped").inc()
+                return
+
+            await self.graph.aupdate_state(
+                graph_config,
+                {
+                    "messages": [RemoveMessage(id=message.id) for message in messages[:split]],
+                    "summary": summary,
+                },
+            )
+            self.summariser.summary_result_metric.labels("success").inc()
+            logger.info(f"Conversation {thread_id} summarised, {split} messages replaced")
+
+        except Exception as e:
+            logger.error(f"Failed to summarise conversation {thread_id}: {str(e)}")
+            self.summariser.summary_result_metric.labels("error").inc()
+        finally:
+            self.memory.unpin(thread_id)
+            self.pending_summaries.discard(thread_id)
+
+    async def aclose(self) -> None:
+        """Cancel background work such as pending summaries"""
+        for task in list(self.background_tasks):
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+
+    def _record_history(self, chat_history: ChatHistory, final_state: dict) -> None:
+        """
+        Rewrite the chat history from the thread, the summary and the last history_turns turns.
+        Tool calls and their results are left out, a reseeded conversation keeps the prompts and replies.
+        """
+        messages = [message for message in final_state["messages"] if isinstance(message, HumanMessage) or (isinstance(message, AIMessage) and not message.tool_calls)]
+        turn_starts = [index for index, message in enumerate(messages) if isinstance(message, HumanMessage)]
+        turns = self.config.checkpoint.history_turns
+        start = turn_starts[-turns] if len(turn_starts) > turns else 0
+
+        chat_history.messages = messages[start:]
+        chat_history.summary = final_state.get("summary", "")
+
+    @staticmethod
+    def _response_text(final_messages: list[AnyMessage]) -> str:
+        """Extract the reply text from the final messages of a turn"""
 
         # The last message in the final_messages list should be the AI's response
         final_response_message = final_messages[-1] if final_messages else None
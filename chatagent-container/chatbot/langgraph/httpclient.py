@@ -0,0 +1,133 @@
+from collections.abc import AsyncIterator, Callable
+import logging
+
+import httpx
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+
+from chatbot.config import LangchainConfig
+
+logger = logging.getLogger(__name__)
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    """Body of a response, the request holds its connection until the body is closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, done: Callable[[], None]):
+        self.stream = stream
+        self.done = done
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self.done()
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """
+    Transport counting the requests holding or waiting on a connection of the pool
+    """
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, in_flight: Gauge):
+        self.transport = transport
+        self.in_flight = in_flight
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight.inc()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.in_flight.dec()
+            raise
+
+        closed = False
+
+        def done():
+            nonlocal closed
+            if not closed:
+                closed = True
+                self.in_flight.dec()
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_MeteredStream(response.stream, done),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class LlmHttpClient:
+    """
+    Process wide HTTP clients for the model API of the LLM provider.
+
+    The async client carries the model calls, its connection pool is tuned from the LangchainConfig
+    and its utilisation exported as metrics. The sync client has the same settings and is unmetered.
+    """
+
+    def __init__(self, config: LangchainConfig, registry: CollectorRegistry | None = REGISTRY):
+        self.provider = config.model_provider
+        self.limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout)
+
+        self.in_flight_metric = Gauge(
+            "llm_http_requests_in_flight",
+            "Requests to the model API holding or waiting on a pooled connection",
+            ["provider"],
+            registry=registry,
+        )
+        self.connections_metric = Gauge(
+            "llm_http_pool_connections",
+            "Connections open in the pool to the model API",
+            ["provider", "state"],
+            registry=registry,
+        )
+        self.max_connections_metric = Gauge(
+            "llm_http_pool_max_connections",
+            "Maximum connections in the pool to the model API",
+            ["provider"],
+            registry=registry,
+        )
+        self.max_connections_metric.labels(self.provider).set(config.max_connections)
+
+        self.transport = httpx.AsyncHTTPTransport(
+            verify=config.httpx_verify_ssl,
+            http2=config.http2,
+            limits=self.limits,
+        )
+        self.async_client = httpx.AsyncClient(
+            transport=MeteredTransport(self.transport, self.in_flight_metric.labels(self.provider)),
+            timeout=self.timeout,
+        )
+        self.client = httpx.Client(
+            verify=config.httpx_verify_ssl,
+            http2=config.http2,
+            limits=self.limits,
+            timeout=self.timeout,
+        )
+
+        self.connections_metric.labels(self.provider, "active").set_function(lambda: self._connections(idle=False))
+        self.connections_metric.labels(self.provider, "idle").set_function(lambda: self._connections(idle=True))
+
+    def _connections(self, idle: bool) -> int:
+        # httpx does not expose its pool, httpcore lists the connections of the pool
+        pool = getattr(self.transport, "_pool", None)
+        if pool is None:
+            return 0
+        return sum(1 for connection in pool.connections if connection.is_idle() == idle)
+
+    async def aclose(self) -> None:
+        """Close the connections to the model API"""
+        await self.async_client.aclose()
+        self.client.close()
+        logger.debug(f"Closed HTTP clients for {self.provider}")
@@ -0,0 +1,91 @@
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import asyncio
+import heapq
+import itertools
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge, Summary
+
+
+class Priority(IntEnum):
+    """Priority of a call to the LLM, lower values are served first"""
+
+    interactive = 0
+    background = 1
+
+
+class LlmLimiter:
+    """
+    Process wide limit on the calls in flight to the LLM.
+
+    Calls beyond the limit wait in a priority queue, a free slot goes to the waiting call of the
+    highest priority and then to the one waiting longest. Interactive turns are therefore served
+    ahead of background work such as summaries.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        registry: CollectorRegistry | None = REGISTRY,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.max_concurrent = max_concurrent
+        self.clock = clock
+        self.in_flight = 0
+        # (priority, arrival, future) of each waiting call
+        self.waiting: list[tuple[Priority, int, asyncio.Future]] = []
+        self.arrivals = itertools.count()
+
+        self.queue_metric = Gauge("llm_queue_depth", "Calls to the LLM waiting for a slot", ["priority"], registry=registry)
+        self.wait_metric = Summary("llm_queue_wait_seconds", "Time calls to the LLM waited for a slot", ["priority"], registry=registry)
+        self.in_flight_metric = Gauge("llm_calls_in_flight", "Calls in flight to the LLM", ["priority"], registry=registry)
+
+    async def acquire(self, priority: Priority) -> None:
+        start = self.clock()
+        if self.in_flight < self.max_concurrent and not self.waiting:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (priority, next(self.arrivals), waiter)
+            heapq.heappush(self.waiting, entry)
+            self.queue_metric.labels(priority.name).inc()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over as the call was cancelled, pass it on
+                    self._release()
+                elif entry in self.waiting:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                    self.queue_metric.labels(priority.name).dec()
+                raise
+
+        self.wait_metric.labels(priority.name).observe(self.clock() - start)
+        self.in_flight_metric.labels(priority.name).inc()
+
+    def _release(self) -> None:
+        """Hand the slot to the next waiting call, or free it"""
+        while self.waiting:
+            priority, _, waiter = heapq.heappop(self.waiting)
+            self.queue_metric.labels(priority.name).dec()
+            # A waiter cancelled before its task has run is skipped
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def release(self, priority: Priority) -> None:
+        self.in_flight_metric.labels(priority.name).dec()
+        self._release()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority) -> AsyncIterator[None]:
+        """Hold a slot for a call to the LLM"""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import AIMessage, AnyMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+from chatbot.config import LangchainConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def tools_hash(tools: Sequence[BaseTool]) -> str:
+    """Hash of the schemas of the tools bound to the model, any change to a tool changes the hash"""
+    return _digest(sorted((convert_to_openai_tool(tool) for tool in tools), key=lambda schema: schema["function"]["name"]))
+
+
+def normalise_message(message: AnyMessage) -> dict:
+    """
+    The parts of a message that decide the response of the model.
+    Whitespace is collapsed, the case of user prompts ignored and the ids of messages and tool calls left out.
+    """
+    if isinstance(message.content, str):
+        content = " ".join(message.content.split())
+        if isinstance(message, HumanMessage):
+            content = content.casefold()
+    else:
+        # Content with images or other blocks is matched exactly
+        content = message.content
+
+    normalised = {"type": message.type, "content": content}
+    if isinstance(message, AIMessage) and message.tool_calls:
+        normalised["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+    if isinstance(message, ToolMessage):
+        normalised["name"] = message.name
+    return normalised
+
+
+@dataclass
+class CachedResponse:
+    message: AIMessage
+    expires: float
+    # Time the model took to produce the response, saved by each hit
+    latency: float
+
+
+class ResponseCache:
+    """
+    Least recently used cache of model responses with a time to live.
+
+    Responses are keyed on the normalised messages sent, the model, the temperature and the tools bound.
+    The cache is bypassed when the temperature is above 0 unless allow_nondeterministic is set.
+    """
+
+    def __init__(
+        self,
+        config: LangchainConfig,
+        registry: CollectorRegistry | None = REGISTRY,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config.response_cache
+        self.model = config.model
+        self.temperature = config.temperature
+        self.cacheable = config.temperature == 0 or self.config.allow_nondeterministic
+        self.clock = clock
+        self.entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+        self.lookup_metric = Counter("response_cache_lookups", "Count of model calls looked up in the response cache by result", ["result"], registry=registry)
+        self.saved_metric = Counter("response_cache_saved_seconds", "Model latency saved by responses served from the cache", registry=registry)
+        self.entries_metric = Gauge("response_cache_entries", "Number of model responses held in the cache", registry=registry)
+
+        if not self.cacheable:
+            logger.warning(f"Response cache bypassed as the temperature {self.temperature} is non-deterministic")
+
+    def key(self, messages: Sequence[AnyMessage], tools: str) -> str:
+        return _digest(
+            {
+                "model": self.model,
+                "temperature": self.temperature,
+                "tools": tools,
+                "messages": [normalise_message(message) for message in messages],
+            }
+        )
+
+    def get(self, key: str) -> AIMessage | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry.expires <= self.clock():
+            del self.entries[key]
+            self.entries_metric.set(len(self.entries))
+            entry = None
+
+        if entry is None:
+            self.lookup_metric.labels("miss").inc()
+            return None
+
+        self.entries.move_to_end(key)
+        self.lookup_metric.labels("hit").inc()
+        self.saved_metric.inc(entry.latency)
+        # A fresh id so a repeat within a conversation is appended rather than replacing the earlier reply,
+        # and no usage as no tokens were sent for it
+        return entry.message.model_copy(update={"id": str(uuid.uuid4()), "usage_metadata": None})
+
+    def put(self, key: str, message: AIMessage, latency: float) -> None:
+        self.entries[key] = CachedResponse(message, self.clock() + self.config.ttl.total_seconds(), latency)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.config.max_entries:
+            self.entries.popitem(last=False)
+        self.entries_metric.set(len(self.entries))
+
+    def wrap(self, client: Runnable, tools: Sequence[BaseTool]) -> "CachedModel":
+        """The client answering from the cache, for the tools bound to it"""
+        return CachedModel(client, self, tools_hash(tools))
+
+
+class CachedModel(Runnable[LanguageModelInput, BaseMessage]):
+    """A model with tools bound that answers repeated calls from the response cache"""
+
+    def __init__(self, client: Runnable, cache: ResponseCache, tools: str):
+        self.client = client
+        self.cache = cache
+        self.tools = tools
+
+    def _key(self, input: LanguageModelInput, kwargs: dict) -> str | None:
+        """The cache key for the call, None if the call bypasses the cache"""
+        if not self.cache.cacheable or kwargs or not isinstance(input, list):
+            return None
+        return self.cache.key(input, self.tools)
+
+    def invoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        key = self._key(input, kwargs)
+        if key is None:
+            self.cache.lookup_metric.labels("bypass").inc()
+            return self.client.invoke(input, config, **kwargs)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        response = self.client.invoke(input, config, **kwargs)
+        self.cache.put(key, response, time.perf_counter() - start)
+        return response
+
+    async def ainvoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        key = self._key(input, kwargs)
+        if key is None:
+            self.cache.lookup_metric.labels("bypass").inc()
+            return await self.client.ainvoke(input, config, **kwargs)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        response = await self.client.ainvoke(input, config, **kwargs)
+        self.cache.put(key, response, time.perf_counter() - start)
+        return response
@@ -0,0 +1,211 @@
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+import asyncio
+import copy
+import logging
+import time
+
+import openai
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Summary
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest call in the moving average latency of a deployment
+LATENCY_SMOOTHING = 0.2
+
+
+@dataclass
+class Deployment:
+    """An equivalent deployment of the model and what the router has observed of it"""
+
+    name: str
+    model: BaseChatModel
+    weight: float = 1.0
+    outstanding: int = 0
+    # Moving average of the latency of successful calls, None until a call completes
+    latency: float | None = None
+    throttled_until: float = 0.0
+
+
+def is_throttled(e: Exception) -> bool:
+    """Whether the provider rejected the call with a 429, openai errors carry status_code and google errors code"""
+    return getattr(e, "status_code", None) == 429 or getattr(e, "code", None) == 429
+
+
+def is_transient(e: Exception) -> bool:
+    """Whether the call failed in a way the openai client retries, a connection error or timeout, or a 408, 409 or 5xx"""
+    if isinstance(e, openai.APIConnectionError):
+        return True
+    status = getattr(e, "status_code", None)
+    return status in (408, 409) or (isinstance(status, int) and status >= 500)
+
+
+def retry_after(e: Exception) -> float | None:
+    """Seconds the provider asked to wait before calling again, None if it did not say"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers or "retry-after" not in headers:
+        return None
+    try:
+        return float(headers["retry-after"])
+    except ValueError:
+        return None
+
+
+class LlmRouter(Runnable[LanguageModelInput, BaseMessage]):
+    """
+    Routes each call of the model to one of a set of equivalent deployments.
+
+    A call goes to the deployment with the lowest expected wait, its outstanding calls times its
+    average latency scaled down by its weight. A deployment that throttles with a 429 is taken out
+    of routing for its Retry-After or the cooldown and the call is retried on another deployment.
+    As the deployments are called without the retries of their clients, a call that fails with a
+    transient error is retried up to max_retries times, on a deployment it has not tried if there
+    is one, else after an exponential backoff as the client would have.
+    Copies made by bind_tools share the deployments so their observations apply to every copy.
+    """
+
+    def __init__(
+        self,
+        deployments: Sequence[Deployment],
+        cooldown: float,
+        registry: CollectorRegistry | None = REGISTRY,
+        clock: Callable[[], float] = time.monotonic,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+    ):
+        if not deployments:
+            raise ValueError("LlmRouter needs at least one deployment")
+
+        self.deployments = list(deployments)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # What each deployment is called through, the model or the model bound to tools
+        self.runnables: dict[str, Runnable] = {deployment.name: deployment.model for deployment in self.deployments}
+
+        self.latency_metric = Summary("llm_deployment_latency_seconds", "Latency of successful calls to each LLM deployment", ["deployment"], registry=registry)
+        self.selection_metric = Counter("llm_deployment_selections", "Count of calls routed to each LLM deployment", ["deployment"], registry=registry)
+        self.throttle_metric = Counter("llm_deployment_throttles", "Count of calls throttled with a 429 by each LLM deployment", ["deployment"], registry=registry)
+        self.error_metric = Counter("llm_deployment_errors", "Count of calls failed with a transient error by each LLM deployment", ["deployment"], registry=registry)
+        self.outstanding_metric = Gauge("llm_deployment_outstanding", "Calls in flight to each LLM deployment", ["deployment"], registry=registry)
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs) -> "LlmRouter":
+        """A router calling each deployment with the tools bound"""
+        bound = copy.copy(self)
+        bound.runnables = {deployment.name: deployment.model.bind_tools(tools, **kwargs) for deployment in self.deployments}
+        return bound
+
+    def _expected_wait(self, deployment: Deployment, default_latency: float) -> float:
+        latency = deployment.latency if deployment.latency is not None else default_latency
+        return (deployment.outstanding + 1) * latency / deployment.weight
+
+    def select(self, exclude: set[str] = frozenset()) -> Deployment | None:
+        """
+        The deployment to send the next call to, None if every deployment not excluded is throttled.
+        When nothing is excluded and every deployment is throttled the first to recover is chosen.
+        """
+        now = self.clock()
+        candidates = [deployment for deployment in self.deployments if deployment.name not in exclude]
+        available = [deployment for deployment in candidates if deployment.throttled_until <= now]
+
+        if not available:
+            if exclude or not candidates:
+                return None
+            return min(candidates, key=lambda deployment: deployment.throttled_until)
+
+        # An idle deployment yet to complete a call is tried to learn its latency
+        untried = [deployment for deployment in available if deployment.latency is None and deployment.outstanding == 0]
+        if untried:
+            return max(untried, key=lambda deployment: deployment.weight)
+
+        # Those with calls in flight but none completed are expected to be as fast as the average
+        observed = [deployment.latency for deployment in self.deployments if deployment.latency is not None]
+        default_latency = sum(observed) / len(observed) if observed else 1.0
+
+        return min(available, key=lambda deployment: self._expected_wait(deployment, default_latency))
+
+    @contextmanager
+    def _routed(self, deployment: Deployment) -> Iterator[None]:
+        """Account a call to the deployment"""
+        self.selection_metric.labels(deployment.name).inc()
+        deployment.outstanding += 1
+        self.outstanding_metric.labels(deployment.name).inc()
+        start = self.clock()
+        try:
+            yield
+        except Exception as e:
+            if is_throttled(e):
+                wait = retry_after(e) or self.cooldown
+                deployment.throttled_until = self.clock() + wait
+                self.throttle_metric.labels(deployment.name).inc()
+                logger.warning(f"LLM deployment '{deployment.name}' throttled, out of routing for {wait:.1f}s")
+            elif is_transient(e):
+                self.error_metric.labels(deployment.name).inc()
+                logger.warning(f"LLM deployment '{deployment.name}' failed with a transient error: {e}")
+            raise
+        else:
+            latency = self.clock() - start
+            self.latency_metric.labels(deployment.name).observe(latency)
+            if deployment.latency is None:
+                deployment.latency = latency
+            else:
+                deployment.latency += LATENCY_SMOOTHING * (latency - deployment.latency)
+        finally:
+            deployment.outstanding -= 1
+            self.outstanding_metric.labels(deployment.name).dec()
+
+    def _next(self, tried: set[str], e: Exception | None) -> Deployment:
+        """The deployment for the next attempt of a call, raising the last error when there is none"""
+        deployment = self.select(tried)
+        if deployment is None:
+            raise e
+        tried.add(deployment.name)
+        return deployment
+
+    def _retry(self, tried: set[str], e: Exception, retries: int) -> tuple[Deployment, float]:
+        """The deployment to retry a failed call on and the seconds to wait first, raising the error if the call is not retried"""
+        if is_throttled(e):
+            return self._next(tried, e), 0.0
+        if not is_transient(e) or retries >= self.max_retries:
+            raise e
+
+        deployment = self.select(tried)
+        if deployment is not None:
+            tried.add(deployment.name)
+            return deployment, 0.0
+        # Every deployment has been tried, back off before calling again
+        return self.select(), self.backoff * 2**retries
+
+    def invoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        tried: set[str] = set()
+        retries = 0
+        deployment = self._next(tried, None)
+        while True:
+            try:
+                with self._routed(deployment):
+                    return self.runnables[deployment.name].invoke(input, config, **kwargs)
+            except Exception as e:
+                deployment, delay = self._retry(tried, e, retries)
+                if is_transient(e):
+                    retries += 1
+                time.sleep(delay)
+
+    async def ainvoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        tried: set[str] = set()
+        retries = 0
+        deployment = self._next(tried, None)
+        while True:
+            try:
+                with self._routed(deployment):
+                    return await self.runnables[deployment.name].ainvoke(input, config, **kwargs)
+            except Exception as e:
+                deployment, delay = self._retry(tried, e, retries)
+                if is_transient(e):
+                    retries += 1
+                await asyncio.sleep(delay)
@@ -0,0 +1,144 @@
+from collections.abc import Callable
+import hashlib
+import logging
+import time
+import uuid
+
+# Only imported by the handler when the semantic cache is enabled
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+
+from chatbot.config import SemanticCacheConfig
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1.0)
+
+
+def normalise_text(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+class HashingEmbedder(Embeddings):
+    """
+    Deterministic local embedder hashing the words and character n-grams of a text into a fixed size vector.
+    It needs no model or network so the semantic cache runs offline, texts sharing most of their wording are similar.
+    """
+
+    def __init__(self, dimensions: int = 1024, ngram: int = 3):
+        self.dimensions = dimensions
+        self.ngram = ngram
+
+    def _features(self, text: str) -> list[str]:
+        text = normalise_text(text)
+        padded = f" {text} "
+        return text.split() + [padded[i : i + self.ngram] for i in range(len(padded) - self.ngram + 1)]
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            # A stable hash, the builtin hash is salted per process
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest())
+            # The sign spreads collisions so they cancel rather than accumulate
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class SemanticCache:
+    """
+    Answers to first turn questions held with the embeddings of the questions.
+
+    A question is answered from the cache when the cosine similarity of its embedding to that of
+    a cached question is at or above the threshold. The similarity of the closest question is
+    recorded for every lookup so the threshold can be tuned from the metrics.
+    Once full the oldest answer is replaced.
+    """
+
+    def __init__(
+        self,
+        config: SemanticCacheConfig,
+        embedder: Embeddings | None = None,
+        registry: CollectorRegistry | None = REGISTRY,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self.embedder = embedder or HashingEmbedder(config.dimensions, config.ngram)
+        self.clock = clock
+
+        # Allocated on the first answer as the dimensions depend on the embedder
+        self.vectors: np.ndarray | None = None
+        self.expires = np.zeros(config.max_entries)
+        self.answers: list[AIMessage | None] = [None] * config.max_entries
+        self.next_slot = 0
+        self.entries = 0
+
+        self.similarity_metric = Histogram(
+            "semantic_cache_similarity",
+            "Cosine similarity of each question to the closest cached question",
+            buckets=SIMILARITY_BUCKETS,
+            registry=registry,
+        )
+        self.lookup_metric = Counter("semantic_cache_lookups", "Count of first turn questions looked up in the semantic cache by result", ["result"], registry=registry)
+        self.entries_metric = Gauge("semantic_cache_entries", "Number of answers held in the semantic cache", registry=registry)
+
+    async def embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(await self.embedder.aembed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def closest(self, vector: np.ndarray) -> tuple[int, float] | None:
+        """The slot of the cached question closest to the vector and its similarity, None if nothing is cached"""
+        if self.vectors is None:
+            return None
+
+        similarities = self.vectors @ vector
+        # Empty and expired slots never match
+        similarities[self.expires <= self.clock()] = -np.inf
+        slot = int(np.argmax(similarities))
+        if similarities[slot] == -np.inf:
+            return None
+        return slot, float(similarities[slot])
+
+    async def lookup(self, question: str) -> AIMessage | None:
+        """The cached answer to a question similar to this one, None if there is none"""
+        closest = self.closest(await self.embed(question))
+        if closest is not None:
+            self.similarity_metric.observe(closest[1])
+
+        if closest is None or closest[1] < self.config.threshold:
+            self.lookup_metric.labels("miss").inc()
+            return None
+
+        slot, similarity = closest
+        logger.debug(f"Semantic cache hit with similarity {similarity:.3f}")
+        self.lookup_metric.labels("hit").inc()
+        # A fresh id as the answer is added to another conversation
+        return self.answers[slot].model_copy(update={"id": str(uuid.uuid4())})
+
+    async def add(self, question: str, answer: AIMessage) -> None:
+        vector = await self.embed(question)
+        if self.vectors is None:
+            self.vectors = np.zeros((self.config.max_entries, len(vector)), dtype=np.float32)
+
+        slot = self.next_slot
+        if self.answers[slot] is None:
+            self.entries += 1
+        self.vectors[slot] = vector
+        self.answers[slot] = answer
+        self.expires[slot] = self.clock() + self.config.ttl.total_seconds()
+        self.next_slot = (slot + 1) % self.config.max_entries
+        self.entries_metric.set(self.entries)
+
+    def clear(self) -> None:
+        """Forget every answer, eg when the tools change"""
+        self.expires[:] = 0
+        self.answers = [None] * self.config.max_entries
+        self.entries = 0
+        self.entries_metric.set(0)
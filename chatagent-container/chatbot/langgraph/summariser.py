@@ -0,0 +1,85 @@
+from collections.abc import Sequence
+from contextlib import AbstractAsyncContextManager, nullcontext
+import asyncio
+import logging
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, get_buffer_string
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Summary
+
+from chatbot.config import SummaryConfig
+from .contextwindow import message_blocks
+from .limiter import LlmLimiter, Priority
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_INSTRUCTION = """You maintain a running summary of a conversation between a user and an assistant.
+Combine the existing summary with the new messages into a single concise summary.
+Keep facts, names, identifiers, decisions and open questions. Reply with the summary only."""
+
+
+class ConversationSummariser:
+    """
+    Produces a rolling summary of the older part of a conversation.
+
+    The summary is computed with the model before tools are bound to it and calls
+    are limited to max_concurrent at a time across all conversations. With a limiter they
+    also wait behind interactive turns for a slot to call the model.
+    """
+
+    def __init__(
+        self,
+        config: SummaryConfig,
+        model: BaseChatModel,
+        registry: CollectorRegistry | None = REGISTRY,
+        limiter: LlmLimiter | None = None,
+    ):
+        self.config = config
+        self.model = model
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(config.max_concurrent)
+
+        self.summary_llm_metric = Summary("summary_llm_usage", "Summary of LLM usage for conversation summaries", registry=registry)
+        self.summary_result_metric = Counter(
+            "conversation_summaries",
+            "Count of conversation summarisation attempts",
+            ["result"],
+            registry=registry,
+        )
+
+    def split(self, messages: Sequence[AnyMessage]) -> int:
+        """Index of the first message to keep verbatim, 0 if the conversation does not need summarising.
+
+        The split is made at the start of a user turn so tool calls and their results are never separated
+        and at least keep_messages recent messages are retained.
+        """
+        if len(messages) < self.config.trigger_messages:
+            return 0
+
+        index = 0
+        split = 0
+        for block in message_blocks(messages):
+            if len(messages) - index < self.config.keep_messages:
+                break
+            if isinstance(block[0], HumanMessage):
+                split = index
+            index += len(block)
+
+        return split
+
+    def slot(self) -> AbstractAsyncContextManager:
+        return self.limiter.slot(Priority.background) if self.limiter else nullcontext()
+
+    async def summarise(self, summary: str, messages: Sequence[AnyMessage]) -> str:
+        """Fold messages into the existing summary"""
+        prompt = [
+            SystemMessage(content=SUMMARY_INSTRUCTION),
+            HumanMessage(content=f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{get_buffer_string(messages)}"),
+        ]
+
+        async with self.semaphore, self.slot():
+            with self.summary_llm_metric.time():
+                response = await self.model.ainvoke(prompt)
+
+        return response.text
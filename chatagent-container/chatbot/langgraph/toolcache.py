@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+import json
+import logging
+import time
+
+from langchain_core.messages.tool import ToolMessage
+from prometheus_client import Counter
+
+from chatbot.config.tool import ToolCacheConfig
+
+logger = logging.getLogger(__name__)
+
+
+def call_key(args: dict[str, Any], identity: str | None = None) -> str:
+    """Normalised key for a tool call, identity is included for tools whose results depend on the user"""
+    key = {"args": args}
+    if identity is not None:
+        key["identity"] = identity
+    return json.dumps(key, sort_keys=True, default=str)
+
+
+class ToolResultCache:
+    """
+    Time limited LRU cache of successful results of one tool, keyed by the call arguments.
+
+    Results are cached as ToolMessages and returned as copies carrying the id of the
+    tool call being answered. Neither the cached message nor the copies carry a message id,
+    so the message reducer gives each copy its own and removing one never removes another.
+    """
+
+    def __init__(
+        self,
+        tool_name: str,
+        source: str,
+        config: ToolCacheConfig,
+        hits_metric: Counter,
+        misses_metric: Counter,
+        evictions_metric: Counter,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self.ttl = config.ttl.total_seconds()
+        self.clock = clock
+        self.entries: OrderedDict[str, tuple[float, ToolMessage]] = OrderedDict()
+
+        self.hits_metric = hits_metric.labels(tool_name, source)
+        self.misses_metric = misses_metric.labels(tool_name, source)
+        self.expired_metric = evictions_metric.labels(tool_name, source, "expired")
+        self.size_metric = evictions_metric.labels(tool_name, source, "size")
+
+    def get(self, key: str, tool_call_id: str) -> ToolMessage | None:
+        """Cached result for the call, None on a miss"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            del self.entries[key]
+            self.expired_metric.inc()
+            entry = None
+
+        if entry is None:
+            self.misses_metric.inc()
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits_metric.inc()
+        return entry[1].model_copy(update={"tool_call_id": tool_call_id, "id": None})
+
+    def put(self, key: str, message: ToolMessage) -> None:
+        """Cache a result, errors are never cached"""
+        if message.status == "error":
+            return
+
+        # A copy, the message returned to the caller is given an id when it is added to the conversation
+        self.entries[key] = (self.clock() + self.ttl, message.model_copy(update={"id": None}))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.config.max_entries:
+            self.entries.popitem(last=False)
+            self.size_metric.inc()
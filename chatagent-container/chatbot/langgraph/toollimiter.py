@@ -0,0 +1,63 @@
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+
+from prometheus_client import Counter, Gauge, Summary
+
+logger = logging.getLogger(__name__)
+
+
+class ToolQueueFullError(Exception):
+    """Raised when a tool already has the maximum number of calls waiting"""
+
+
+class ToolLimiter:
+    """
+    Process wide limit on the concurrent executions of one tool.
+
+    At most max_instances calls run at once, up to max_queue further calls wait
+    for a slot and any more are rejected with ToolQueueFullError.
+    """
+
+    def __init__(
+        self,
+        tool_name: str,
+        source: str,
+        max_instances: int,
+        max_queue: int,
+        queue_depth_metric: Gauge,
+        wait_metric: Summary,
+        rejected_metric: Counter,
+    ):
+        self.tool_name = tool_name
+        self.max_instances = max_instances
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_instances)
+        self.waiting = 0
+
+        self.queue_depth_metric = queue_depth_metric.labels(tool_name, source)
+        self.wait_metric = wait_metric.labels(tool_name, source)
+        self.rejected_metric = rejected_metric.labels(tool_name, source)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Hold one of the tool's execution slots for the duration of the context"""
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected_metric.inc()
+            raise ToolQueueFullError(f"Tool '{self.tool_name}' is busy ({self.max_instances} running, {self.waiting} waiting), try again later")
+
+        self.waiting += 1
+        self.queue_depth_metric.inc()
+        start = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            self.queue_depth_metric.dec()
+            self.wait_metric.observe(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self.semaphore.release()
@@ -1,12 +1,20 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import Literal
 from collections.abc import Sequence
 from chatbot.config.tool import ToolBoxConfig, ToolConfig, ToolModeEnum
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
 from langchain_core.messages.tool import ToolCall, ToolMessage
 from langchain_core.tools.structured import StructuredTool
+from langgraph.prebuilt.tool_node import ToolCallRequest
+from langgraph.types import Command
 import logging
 import asyncio
-from prometheus_client import REGISTRY, CollectorRegistry, Summary
+import json
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Summary
+from .toolcache import ToolResultCache, call_key
+from .toollimiter import ToolLimiter, ToolQueueFullError
+from .toolscheduler import ToolScheduler
 from ruamel.yaml import YAML
 
 yaml = YAML()
@@ -32,6 +40,9 @@ class ToolDefinition:
     name: str
     definition: ToolConfig
     tool: StructuredTool
+    source: str
+    limiter: ToolLimiter
+    cache: ToolResultCache | None = None
 
 
 class ToolRegistry:
@@ -46,12 +57,62 @@ class ToolRegistry:
         # (List form is easier to manage in k8s (ie lists enable replace vs change))
         self.tool_definition_dict = {tool.name: tool for tool in self.toolboxConfig.tools if tool.name is not None}
         self.prometheus_registry = registry
+        self.scheduler = ToolScheduler(toolboxConfig.max_concurrent, registry=registry)
+        self.inflight: dict[tuple[str, str], asyncio.Task] = {}
         self.tool_usage_metric = Summary(
             "tool_usage",
             "Summary of tool usage",
             ["tool_name"],
             registry=registry,
         )
+        self.tool_queue_depth_metric = Gauge(
+            "tool_queue_depth",
+            "Number of calls waiting for an instance of a tool",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_wait_metric = Summary(
+            "tool_wait",
+            "Time calls waited for an instance of a tool",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_rejected_metric = Counter(
+            "tool_rejected",
+            "Count of tool calls rejected because the tool queue was full",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_cache_hits_metric = Counter(
+            "tool_cache_hits",
+            "Count of tool calls answered from the tool result cache",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_cache_misses_metric = Counter(
+            "tool_cache_misses",
+            "Count of tool calls not found in the tool result cache",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_cache_evictions_metric = Counter(
+            "tool_cache_evictions",
+            "Count of results removed from the tool result cache",
+            ["tool_name", "mcp_server", "reason"],
+            registry=registry,
+        )
+        self.tool_coalesced_metric = Counter(
+            "tool_coalesced",
+            "Count of tool calls answered by an identical call already in flight",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
+        self.tool_timeout_metric = Counter(
+            "tool_timeouts",
+            "Count of tool calls cancelled at their configured timeout",
+            ["tool_name", "mcp_server"],
+            registry=registry,
+        )
 
     def all_tools(self) -> Sequence[StructuredTool]:
         logger.debug(f"ToolRegistry.all_tools: {list(self.registry.keys())}")
@@ -66,18 +127,10 @@ class ToolRegistry:
         """Merge explicit config with defaults, explicit takes precedence"""
         if explicit is None:
             # Use all defaults
-            return ToolConfig(
-                name=tool_name,
-                max_instances=default.max_instances,
-                timeout=default.timeout,
-            )
+            return default.model_copy(update={"name": tool_name})
 
         # Merge: explicit values override defaults
-        return ToolConfig(
-            name=tool_name,
-            max_instances=explicit.max_instances,
-            timeout=explicit.timeout,
-        )
+        return explicit.model_copy(update={"name": tool_name})
 
     def register_tools(
         self,
@@ -98,6 +151,27 @@ class ToolRegistry:
         Raises:
             ValueError: If tool is not configured in strict mode
         """
+        self.registry[tool.name] = self._tool_definition(tool, context)
+
+        logger.debug(f"Tool registered: {tool.name}")
+
+    def replace_mcp_tools(self, tools: Sequence[StructuredTool], context: ToolRegistrationContext) -> None:
+        """Replaces all the tools registered from an MCP server, eg after the server changed its tools.
+
+        Every tool is checked before any are replaced so a tool failing registration leaves the registry unchanged.
+
+        Raises:
+            ValueError: If tool is not configured in strict mode
+        """
+        definitions = {tool.name: self._tool_definition(tool, context) for tool in tools}
+
+        # Swapped in one assignment, calls in flight keep the definition they looked up
+        self.registry = {name: declaration for name, declaration in self.registry.items() if declaration.source != context.mcp_name} | definitions
+
+        logger.info(f"Tools from MCP '{context.mcp_name}' replaced: {list(definitions.keys())}")
+
+    def _tool_definition(self, tool: StructuredTool, context: ToolRegistrationContext | None = None) -> ToolDefinition:
+        """Builds the definition of a tool from its configuration, checking the tool is allowed"""
         tool_name = tool.name
 
         # Determine if this is a local tool (no context or source is local)
@@ -161,29 +235,69 @@ To resolve:
         else:
             raise ValueError(f"Unknown source: {context.source}")
 
-        # Register the tool
-        self.registry[tool_name] = ToolDefinition(
+        source = context.mcp_name if context is not None and context.source == "mcp" else "local"
+
+        # A tool registered again with the same configuration keeps its limiter and cache
+        # so its limits hold across reloads of the tools
+        existing = self.registry.get(tool_name)
+        if existing is not None and existing.source == source and existing.definition == tool_config:
+            return replace(existing, tool=tool)
+
+        return ToolDefinition(
             name=tool_name,
             tool=tool,
             definition=tool_config,
+            source=source,
+            limiter=ToolLimiter(
+                tool_name,
+                source,
+                tool_config.max_instances,
+                tool_config.max_queue,
+                self.tool_queue_depth_metric,
+                self.tool_wait_metric,
+                self.tool_rejected_metric,
+            ),
+            cache=(
+                ToolResultCache(
+                    tool_name,
+                    source,
+                    tool_config.cache,
+                    self.tool_cache_hits_metric,
+                    self.tool_cache_misses_metric,
+                    self.tool_cache_evictions_metric,
+                )
+                if tool_config.cache is not None
+                else None
+            ),
         )
 
-        logger.debug(f"Tool registered: {tool_name}")
+    @asynccontextmanager
+    async def _tool_slot(self, declaration: ToolDefinition, conversation_id: str):
+        """Hold a slot for the tool and a process wide slot while the tool executes"""
+        # The per tool limit is taken first so calls queued on a busy tool do not hold scheduler slots
+        async with declaration.limiter.acquire():
+            async with self.scheduler.acquire(conversation_id):
+                with self.tool_usage_metric.labels(declaration.name).time():
+                    yield
 
-    async def perform_tool_actions(self, parts: Sequence[ToolCall]) -> Sequence[ToolMessage]:
+    async def perform_tool_actions(
+        self,
+        parts: Sequence[ToolCall],
+        conversation_id: str = "default",
+        identity: str | None = None,
+    ) -> Sequence[ToolMessage]:
         """Performs actions using the registered tools.
         Reply back with an array to match what was called
         """
-        semaphore = asyncio.Semaphore(self.toolboxConfig.max_concurrent)
-
-        async def sem_task(tool: ToolCall) -> ToolMessage:
-            async with semaphore:
-                return await self.perform_tool_action(tool)
-
-        tasks = [sem_task(part) for part in parts]
+        tasks = [self.perform_tool_action(part, conversation_id, identity) for part in parts]
         return await asyncio.gather(*tasks)
 
-    async def perform_tool_action(self, tool_call: ToolCall) -> ToolMessage:
+    async def perform_tool_action(
+        self,
+        tool_call: ToolCall,
+        conversation_id: str = "default",
+        identity: str | None = None,
+    ) -> ToolMessage:
         """Performs an action using a single tool call part."""
 
         logger.debug(f"Received tool call: {tool_call}")
@@ -196,15 +310,16 @@ To resolve:
 
             logger.debug(f"Tool declaration found: {declaration}")
 
-            # Call the function with its arguments
-            with self.tool_usage_metric.labels(tool_name).time():
+            async def run() -> ToolMessage:
+                # Call the function with its arguments
                 result = await declaration.tool.ainvoke(tool_call["args"])
+                return ToolMessage(
+                    content=result,
+                    tool_call_id=tool_call["id"],
+                    status="success",
+                )
 
-            return ToolMessage(
-                content=result,
-                tool_call_id=tool_call["id"],
-                status="success",
-            )
+            return await self._execute(declaration, tool_call, conversation_id, identity, run)
 
         except Exception as e:
             logger.error(f"Error executing tool {tool_name}: {str(e)}")
@@ -213,3 +328,113 @@ To resolve:
                 tool_call_id=tool_call["id"],
                 status="error",
             )
+
+    async def awrap_tool_call(
+        self,
+        request: ToolCallRequest,
+        execute: Callable[[ToolCallRequest], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        """Wraps each tool call made by the ToolNode to apply the tool's configured limits."""
+        declaration = self.registry.get(request.tool_call["name"])
+
+        if declaration is None:
+            # Let the ToolNode report the unknown tool
+            return await execute(request)
+
+        # Tool calls are scheduled fairly between conversations, ie graph threads
+        config = request.runtime.config if request.runtime is not None else {}
+        configurable = config.get("configurable", {})
+
+        return await self._execute(
+            declaration,
+            request.tool_call,
+            configurable.get("thread_id", "default"),
+            configurable.get("identity"),
+            lambda: execute(request),
+        )
+
+    async def _execute(
+        self,
+        declaration: ToolDefinition,
+        tool_call: ToolCall,
+        conversation_id: str,
+        identity: str | None,
+        run: Callable[[], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        """Run a tool call with the tool's cache, coalescing, limits and timeout applied"""
+        cache = declaration.cache
+        if cache is None and not declaration.definition.coalesce:
+            return await self._execute_limited(declaration, tool_call, conversation_id, run)
+
+        key = call_key(tool_call["args"], identity if cache is not None and cache.config.include_identity else None)
+        if cache is not None:
+            cached = cache.get(key, tool_call["id"])
+            if cached is not None:
+                return cached
+
+        # Identical calls already in flight share the one upstream invocation
+        inflight_key = (declaration.name, key)
+        task = self.inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.create_task(self._execute_limited(declaration, tool_call, conversation_id, run))
+            self.inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self.inflight.pop(inflight_key) if self.inflight.get(inflight_key) is done else None)
+        else:
+            logger.debug(f"Tool call {tool_call['id']} to '{declaration.name}' coalesced with a call in flight")
+            self.tool_coalesced_metric.labels(declaration.name, declaration.source).inc()
+
+        # Shielded so a cancelled caller does not cancel the call for the others waiting on it
+        result = await asyncio.shield(task)
+
+        if isinstance(result, ToolMessage):
+            # Each caller gets its own message, coalesced callers would otherwise share one id
+            result = result.model_copy(update={"tool_call_id": tool_call["id"], "id": None})
+            if cache is not None:
+                cache.put(key, result)
+        return result
+
+    async def _execute_limited(
+        self,
+        declaration: ToolDefinition,
+        tool_call: ToolCall,
+        conversation_id: str,
+        run: Callable[[], Awaitable[ToolMessage | Command]],
+    ) -> ToolMessage | Command:
+        """Run a tool call within the tool's limits and timeout"""
+        try:
+            async with self._tool_slot(declaration, conversation_id):
+                # Cancelling an MCP tool call closes the session it opened, which ends the
+                # request on the server for transports that support it (streamable_http)
+                async with asyncio.timeout(declaration.definition.timeout.total_seconds()):
+                    result = await run()
+        except TimeoutError:
+            return self._timeout_message(declaration, tool_call["id"])
+        except ToolQueueFullError as e:
+            logger.warning(str(e))
+            return ToolMessage(
+                content=str(e),
+                name=declaration.name,
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+        return result
+
+    def _timeout_message(self, declaration: ToolDefinition, tool_call_id: str) -> ToolMessage:
+        """Reply to the LLM for a tool call that was cancelled at its timeout"""
+        timeout = declaration.definition.timeout.total_seconds()
+        logger.warning(f"Tool '{declaration.name}' from '{declaration.source}' timed out after {timeout}s")
+        self.tool_timeout_metric.labels(declaration.name, declaration.source).inc()
+
+        return ToolMessage(
+            content=json.dumps(
+                {
+                    "error": "timeout",
+                    "tool": declaration.name,
+                    "timeout_seconds": timeout,
+                    "message": f"Tool '{declaration.name}' did not complete within {timeout} seconds and was cancelled",
+                }
+            ),
+            name=declaration.name,
+            tool_call_id=tool_call_id,
+            status="error",
+        )
@@ -0,0 +1,115 @@
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge, Summary
+
+logger = logging.getLogger(__name__)
+
+
+class ToolScheduler:
+    """
+    Process wide limit on the number of tool calls executing at once.
+
+    When all max_concurrent slots are busy, callers queue per conversation and a freed
+    slot goes to the waiting conversation with the fewest calls executing, and of those
+    the one served least recently, so one conversation issuing many parallel tool
+    calls cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent: int, registry: CollectorRegistry | None = REGISTRY):
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self.waiting = 0
+        self.queues: dict[str, deque[asyncio.Future]] = {}
+        self.active: dict[str, int] = {}
+        self.last_served: dict[str, int] = {}
+        self.grants = 0
+
+        self.capacity_metric = Gauge("tool_scheduler_capacity", "Maximum number of tool calls executing at once", registry=registry)
+        self.capacity_metric.set(max_concurrent)
+        self.running_metric = Gauge("tool_scheduler_running", "Number of tool calls executing", registry=registry)
+        self.waiting_metric = Gauge("tool_scheduler_waiting", "Number of tool calls waiting for a slot", registry=registry)
+        self.conversations_metric = Gauge("tool_scheduler_waiting_conversations", "Number of conversations with tool calls waiting for a slot", registry=registry)
+        self.wait_metric = Summary("tool_scheduler_wait", "Time tool calls waited for a slot", registry=registry)
+
+    @asynccontextmanager
+    async def acquire(self, conversation_id: str):
+        """Hold one of the process wide tool slots for the duration of the context"""
+        start = time.perf_counter()
+        if self.running < self.max_concurrent and not self.waiting:
+            self.running += 1
+            self._grant(conversation_id)
+        else:
+            await self._wait(conversation_id)
+        self.wait_metric.observe(time.perf_counter() - start)
+        self._update_metrics()
+
+        try:
+            yield
+        finally:
+            self._release(conversation_id)
+
+    async def _wait(self, conversation_id: str) -> None:
+        """Queue for a slot, it is handed over by _release with running and active already updated"""
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(conversation_id, deque()).append(future)
+        self.waiting += 1
+        self._update_metrics()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as the caller was cancelled, pass it on
+                self._release(conversation_id)
+            else:
+                self._discard(conversation_id, future)
+            raise
+
+    def _discard(self, conversation_id: str, future: asyncio.Future) -> None:
+        queue = self.queues.get(conversation_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[conversation_id]
+                if conversation_id not in self.active:
+                    self.last_served.pop(conversation_id, None)
+        self._update_metrics()
+
+    def _grant(self, conversation_id: str) -> None:
+        self.grants += 1
+        self.active[conversation_id] = self.active.get(conversation_id, 0) + 1
+        self.last_served[conversation_id] = self.grants
+
+    def _release(self, conversation_id: str) -> None:
+        """Hand the slot to the next conversation in turn, or free it if nothing is waiting"""
+        self.active[conversation_id] -= 1
+        if not self.active[conversation_id]:
+            del self.active[conversation_id]
+            if conversation_id not in self.queues:
+                del self.last_served[conversation_id]
+
+        while self.queues:
+            next_id = min(self.queues, key=lambda waiting_id: (self.active.get(waiting_id, 0), self.last_served.get(waiting_id, 0)))
+            queue = self.queues[next_id]
+            future = queue.popleft()
+            self.waiting -= 1
+            if not queue:
+                del self.queues[next_id]
+            if not future.done():
+                self._grant(next_id)
+                future.set_result(None)
+                self._update_metrics()
+                return
+
+        self.running -= 1
+        self._update_metrics()
+
+    def _update_metrics(self) -> None:
+        self.running_metric.set(self.running)
+        self.waiting_metric.set(self.waiting)
+        self.conversations_metric.set(len(self.queues))
@@ -1,15 +1,29 @@
+from collections.abc import Awaitable
 from dataclasses import dataclass, field
+from typing import TypeVar
+import asyncio
 import logging
+import time
 from aiohttp import web
 from chatbot.config import ServiceConfig
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from chatbot.config.tool import McpConfig
+from langchain_mcp_adapters.prompts import load_mcp_prompt
+from langchain_mcp_adapters.resources import load_mcp_resources
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+from mcp.types import Tool
+from prometheus_client import REGISTRY, Summary
 from chatbot import keys
+from chatbot.startup import startup_phase
+from .sessionpool import McpSessionPool, McpSessionPools
+from .toolsnapshot import ToolSnapshots
 from langchain_core.tools.structured import StructuredTool
 from langchain_core.documents.base import Blob
 from langchain_core.messages import AIMessage, HumanMessage
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 @dataclass
 class MCPObjects:
@@ -19,102 +33,304 @@ class MCPObjects:
     all_tools: list[StructuredTool] = field(default_factory=list)
     resources: dict[str, list[Blob]] = field(default_factory=dict)
     prompts: dict[str, dict[str, list[HumanMessage | AIMessage]]] = field(default_factory=dict)
+    sessions: McpSessionPools | None = None
+    snapshots: ToolSnapshots | None = None
+    # Checks the servers started from tool snapshots against the live servers
+    revalidation: asyncio.Task | None = None
 
     def get_tools_for_mcp(self, mcp_name: str) -> list[StructuredTool]:
         """Get tools for a specific MCP server"""
         return self.tools_by_mcp.get(mcp_name, [])
 
+    def set_tools_for_mcp(self, mcp_name: str, tools: list[StructuredTool]) -> None:
+        """Replace the tools of a specific MCP server, eg after they were reloaded"""
+        self.tools_by_mcp[mcp_name] = tools
+        self.all_tools = [tool for mcp_tools in self.tools_by_mcp.values() for tool in mcp_tools]
 
-async def connect_to_mcp_server(app):
+
+def tool_signature(tools: list[StructuredTool]) -> list[tuple]:
+    """The parts of the tools that the LLM sees, used to tell if a server's tools changed"""
+    return sorted(((tool.name, tool.description, tool.args_schema) for tool in tools), key=lambda signature: signature[0])
+
+
+async def list_mcp_tools(pool: McpSessionPool) -> list[Tool]:
+    """Lists all the tools of an MCP server, following the pagination"""
+    tools: list[Tool] = []
+    cursor: str | None = None
+    while True:
+        page = await pool.list_tools(cursor=cursor)
+        tools.extend(page.tools)
+        cursor = page.nextCursor
+        if not cursor:
+            return tools
+
+
+def convert_tools(pool: McpSessionPool, mcp_name: str, tools: list[Tool]) -> list[StructuredTool]:
+    """LangChain tools for the MCP tools, making their calls through the session pool"""
+    return [convert_mcp_tool_to_langchain_tool(pool, tool, server_name=mcp_name) for tool in tools]
+
+
+async def load_changed_tools(mcpObjects: MCPObjects, mcp: McpConfig) -> list[StructuredTool] | None:
     """
-    Establishes a connection to the MCP server
+    Reloads the tools of an MCP server, returning them only if they differ from the tools held for it
     """
+    pool = mcpObjects.sessions.get(mcp.name)
+    tools = await list_mcp_tools(pool)
+    mcp_tools = convert_tools(pool, mcp.name, tools)
 
-    config: ServiceConfig = app[keys.config]
+    if tool_signature(mcp_tools) == tool_signature(mcpObjects.get_tools_for_mcp(mcp.name)):
+        logger.debug(f"MCP server '{mcp.name}' tools unchanged")
+        return None
 
-    toolbox_config = config.myai.toolbox
+    logger.info(f"MCP server '{mcp.name}' tools changed to: {[tool.name for tool in mcp_tools]}")
+    if mcpObjects.snapshots is not None:
+        await mcpObjects.snapshots.save(mcp, tools)
+    return mcp_tools
+
+
+async def timed_phase(phase_metric: Summary, timings: dict[str, float], mcp_name: str, phase: str, coroutine: Awaitable[T]) -> T:
+    """Await a discovery phase recording how long it took"""
+    start = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        timings[phase] = time.perf_counter() - start
+        phase_metric.labels(mcp_name, phase).observe(timings[phase])
+
+
+async def discover_mcp(
+    mcp: McpConfig,
+    pool: McpSessionPool,
+    configured_tool_names: set[str],
+    phase_metric: Summary,
+    snapshots: ToolSnapshots | None = None,
+) -> tuple[list[StructuredTool], list[Blob], dict[str, list[HumanMessage | AIMessage]], dict[str, float]]:
+    """
+    Fetches the tools, resources and prompts of one MCP server concurrently.
+
+    Tools are required, failing to get them within the server's startup timeout raises.
+    Resources and prompts are optional and are left empty on failure.
+    The tools are saved to the snapshots if given.
+    """
+    timings: dict[str, float] = {}
+    deadline = asyncio.get_running_loop().time() + mcp.startup_timeout.total_seconds()
+
+    async def get_tools() -> list[Tool]:
+        async with asyncio.timeout_at(deadline):
+            return await list_mcp_tools(pool)
+
+    async def get_resources() -> list[Blob]:
+        try:
+            async with asyncio.timeout_at(deadline):
+                return await load_mcp_resources(pool)
+        except Exception as e:
+            logger.warning(f"Failed to get resources from MCP '{mcp.name}': {str(e) or type(e).__name__}")
+            return []
+
+    async def get_prompt(prompt: str) -> list[HumanMessage | AIMessage]:
+        async with asyncio.timeout_at(deadline):
+            return await load_mcp_prompt(pool, prompt)
+
+    async def get_prompts() -> dict[str, list[HumanMessage | AIMessage]]:
+        try:
+            messages = await asyncio.gather(*[get_prompt(prompt) for prompt in mcp.prompts])
+        except Exception as e:
+            logger.warning(f"Failed to get prompts from MCP '{mcp.name}': {str(e) or type(e).__name__}")
+            return {}
+        return dict(zip(mcp.prompts, messages))
+
+    start = time.perf_counter()
+    logger.info(f"Connecting to MCP server '{mcp.name}' at {mcp.url}")
 
-    # Create the multi-server MCP client
     try:
-        client = MultiServerMCPClient({mcp.name: {"url": str(mcp.url), "transport": mcp.transport.value} for mcp in toolbox_config.mcps})
+        tools, resources, prompts = await asyncio.gather(
+            timed_phase(phase_metric, timings, mcp.name, "tools", get_tools()),
+            timed_phase(phase_metric, timings, mcp.name, "resources", get_resources()),
+            timed_phase(phase_metric, timings, mcp.name, "prompts", get_prompts()),
+        )
     except Exception as e:
-        error_msg = f"Failed to create MCP client: {str(e)}"
+        if isinstance(e, TimeoutError):
+            e = TimeoutError(f"No tools within startup timeout of {mcp.startup_timeout.total_seconds()}s")
+        error_msg = f"""Failed to connect to MCP server '{mcp.name}' at {mcp.url}
+Error: {str(e)}
+
+The application cannot start without connecting to all configured MCP servers.
+"""
         logger.error(error_msg)
         raise RuntimeError(error_msg) from e
+    finally:
+        timings["total"] = time.perf_counter() - start
+        phase_metric.labels(mcp.name, "total").observe(timings["total"])
 
-    # Track tools per MCP and all tools
-    tools_by_mcp = {}
-    all_tools = []
+    if snapshots is not None:
+        await snapshots.save(mcp, tools)
 
-    # Get configured tool names for warning about removed tools
-    configured_tool_names = {tool.name for tool in toolbox_config.tools if tool.name is not None}
+    mcp_tools = convert_tools(pool, mcp.name, tools)
+
+    # Check if MCP returned no tools
+    if not mcp_tools:
+        logger.warning(f"MCP server '{mcp.name}' at {mcp.url} returned no tools")
+    else:
+        logger.info(f"MCP server '{mcp.name}' returned {len(mcp_tools)} tools: " f"{[tool.name for tool in mcp_tools]}")
 
-    # Connect to each MCP server individually
-    for mcp in toolbox_config.mcps:
+    # Check for configured tools that are no longer available
+    mcp_tool_names = {tool.name for tool in mcp_tools}
+    for configured_tool in configured_tool_names:
+        if configured_tool not in mcp_tool_names:
+            # This tool was configured but not returned by this MCP
+            # We can't be 100% sure it came from this MCP, but log a warning
+            logger.debug(f"Tool '{configured_tool}' is configured but not " f"available from MCP server '{mcp.name}'")
+
+    return mcp_tools, resources, prompts, timings
+
+
+async def warm_start_mcp(
+    mcp: McpConfig,
+    pool: McpSessionPool,
+    snapshots: ToolSnapshots,
+    phase_metric: Summary,
+) -> tuple[list[StructuredTool], list[Blob], dict[str, list[HumanMessage | AIMessage]], dict[str, float]] | None:
+    """
+    Takes the tools of one MCP server from its snapshot, without waiting on the server.
+    Returns None if there is no usable snapshot. Resources and prompts are left for the revalidation.
+    """
+    timings: dict[str, float] = {}
+    snapshot = await timed_phase(phase_metric, timings, mcp.name, "snapshot", snapshots.load(mcp))
+    if snapshot is None:
+        return None
+
+    mcp_tools = convert_tools(pool, mcp.name, snapshot.tools)
+    logger.info(f"MCP server '{mcp.name}' started from tool snapshot saved at {snapshot.saved}, " f"{len(mcp_tools)} tools: {[tool.name for tool in mcp_tools]}")
+
+    return mcp_tools, [], {}, timings
+
+
+async def revalidate_mcps(mcpObjects: MCPObjects, mcps: list[McpConfig], configured_tool_names: set[str], phase_metric: Summary):
+    """
+    Discovers the MCP servers that were started from snapshots against the live servers.
+    Servers whose tools differ from their snapshot are flagged as changed so their tools are reloaded.
+    """
+
+    async def revalidate(mcp: McpConfig):
+        pool = mcpObjects.sessions.get(mcp.name)
         try:
-            logger.info(f"Connecting to MCP server '{mcp.name}' at {mcp.url}")
+            mcp_tools, resources, prompts, _ = await discover_mcp(mcp, pool, configured_tool_names, phase_metric, mcpObjects.snapshots)
+        except RuntimeError:
+            logger.warning(f"Could not revalidate the tools of MCP '{mcp.name}', serving the tools from its snapshot until its next refresh")
+            return
 
-            # Get tools from this specific MCP
-            mcp_tools = await client.get_tools(server_name=mcp.name)
+        mcpObjects.resources[mcp.name] = resources
+        mcpObjects.prompts[mcp.name] = prompts
+        if tool_signature(mcp_tools) != tool_signature(mcpObjects.get_tools_for_mcp(mcp.name)):
+            logger.info(f"MCP server '{mcp.name}' tools differ from its snapshot")
+            pool.tools_changed.set()
+        elif prompts:
+            # Wakes the watcher of the server to add its prompts to the instructions
+            pool.tools_changed.set()
 
-            # Check if MCP returned no tools
-            if not mcp_tools:
-                logger.warning(f"MCP server '{mcp.name}' at {mcp.url} returned no tools")
-            else:
-                logger.info(f"MCP server '{mcp.name}' returned {len(mcp_tools)} tools: " f"{[tool.name for tool in mcp_tools]}")
+    await asyncio.gather(*[revalidate(mcp) for mcp in mcps])
 
-            # Check for configured tools that are no longer available
-            mcp_tool_names = {tool.name for tool in mcp_tools}
-            for configured_tool in configured_tool_names:
-                if configured_tool not in mcp_tool_names:
-                    # This tool was configured but not returned by this MCP
-                    # We can't be 100% sure it came from this MCP, but log a warning
-                    logger.debug(f"Tool '{configured_tool}' is configured but not " f"available from MCP server '{mcp.name}'")
 
-            # Store tools for this MCP
-            tools_by_mcp[mcp.name] = mcp_tools
-            all_tools.extend(mcp_tools)
+async def connect_to_mcp_server(app):
+    """
+    Establishes a connection to the MCP servers, discovering all of them concurrently
+    """
 
-        except Exception as e:
-            error_msg = f"""Failed to connect to MCP server '{mcp.name}' at {mcp.url}
-Error: {str(e)}
+    config: ServiceConfig = app[keys.config]
 
-The application cannot start without connecting to all configured MCP servers.
-"""
-            logger.error(error_msg)
-            raise RuntimeError(error_msg) from e
+    toolbox_config = config.myai.toolbox
+
+    # Persistent sessions to each MCP server, shared by discovery and the tools
+    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+    sessions = McpSessionPools(toolbox_config.mcps, registry=registry)
+    phase_metric = Summary("mcp_discovery", "Time taken by each phase of MCP discovery at startup", ["mcp_server", "phase"], registry=registry)
+
+    snapshots = ToolSnapshots(toolbox_config.snapshot_dir) if toolbox_config.snapshot_dir is not None else None
+
+    # Get configured tool names for warning about removed tools
+    configured_tool_names = {tool.name for tool in toolbox_config.tools if tool.name is not None}
 
-    # Get resources and prompts (these are per-MCP already)
+    # Servers started from their snapshot, to be revalidated once the service is up
+    warm_started: list[McpConfig] = []
+
+    async def start_mcp(mcp: McpConfig):
+        pool = sessions.get(mcp.name)
+        if snapshots is not None:
+            started = await warm_start_mcp(mcp, pool, snapshots, phase_metric)
+            if started is not None:
+                warm_started.append(mcp)
+                return started
+        return await discover_mcp(mcp, pool, configured_tool_names, phase_metric, snapshots)
+
+    start = time.perf_counter()
+    try:
+        discovered = await asyncio.gather(*[start_mcp(mcp) for mcp in toolbox_config.mcps])
+    except BaseException:
+        # Also on cancellation, eg the app shutting down while discovery is still running
+        await sessions.close()
+        raise
+
+    # Track tools per MCP and all tools, resources and prompts are per-MCP already
+    tools_by_mcp = {}
+    all_tools = []
     resources = {}
     prompts = {}
+    for mcp, (mcp_tools, mcp_resources, mcp_prompts, timings) in zip(toolbox_config.mcps, discovered):
+        tools_by_mcp[mcp.name] = mcp_tools
+        all_tools.extend(mcp_tools)
+        resources[mcp.name] = mcp_resources
+        prompts[mcp.name] = mcp_prompts
+        logger.info(f"MCP '{mcp.name}' discovery timings: " + ", ".join(f"{phase}={seconds:.3f}s" for phase, seconds in timings.items()))
 
-    for mcp in toolbox_config.mcps:
-        try:
-            resources[mcp.name] = await client.get_resources(mcp.name)
-        except Exception as e:
-            logger.warning(f"Failed to get resources from MCP '{mcp.name}': {str(e)}")
-            resources[mcp.name] = []
+    # Filled in place as discovery completes after the app has started
+    mcpObjects: MCPObjects = app[keys.mcpobjects]
+    mcpObjects.tools_by_mcp = tools_by_mcp
+    mcpObjects.all_tools = all_tools
+    mcpObjects.resources = resources
+    mcpObjects.prompts = prompts
+    mcpObjects.sessions = sessions
+    mcpObjects.snapshots = snapshots
+    sessions.start()
 
-        try:
-            prompts[mcp.name] = {prompt: await client.get_prompt(mcp.name, prompt) for prompt in mcp.prompts}
-        except Exception as e:
-            logger.warning(f"Failed to get prompts from MCP '{mcp.name}': {str(e)}")
-            prompts[mcp.name] = {}
+    if warm_started:
+        mcpObjects.revalidation = asyncio.create_task(revalidate_mcps(mcpObjects, warm_started, configured_tool_names, phase_metric))
 
-    mcpObjects = MCPObjects(
-        tools_by_mcp=tools_by_mcp,
-        all_tools=all_tools,
-        resources=resources,
-        prompts=prompts,
-    )
+    logger.info(f"MCP initialization complete in {time.perf_counter() - start:.3f}s. Total tools: {len(all_tools)}, MCPs: {list(tools_by_mcp.keys())}")
 
-    logger.info(f"MCP initialization complete. Total tools: {len(all_tools)}, " f"MCPs: {list(tools_by_mcp.keys())}")
 
-    app[keys.mcpobjects] = mcpObjects
+async def discover_in_background(app: web.Application):
+    """
+    Run the MCP discovery as a background task so the listener and HaMS start without waiting on the MCP servers
+    """
+
+    async def discovery():
+        with startup_phase(app, "mcp_discovery"):
+            await connect_to_mcp_server(app)
+
+    app[keys.mcp_discovery] = asyncio.create_task(discovery())
+
+    yield
+
+    app[keys.mcp_discovery].cancel()
+    await asyncio.gather(app[keys.mcp_discovery], return_exceptions=True)
+
+
+async def close_mcp_sessions(app):
+    """
+    Closes the persistent sessions to the MCP servers
+    """
+    mcpObjects: MCPObjects = app[keys.mcpobjects]
+    if mcpObjects.revalidation is not None:
+        mcpObjects.revalidation.cancel()
+        await asyncio.gather(mcpObjects.revalidation, return_exceptions=True)
+    if mcpObjects.sessions is not None:
+        await mcpObjects.sessions.close()
 
 
 def mcp_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
 
-    app.on_startup.append(connect_to_mcp_server)
+    app[keys.mcpobjects] = MCPObjects()
+    app.cleanup_ctx.append(discover_in_background)
+    app.on_cleanup.append(close_mcp_sessions)
 
     return app
@@ -0,0 +1,254 @@
+from collections import deque
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+from typing import Any
+import asyncio
+import logging
+import time
+
+from langchain_mcp_adapters.sessions import Connection, create_session
+from mcp import ClientSession
+from mcp.types import ServerNotification, ToolListChangedNotification
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Summary
+
+from chatbot.config.tool import McpConfig
+
+logger = logging.getLogger(__name__)
+
+
+class McpSession:
+    """
+    An initialised MCP session held open until closed.
+
+    The session is owned by its own task as the MCP transports use task groups that
+    must be exited by the task that entered them.
+    """
+
+    def __init__(self, connection: Connection, clock: Callable[[], float] = time.monotonic):
+        self.connection = connection
+        self.clock = clock
+        self.session: ClientSession | None = None
+        self.error: Exception | None = None
+        self.ready = asyncio.Event()
+        self.closing = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.last_used = clock()
+
+    async def open(self) -> None:
+        """Connect and initialise the session, raising if that fails"""
+        self.task = asyncio.create_task(self._run())
+        await self.ready.wait()
+        if self.session is None:
+            raise self.error or RuntimeError("MCP session closed during initialisation")
+
+    async def _run(self) -> None:
+        try:
+            async with create_session(self.connection) as session:
+                await session.initialize()
+                self.session = session
+                self.ready.set()
+                await self.closing.wait()
+        except Exception as e:
+            self.error = e
+            logger.debug(f"MCP session ended with error: {e}")
+        finally:
+            self.session = None
+            self.ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.closing.is_set()
+
+    def close(self) -> None:
+        """Ask the owning task to close the session, it completes in the background"""
+        self.closing.set()
+        if self.task is not None and not self.ready.is_set():
+            # Still connecting, which may never complete
+            self.task.cancel()
+
+    async def wait_closed(self) -> None:
+        if self.task is not None:
+            await self.task
+
+
+class McpSessionPool:
+    """
+    Pool of persistent sessions to one MCP server.
+
+    Implements the ClientSession calls used by langchain_mcp_adapters, each taking a
+    session from the pool, so tools loaded with the pool as their session reuse open
+    sessions rather than connecting and initialising for every call.
+
+    A session that raises or is cancelled mid call is closed, rather than returned to
+    the pool, as its state is unknown. Closing the session ends the call on the server
+    for transports that support it. The next call opens a fresh session.
+    """
+
+    def __init__(
+        self,
+        config: McpConfig,
+        opened_metric: Counter,
+        reused_metric: Counter,
+        closed_metric: Counter,
+        open_metric: Gauge,
+        connect_metric: Summary,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = config.name
+        self.connection: Connection = {
+            "url": str(config.url),
+            "transport": config.transport.value,
+            "session_kwargs": {"message_handler": self._message_handler},
+        }
+        self.keepalive = config.pool.keepalive.total_seconds()
+        self.clock = clock
+        self.semaphore = asyncio.Semaphore(config.pool.size)
+        self.idle: deque[McpSession] = deque()
+        self.sessions: set[McpSession] = set()
+        self.keepalive_task: asyncio.Task | None = None
+        # Set when the server announces its tools changed on any of the sessions
+        self.tools_changed = asyncio.Event()
+
+        self.opened_metric = opened_metric.labels(self.name)
+        self.reused_metric = reused_metric.labels(self.name)
+        self.closed_metric = closed_metric
+        self.open_metric = open_metric.labels(self.name)
+        self.connect_metric = connect_metric.labels(self.name)
+
+    def start(self) -> None:
+        """Start pinging idle sessions"""
+        if self.keepalive_task is None:
+            self.keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def close(self) -> None:
+        """Stop the keepalive and close all sessions"""
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+
+        sessions = list(self.sessions)
+        for pooled in sessions:
+            self._discard(pooled, "shutdown")
+        await asyncio.gather(*[pooled.wait_closed() for pooled in sessions], return_exceptions=True)
+
+    @asynccontextmanager
+    async def session(self):
+        """Use a pooled session for the duration of the context"""
+        async with self.semaphore:
+            pooled = self._take_idle() or await self._open()
+            try:
+                yield pooled.session
+            except BaseException:
+                self._discard(pooled, "error")
+                raise
+
+            pooled.last_used = self.clock()
+            self.idle.append(pooled)
+
+    def _take_idle(self) -> McpSession | None:
+        while self.idle:
+            pooled = self.idle.pop()
+            if pooled.alive:
+                self.reused_metric.inc()
+                return pooled
+            self._discard(pooled, "dead")
+        return None
+
+    async def _open(self) -> McpSession:
+        pooled = McpSession(self.connection, clock=self.clock)
+        with self.connect_metric.time():
+            try:
+                await pooled.open()
+            except BaseException:
+                pooled.close()
+                self.closed_metric.labels(self.name, "connect_failed").inc()
+                raise
+
+        logger.debug(f"Opened MCP session to '{self.name}'")
+        self.sessions.add(pooled)
+        self.opened_metric.inc()
+        self.open_metric.set(len(self.sessions))
+        return pooled
+
+    def _discard(self, pooled: McpSession, reason: str) -> None:
+        logger.debug(f"Closing MCP session to '{self.name}': {reason}")
+        pooled.close()
+        if pooled in self.sessions:
+            self.sessions.discard(pooled)
+            self.closed_metric.labels(self.name, reason).inc()
+            self.open_metric.set(len(self.sessions))
+
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive)
+            now = self.clock()
+            for pooled in [pooled for pooled in self.idle if now - pooled.last_used >= self.keepalive]:
+                self.idle.remove(pooled)
+                try:
+                    async with asyncio.timeout(self.keepalive):
+                        await pooled.session.send_ping()
+                except Exception as e:
+                    logger.warning(f"MCP session to '{self.name}' failed keepalive: {e}")
+                    self._discard(pooled, "keepalive")
+                    continue
+                pooled.last_used = self.clock()
+                self.idle.append(pooled)
+
+    async def _message_handler(self, message: Any) -> None:
+        if isinstance(message, ServerNotification) and isinstance(message.root, ToolListChangedNotification):
+            logger.info(f"MCP server '{self.name}' announced its tools changed")
+            self.tools_changed.set()
+
+    async def wait_tools_changed(self, timeout: float | None) -> None:
+        """Wait for the server to announce its tools changed, or for the timeout to pass"""
+        try:
+            async with asyncio.timeout(timeout):
+                await self.tools_changed.wait()
+        except TimeoutError:
+            pass
+        self.tools_changed.clear()
+
+    # ClientSession calls used by langchain_mcp_adapters
+
+    async def call_tool(self, *args: Any, **kwargs: Any) -> Any:
+        async with self.session() as session:
+            return await session.call_tool(*args, **kwargs)
+
+    async def list_tools(self, *args: Any, **kwargs: Any) -> Any:
+        async with self.session() as session:
+            return await session.list_tools(*args, **kwargs)
+
+    async def list_resources(self, *args: Any, **kwargs: Any) -> Any:
+        async with self.session() as session:
+            return await session.list_resources(*args, **kwargs)
+
+    async def read_resource(self, *args: Any, **kwargs: Any) -> Any:
+        async with self.session() as session:
+            return await session.read_resource(*args, **kwargs)
+
+    async def get_prompt(self, *args: Any, **kwargs: Any) -> Any:
+        async with self.session() as session:
+            return await session.get_prompt(*args, **kwargs)
+
+
+class McpSessionPools:
+    """Session pools for each configured MCP server, sharing one set of metrics"""
+
+    def __init__(self, mcps: list[McpConfig], registry: CollectorRegistry | None = REGISTRY):
+        opened_metric = Counter("mcp_sessions_opened", "Count of MCP sessions opened", ["mcp_server"], registry=registry)
+        reused_metric = Counter("mcp_sessions_reused", "Count of MCP calls made on an already open session", ["mcp_server"], registry=registry)
+        closed_metric = Counter("mcp_sessions_closed", "Count of MCP sessions closed", ["mcp_server", "reason"], registry=registry)
+        open_metric = Gauge("mcp_sessions_open", "Number of MCP sessions open", ["mcp_server"], registry=registry)
+        connect_metric = Summary("mcp_session_connect", "Time to connect and initialise an MCP session", ["mcp_server"], registry=registry)
+
+        self.pools = {mcp.name: McpSessionPool(mcp, opened_metric, reused_metric, closed_metric, open_metric, connect_metric) for mcp in mcps}
+
+    def get(self, mcp_name: str) -> McpSessionPool:
+        return self.pools[mcp_name]
+
+    def start(self) -> None:
+        for pool in self.pools.values():
+            pool.start()
+
+    async def close(self) -> None:
+        await asyncio.gather(*[pool.close() for pool in self.pools.values()])
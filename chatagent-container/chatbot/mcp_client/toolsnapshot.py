@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+from pathlib import Path
+import asyncio
+import logging
+import os
+
+from mcp.types import Tool
+from pydantic import BaseModel, Field, ValidationError
+
+from chatbot.config.tool import McpConfig
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the snapshot changes, snapshots of other versions are ignored
+SNAPSHOT_VERSION = 1
+
+
+class McpToolSnapshot(BaseModel):
+    """The tool schemas of an MCP server as last listed from it"""
+
+    version: int = Field(description="Layout version of the snapshot")
+    mcp_name: str = Field(description="Name of the MCP server")
+    url: str = Field(description="URL the tools were listed from")
+    saved: datetime = Field(description="When the tools were listed")
+    tools: list[Tool] = Field(description="Tools as listed by the MCP server")
+
+
+class ToolSnapshots:
+    """
+    Snapshots of the tools of each MCP server kept in a local directory, one file per server.
+
+    A new process binds its tools from the snapshots rather than waiting on the MCP servers,
+    the tools are then revalidated against the live servers.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def path(self, mcp_name: str) -> Path:
+        return self.directory / f"{mcp_name}.json"
+
+    async def load(self, mcp: McpConfig) -> McpToolSnapshot | None:
+        """The snapshot of the tools of the MCP server, None if there is no usable snapshot"""
+        return await asyncio.to_thread(self._load, mcp)
+
+    async def save(self, mcp: McpConfig, tools: list[Tool]) -> None:
+        """Save the tools of the MCP server, failures are logged as the snapshot is only an optimisation"""
+        snapshot = McpToolSnapshot(
+            version=SNAPSHOT_VERSION,
+            mcp_name=mcp.name,
+            url=str(mcp.url),
+            saved=datetime.now(timezone.utc),
+            tools=tools,
+        )
+        await asyncio.to_thread(self._save, snapshot)
+
+    def _load(self, mcp: McpConfig) -> McpToolSnapshot | None:
+        path = self.path(mcp.name)
+        try:
+            snapshot = McpToolSnapshot.model_validate_json(path.read_bytes())
+        except FileNotFoundError:
+            logger.info(f"No tool snapshot for MCP '{mcp.name}' at {path}")
+            return None
+        except (OSError, ValidationError) as e:
+            logger.warning(f"Ignoring unreadable tool snapshot for MCP '{mcp.name}' at {path}: {e}")
+            return None
+
+        if snapshot.version != SNAPSHOT_VERSION or snapshot.mcp_name != mcp.name or snapshot.url != str(mcp.url):
+            logger.info(f"Ignoring tool snapshot for MCP '{mcp.name}' at {path}, it is from another version or server")
+            return None
+
+        return snapshot
+
+    def _save(self, snapshot: McpToolSnapshot) -> None:
+        path = self.path(snapshot.mcp_name)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Written aside then renamed so a reader never sees a partial snapshot
+            partial = path.with_suffix(f".{os.getpid()}.tmp")
+            partial.write_text(snapshot.model_dump_json(by_alias=True, exclude_none=True))
+            os.replace(partial, path)
+        except OSError as e:
+            logger.warning(f"Failed to save tool snapshot for MCP '{snapshot.mcp_name}' to {path}: {e}")
+            return
+
+        logger.debug(f"Saved tool snapshot for MCP '{snapshot.mcp_name}' to {path}")
@@ -40,13 +40,14 @@ async def service_coroutine_cleanup(app: web.Application):
     yield
 
     app[keys.coroutine].cancel()
+    await asyncio.gather(app[keys.coroutine], return_exceptions=True)
 
     logger.info("Service: coroutine cleanup")
 
 
-def service_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
+def events_app_create(app: web.Application) -> web.Application:
     """
-    Create the service with the given configuration file
+    Create the capacity model of the service, conversation turns reserve capacity from it and are shed when it is full
     """
     registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
 
@@ -54,6 +55,15 @@ def service_app_create(app: web.Application, config: ServiceConfig) -> web.Appli
 
     app.cleanup_ctx.append(service_coroutine_cleanup)
 
+    return app
+
+
+def service_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
+    """
+    Create the service with the given configuration file
+    """
+    events_app_create(app)
+
     print(f"Service: {app[keys.config].webservice.url.host}:{app[keys.config].webservice.url.port}/{app[keys.config].webservice.prefix}")
 
     app.add_routes(
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from chatbot.config import EventConfig
-from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
 
 import logging
 
@@ -30,6 +30,7 @@ class Events:
         self.chunkCount = chunkCount
         self.prometheus_registry = registry
         self.chunkGauge = Gauge("chunk_gauge", "Count of chunks remaining", registry=registry)
+        self.admissionCounter = Counter("turn_admissions", "Count of conversation turns admitted or shed for lack of spare capacity", ["result"], registry=registry)
 
     def updateChunk(self, time: datetime) -> int:
         if self.lastTime < time:
@@ -50,5 +51,27 @@ class Events:
         self.chunkGauge.set(self.chunkCount)
         return self.chunkCount
 
-    def spareCapacity(self) -> bool:
-        return self.chunkCount <= self.config.maxChunks
+    def spareCapacity(self, chunks: int | None = None) -> bool:
+        """Whether there is the capacity to admit a turn of chunks, by default turnChunks"""
+        chunks = chunks if chunks is not None else self.config.turnChunks
+        return self.chunkCount + chunks <= self.config.maxChunks
+
+    def admit(self, chunks: int | None = None) -> bool:
+        """
+        Reserve capacity for a conversation turn, by default turnChunks.
+        Returns False without reserving if the capacity is not spare, the turn should be shed rather than queued.
+        """
+        chunks = chunks if chunks is not None else self.config.turnChunks
+        if not self.spareCapacity(chunks):
+            self.admissionCounter.labels("shed").inc()
+            logger.warning(f"Shedding turn, {self.chunkCount} chunks reserved of {self.config.maxChunks}")
+            return False
+
+        self.addChunks(chunks)
+        self.admissionCounter.labels("admitted").inc()
+        return True
+
+    def retryAfter(self, chunks: int | None = None) -> timedelta:
+        """Time until there is the capacity to admit a turn, as the reserved chunks are processed"""
+        chunks = chunks if chunks is not None else self.config.turnChunks
+        return max(self.chunkCount + chunks - self.config.maxChunks, 0) * self.config.chunkDuration
@@ -2,6 +2,7 @@ from aiohttp import web
 from chatbot.service.state import Events
 from pydantic import BaseModel, ValidationError
 import logging
+import math
 from chatbot import keys
 
 
@@ -51,15 +52,22 @@ class LLMChatView(web.View):
         except KeyError:
             return web.json_response({"error": "Missing 'prompt' query parameter"}, status=400)
 
-        llm_handler = self.request.app[keys.llmhandler]
+        llm_handler = self.request.app[keys.langgraph_handler]
+        if not llm_handler.ready:
+            return web.json_response({"error": "Service is still starting"}, status=503)
 
-        # Create a dummy ConversationAccount for now
+        events: Events | None = self.request.app.get(keys.events)
+        if events is not None and not events.admit():
+            retry_after = math.ceil(events.retryAfter().total_seconds())
+            return web.json_response({"error": "Service is busy, try again shortly"}, status=503, headers={"Retry-After": str(retry_after)})
+
+        # The conversation id selects the graph thread so callers can continue a conversation
         # In a real application, this would involve fetching or creating user/session specific details
-        conversation_account = ConversationAccount(id="dummy_conversation_id")
+        conversation_id = self.request.query.get("conversation_id", "dummy_conversation_id")
         identity = "web_user"
 
         try:
-            ai_response = await llm_handler.chat(conversation_account, identity, prompt)
+            ai_response = await llm_handler.chat(conversation_id, identity, prompt)
             return web.json_response({"response": ai_response})
         except Exception as e:
             logger.error(f"Error during LLM chat: {e}", exc_info=True)
@@ -0,0 +1,174 @@
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+import asyncio
+import logging
+import re
+import signal
+import subprocess
+import sys
+import time
+
+from aiohttp import web
+from prometheus_client import CollectorRegistry, Gauge
+
+from chatbot import keys
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimings:
+    """
+    Durations of the phases of a start of the service.
+    Exported as the startup_phase_seconds gauge once a metrics registry is attached.
+    """
+
+    def __init__(self, origin: float):
+        # perf_counter at the start of the service, phases reached are measured from it
+        self.origin = origin
+        self.phases: dict[str, float] = {}
+        self.started: dict[str, float] = {}
+        self.gauge: Gauge | None = None
+
+    def export(self, registry: CollectorRegistry) -> None:
+        """Export the phases, those already recorded and those to come, to the registry"""
+        self.gauge = Gauge("startup_phase_seconds", "Time taken by each phase of startup", ["phase"], registry=registry)
+        for phase, seconds in self.phases.items():
+            self.gauge.labels(phase).set(seconds)
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = seconds
+        if self.gauge is not None:
+            self.gauge.labels(phase).set(seconds)
+        logger.info(f"Startup: {phase} took {seconds:.3f}s")
+
+    def begin(self, phase: str) -> None:
+        self.started[phase] = time.perf_counter()
+
+    def end(self, phase: str) -> None:
+        self.record(phase, time.perf_counter() - self.started.pop(phase))
+
+    def reached(self, phase: str) -> None:
+        """Record the time from the start of the service to reaching the phase, eg the graph becoming ready"""
+        self.record(phase, time.perf_counter() - self.origin)
+
+    @contextmanager
+    def phase(self, phase: str):
+        self.begin(phase)
+        try:
+            yield
+        finally:
+            self.end(phase)
+
+
+def startup_phase(app: web.Application, phase: str):
+    """Time a phase of startup, if the app is recording its startup"""
+    timings = app.get(keys.startup_timings)
+    return timings.phase(phase) if timings is not None else nullcontext()
+
+
+def startup_reached(app: web.Application, phase: str) -> None:
+    """Record reaching a phase of startup, if the app is recording its startup"""
+    timings = app.get(keys.startup_timings)
+    if timings is not None:
+        timings.reached(phase)
+
+
+async def startup_hooks_begin(app: web.Application):
+    """
+    First cleanup context of the app, times the startup hooks up to startup_hooks_end
+    """
+    app[keys.startup_timings].begin("startup_hooks")
+    yield
+
+
+async def startup_hooks_end(app: web.Application):
+    """
+    Last startup hook of the app, the service starts listening once it returns
+    """
+    app[keys.startup_timings].end("startup_hooks")
+    app[keys.startup_timings].reached("listening")
+
+
+@dataclass
+class ImportTime:
+    """Time to import a module as reported by python -X importtime"""
+
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+# The service and the subsystems app_init imports when the config enables them
+SERVICE_MODULES = ["chatbot.cli", "chatbot.hams", "chatbot.mcp_client", "chatbot.langgraph", "chatbot.azurebot"]
+
+
+def import_times(*modules: str) -> list[ImportTime]:
+    """
+    Import the modules in a new interpreter reporting the time of each import.
+    The imports are listed parents first so they read as a tree.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append(ImportTime(name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+
+    # importtime lists a module after the modules it imports
+    return imports[::-1]
+
+
+async def profile_startup(config_filename: str, secrets_dir: str, stub: bool = True, timeout: float = 120) -> StartupTimings:
+    """
+    Start the service without serving requests, returning the timings once the graph is ready.
+
+    With stub the MCP servers and HaMS checks are removed from the config so startup runs without external services.
+    """
+    from chatbot import app_init, startup_timings
+    from chatbot.config import ServiceConfig
+
+    timings = startup_timings()
+
+    with timings.phase("config"):
+        config = ServiceConfig.from_yaml_and_secrets_dir(config_filename, secrets_dir)
+
+    if stub:
+        config.myai.toolbox.mcps = []
+        config.hams.checks.preflights = []
+        config.hams.checks.shutdowns = []
+
+    app = web.Application()
+    app_init(app, config, timings)
+
+    runner = web.AppRunner(app)
+
+    # A failed startup stops the service with SIGTERM, here it ends the profile
+    loop = asyncio.get_running_loop()
+    failed = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, failed.set)
+    try:
+        await runner.setup()
+
+        handler = app[keys.langgraph_handler]
+        async with asyncio.timeout(timeout):
+            while not handler.ready and not failed.is_set():
+                await asyncio.sleep(0.01)
+
+        if failed.is_set():
+            raise RuntimeError("Startup failed, see the log for the cause")
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        await runner.cleanup()
+
+    return timings
@@ -1,6 +1,5 @@
 from chatbot.tools import calcs
 from chatbot.tools import customer
-from langchain_mcp_adapters.client import MultiServerMCPClient
 
 mytools = [
     calcs.sum_numbers,
@@ -1,2 +1,98 @@
+from collections.abc import Sequence
+from typing import Any
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import BaseTool
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import LangchainConfig, MyAiConfig
+from chatbot.config.tool import ToolBoxConfig
+from chatbot.langgraph.handler import LanggraphHandler
+
+
 def pytest_addoption(parser):
     parser.addoption("--enable-livellm", action="store_true", help="Enable live LLM tests")
+    parser.addoption("--enable-benchmark", action="store_true", help="Enable wall clock benchmarks")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class EchoChatModel(BaseChatModel):
+    """Chat model that replies with the number of messages it was sent and the last prompt"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "echo"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        reply = AIMessage(content=f"{len(messages)}:{messages[-1].content}")
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+
+class CountingChatModel(BaseChatModel):
+    """Chat model that replies with the number of calls made to it"""
+
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"reply {self.calls}"))])
+
+
+def empty_myai_config() -> MyAiConfig:
+    return MyAiConfig(system_instruction=[], toolbox=ToolBoxConfig(tools=[], max_concurrent=5, mcps=[]))
+
+
+def compiled_handler(
+    myai_config: MyAiConfig,
+    model: BaseChatModel,
+    registry: CollectorRegistry | None = None,
+    llm_config: LangchainConfig | None = None,
+    tools: Sequence[BaseTool] = (),
+) -> LanggraphHandler:
+    """Handler for the model with its tools bound and the graph compiled, metrics go to a fresh registry unless one is given"""
+    handler = LanggraphHandler(myai_config, model, registry=registry or CollectorRegistry(), llm_config=llm_config)
+    if tools:
+        handler.register_tools(list(tools))
+    handler.bind_tools()
+    handler.compile()
+    return handler
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def registry() -> CollectorRegistry:
+    return CollectorRegistry()
+
+
+@pytest.fixture
+def myai_config() -> MyAiConfig:
+    return empty_myai_config()
+
+
+@pytest.fixture
+def handler(myai_config, registry) -> LanggraphHandler:
+    return compiled_handler(myai_config, EchoChatModel(), registry)
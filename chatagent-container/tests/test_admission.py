@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from aiohttp import web
+from prometheus_client import CollectorRegistry
+
+from chatbot import keys
+from chatbot.config import EventConfig
+from chatbot.hams import Hams
+from chatbot.service.state import Events
+from chatbot.service.webview import LLMChatView
+from conftest import EchoChatModel, compiled_handler, empty_myai_config
+
+
+def events(registry: CollectorRegistry, maxChunks: int = 2) -> Events:
+    config = EventConfig(maxChunks=maxChunks, chunkDuration=timedelta(seconds=2), checkTime=timedelta(milliseconds=500))
+    return Events(config, datetime.now(timezone.utc), 0, registry=registry)
+
+
+def chat_app(registry: CollectorRegistry) -> web.Application:
+    myai_config = empty_myai_config()
+    handler = compiled_handler(myai_config, EchoChatModel(), registry)
+
+    app = web.Application()
+    app[keys.config] = SimpleNamespace(myai=myai_config)
+    app[keys.langgraph_handler] = handler
+    app[keys.events] = events(registry)
+    app.router.add_view("/llm/chat", LLMChatView)
+    return app
+
+
+def test_turns_beyond_capacity_are_shed(registry):
+    capacity = events(registry, maxChunks=2)
+
+    assert capacity.admit()
+    assert capacity.admit()
+    assert not capacity.admit()
+    assert capacity.chunkCount == 2
+    assert capacity.retryAfter() == timedelta(seconds=2)
+
+    assert registry.get_sample_value("turn_admissions_total", {"result": "admitted"}) == 2
+    assert registry.get_sample_value("turn_admissions_total", {"result": "shed"}) == 1
+
+
+async def test_overloaded_service_is_not_ready(registry):
+    app = chat_app(registry)
+    hams = Hams(web.Application(), app, config=None, registry=registry)
+    assert hams.ready()
+
+    capacity = app[keys.events]
+    assert capacity.admit()
+    assert hams.ready()
+    assert capacity.admit()
+    # Full, turns are now shed and the pod is not ready
+    assert not capacity.admit()
+    assert not hams.ready()
+
+    capacity.updateChunk(capacity.lastTime + timedelta(seconds=1))
+    assert hams.ready()
+
+
+async def test_chat_replies_busy_when_overloaded(aiohttp_client, registry):
+    client = await aiohttp_client(chat_app(registry))
+
+    for _ in range(2):
+        resp = await client.get("/llm/chat", params={"prompt": "hello", "conversation_id": "convo"})
+        assert resp.status == 200
+
+    resp = await client.get("/llm/chat", params={"prompt": "hello", "conversation_id": "convo"})
+    assert resp.status == 503
+    assert resp.headers["Retry-After"] == "2"
+    assert (await resp.json())["error"] == "Service is busy, try again shortly"
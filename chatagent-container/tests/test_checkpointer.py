@@ -0,0 +1,119 @@
+from datetime import timedelta
+from typing import Annotated
+import operator
+
+from langgraph.graph import StateGraph, START, END
+from pydantic import BaseModel
+
+from chatbot.config import CheckpointConfig
+from chatbot.langgraph.checkpointer import BoundedMemorySaver
+
+
+class CountState(BaseModel):
+    items: Annotated[list[str], operator.add]
+
+
+def build_graph(saver: BoundedMemorySaver):
+    workflow = StateGraph(CountState)
+    workflow.add_node("echo", lambda state: {"items": ["reply"]})
+    workflow.add_edge(START, "echo")
+    workflow.add_edge("echo", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+async def test_evicts_least_recently_used_thread(clock, registry):
+    saver = BoundedMemorySaver(CheckpointConfig(max_threads=2), registry=registry, clock=clock)
+    graph = build_graph(saver)
+
+    for thread_id in ["a", "b"]:
+        clock.now += 1
+        await graph.ainvoke({"items": ["hi"]}, config=thread(thread_id))
+
+    # Touch "a" so that "b" becomes the least recently used
+    clock.now += 1
+    await graph.ainvoke({"items": ["again"]}, config=thread("a"))
+
+    clock.now += 1
+    await graph.ainvoke({"items": ["hi"]}, config=thread("c"))
+
+    assert list(saver.last_access) == ["a", "c"]
+    assert "b" not in saver.storage
+    assert not any(key[0] == "b" for key in saver.blobs)
+    assert registry.get_sample_value("checkpoint_evictions_total", {"reason": "threads"}) == 1
+    assert registry.get_sample_value("checkpoint_threads") == 2
+
+    # Evicted threads start again from an empty history
+    state = await graph.ainvoke({"items": ["back"]}, config=thread("b"))
+    assert state["items"] == ["back", "reply"]
+
+
+async def test_evicts_idle_threads(clock, registry):
+    saver = BoundedMemorySaver(CheckpointConfig(idle_ttl=timedelta(seconds=10)), registry=registry, clock=clock)
+    graph = build_graph(saver)
+
+    await graph.ainvoke({"items": ["hi"]}, config=thread("old"))
+    clock.now += 60
+    await graph.ainvoke({"items": ["hi"]}, config=thread("new"))
+
+    assert list(saver.last_access) == ["new"]
+    assert registry.get_sample_value("checkpoint_evictions_total", {"reason": "idle"}) == 1
+
+
+async def test_evicts_by_size_but_keeps_active_thread(clock, registry):
+    saver = BoundedMemorySaver(CheckpointConfig(max_bytes=1), registry=registry, clock=clock)
+    graph = build_graph(saver)
+
+    await graph.ainvoke({"items": ["hi"]}, config=thread("a"))
+    await graph.ainvoke({"items": ["hi"]}, config=thread("b"))
+
+    assert list(saver.last_access) == ["b"]
+    assert saver.total_bytes == saver.thread_bytes["b"] > 0
+    assert registry.get_sample_value("checkpoint_bytes") == saver.total_bytes
+    assert registry.get_sample_value("checkpoint_evictions_total", {"reason": "bytes"}) == 1
+
+    # History of the active thread is retained even though it exceeds the budget
+    state = await graph.ainvoke({"items": ["again"]}, config=thread("b"))
+    assert state["items"] == ["hi", "reply", "again", "reply"]
+
+
+async def test_long_thread_keeps_only_its_latest_checkpoint(clock, registry):
+    saver = BoundedMemorySaver(CheckpointConfig(max_bytes=20_000), registry=registry, clock=clock)
+    graph = build_graph(saver)
+
+    for turn in range(200):
+        state = await graph.ainvoke({"items": [f"turn {turn}"]}, config=thread("a"))
+
+    assert len(state["items"]) == 400
+    assert len(saver.storage["a"][""]) == 1
+    # One blob for each channel of the graph
+    assert len(saver.blobs) == len(saver.thread_blob_keys["a"]) == 3
+    assert len(saver.writes) <= 1
+    assert saver.total_bytes <= saver.config.max_bytes
+    assert registry.get_sample_value("checkpoint_evictions_total", {"reason": "bytes"}) is None
+
+    # The accounting matches what is resident
+    checkpoint, metadata, _ = saver.storage["a"][""][max(saver.storage["a"][""])]
+    resident = len(checkpoint[1]) + len(metadata[1]) + sum(len(blob[1]) for blob in saver.blobs.values())
+    resident += sum(len(value[2][1]) for writes in saver.writes.values() for value in writes.values())
+    assert saver.total_bytes == resident
+
+    state = await graph.ainvoke({"items": ["again"]}, config=thread("a"))
+    assert state["items"][-2:] == ["again", "reply"]
+    assert len(state["items"]) == 402
+
+
+async def test_delete_thread_releases_accounting(clock, registry):
+    saver = BoundedMemorySaver(CheckpointConfig(), registry=registry, clock=clock)
+    graph = build_graph(saver)
+
+    await graph.ainvoke({"items": ["hi"]}, config=thread("a"))
+    saver.delete_thread("a")
+
+    assert saver.total_bytes == 0
+    assert not saver.blobs
+    assert not saver.writes
+    assert registry.get_sample_value("checkpoint_threads") == 0
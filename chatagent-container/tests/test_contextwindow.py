@@ -0,0 +1,65 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from prometheus_client import CollectorRegistry
+
+from chatbot.langgraph.contextwindow import TOKEN_COUNT_KEY, ContextWindow, message_tokens
+
+
+def conversation() -> list:
+    return [
+        SystemMessage(content="system " * 10),
+        HumanMessage(content="first question " * 20),
+        AIMessage(content="first answer " * 20),
+        HumanMessage(content="look it up"),
+        AIMessage(content="", tool_calls=[{"name": "lookup", "args": {"q": "x"}, "id": "call-1"}]),
+        ToolMessage(content="result " * 20, tool_call_id="call-1"),
+        AIMessage(content="the answer"),
+        HumanMessage(content="thanks"),
+    ]
+
+
+def test_token_counts_are_cached_on_the_message():
+    message = HumanMessage(content="hello there")
+    tokens = message_tokens(message)
+
+    assert message.response_metadata[TOKEN_COUNT_KEY] == tokens
+
+    message.response_metadata[TOKEN_COUNT_KEY] = 1234
+    assert message_tokens(message) == 1234
+
+
+def test_everything_kept_when_within_budget():
+    window = ContextWindow(context_length=100000, fraction=0.5, registry=CollectorRegistry())
+    messages = conversation()
+
+    assert window.trim(messages) == messages
+
+
+def test_trims_oldest_turns_and_keeps_system_and_tool_pairs():
+    registry = CollectorRegistry()
+    messages = conversation()
+    recent = sum(message_tokens(message) for message in messages[3:]) + message_tokens(messages[0])
+    window = ContextWindow(context_length=recent, fraction=1.0, registry=registry)
+
+    trimmed = window.trim(messages)
+
+    assert trimmed == [messages[0]] + messages[3:]
+    assert registry.get_sample_value("context_tokens_dropped_sum") == message_tokens(messages[1]) + message_tokens(messages[2])
+
+
+def test_tool_results_never_orphaned():
+    messages = conversation()
+    # Budget only has room for the tool result and the messages after it
+    budget = sum(message_tokens(message) for message in messages[5:]) + message_tokens(messages[0])
+    window = ContextWindow(context_length=budget, fraction=1.0, registry=CollectorRegistry())
+
+    trimmed = window.trim(messages)
+
+    assert not any(isinstance(message, ToolMessage) for message in trimmed)
+    assert trimmed[1] == messages[-1]
+
+
+def test_latest_prompt_kept_when_over_budget():
+    window = ContextWindow(context_length=1, fraction=1.0, registry=CollectorRegistry())
+    messages = conversation()
+
+    assert window.trim(messages) == [messages[0], messages[-1]]
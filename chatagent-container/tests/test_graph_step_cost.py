@@ -0,0 +1,118 @@
+"""
+Cost of a single graph step as the conversation grows.
+
+The work a turn does that scales with the history, checkpoint writes and full
+add_messages merges, is counted and must not grow with the number of steps.
+The wall clock benchmark times a turn with and without a number of tool call round
+trips, the difference divided by the number of extra steps is the cost of a step.
+It is noisy on a loaded machine so it only runs with --enable-benchmark.
+"""
+
+import time
+
+import pytest
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from chatbot.config import LangchainConfig, MyAiConfig
+from chatbot.config.tool import ToolBoxConfig, ToolConfig
+from chatbot.langgraph import agentstate
+from chatbot.langgraph.handler import LanggraphHandler
+from chatbot.tools.calcs import sum_numbers
+from conftest import compiled_handler
+
+TOOL_LOOPS = 10
+REPEATS = 5
+
+
+class ToolLoopChatModel(BaseChatModel):
+    """Chat model that calls sum_numbers a fixed number of times per turn before answering"""
+
+    loops: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "tool-loop"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tool_results = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, ToolMessage):
+                tool_results += 1
+
+        if tool_results < self.loops:
+            reply = AIMessage(content="", tool_calls=[{"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": f"call-{tool_results}"}])
+        else:
+            reply = AIMessage(content="done")
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+
+@pytest.fixture
+def enable_benchmark(request):
+    return request.config.getoption("--enable-benchmark")
+
+
+async def benchmark_handler(history_length: int, loops: int) -> LanggraphHandler:
+    config = MyAiConfig(
+        system_instruction=[],
+        toolbox=ToolBoxConfig(tools=[ToolConfig(name="sum_numbers")], max_concurrent=5, mcps=[]),
+    )
+    handler = compiled_handler(config, ToolLoopChatModel(loops=loops), llm_config=LangchainConfig(model="tool-loop", context_length=4096), tools=[sum_numbers])
+
+    graph_config = handler.get_graph_config("benchmark")
+    history = []
+    for index in range(history_length // 2):
+        history += [HumanMessage(content=f"question {index}"), AIMessage(content=f"answer {index}")]
+    await handler.graph.aupdate_state(graph_config, {"messages": history}, as_node="chatbot")
+    return handler
+
+
+async def fastest_turn(history_length: int, loops: int) -> float:
+    handler = await benchmark_handler(history_length, loops)
+    fastest = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        await handler.chat("benchmark", "user", "next question")
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest
+
+
+async def step_cost(history_length: int) -> float:
+    # Each tool loop is two steps, the tool node and the chatbot node
+    with_tools = await fastest_turn(history_length, TOOL_LOOPS)
+    without_tools = await fastest_turn(history_length, 0)
+    return (with_tools - without_tools) / (2 * TOOL_LOOPS)
+
+
+async def test_turn_does_no_per_step_history_work(monkeypatch):
+    handler = await benchmark_handler(4000, TOOL_LOOPS)
+
+    merges = []
+    monkeypatch.setattr(agentstate, "add_messages", lambda left, right: merges.append(len(left)) or left + right)
+    puts = []
+    put = handler.memory.put
+    monkeypatch.setattr(handler.memory, "put", lambda *args: puts.append(args) or put(*args))
+
+    await handler.chat("benchmark", "user", "next question")
+
+    # The history is written once at the end of the turn and never merged message by message
+    assert len(puts) == 1
+    assert merges == []
+
+
+async def test_step_cost_is_flat_as_history_grows(enable_benchmark):
+    if not enable_benchmark:
+        pytest.skip("Skipped unless --enable-benchmark is set")
+
+    short = await step_cost(100)
+    long = await step_cost(4000)
+
+    # An O(history) step would be tens of times slower at 4000 messages
+    assert long < 3 * short
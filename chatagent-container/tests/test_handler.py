@@ -0,0 +1,239 @@
+from typing import Any
+import asyncio
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+from prometheus_client import CollectorRegistry
+
+from chatbot.chathistory import ChatHistory
+from chatbot.config import AIPromptConfig, CheckpointConfig, LangchainConfig, SummaryConfig
+from chatbot.config.tool import ToolBoxConfig, ToolConfig, ToolModeEnum
+from chatbot.langgraph.handler import LanggraphHandler
+from chatbot.langgraph.toolregistry import ToolRegistrationContext
+from chatbot.tools.calcs import sum_numbers
+from conftest import EchoChatModel, compiled_handler
+
+
+class StreamingChatModel(GenericFakeChatModel):
+    """Chat model that streams its scripted replies word by word"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+async def test_conversations_use_separate_threads(handler):
+    assert await handler.chat("convo-a", "user-a", "hello") == "1:hello"
+    assert await handler.chat("convo-a", "user-a", "again") == "3:again"
+
+    # A different conversation does not see the history of the first
+    assert await handler.chat("convo-b", "user-b", "hello") == "1:hello"
+
+
+async def test_ainvoke_agent_records_turn_in_chat_history(handler):
+    chat_history = ChatHistory()
+
+    assert await handler.ainvoke_agent("convo", "user", "hello", chat_history) == "1:hello"
+    assert await handler.ainvoke_agent("convo", "user", "again", chat_history) == "3:again"
+
+    assert [message.content for message in chat_history.messages] == ["hello", "1:hello", "again", "3:again"]
+
+
+async def test_ainvoke_agent_reseeds_evicted_thread(handler):
+    chat_history = ChatHistory()
+    await handler.ainvoke_agent("convo", "user", "hello", chat_history)
+
+    handler.memory.delete_thread("convo")
+
+    assert await handler.ainvoke_agent("convo", "user", "again", chat_history) == "3:again"
+    assert len(chat_history.messages) == 4
+
+
+class ToolCallingChatModel(BaseChatModel):
+    """Chat model that calls sum_numbers once for each prompt before replying"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "tool-calling"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if messages[-1].type == "human":
+            reply = AIMessage(content="", tool_calls=[{"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": f"call-{len(messages)}"}])
+        else:
+            reply = AIMessage(content=f"sum is {messages[-1].content}")
+        return ChatResult(generations=[ChatGeneration(message=reply)])
+
+
+async def test_chat_history_keeps_the_last_turns_without_tool_messages(myai_config):
+    myai_config.checkpoint = CheckpointConfig(history_turns=2)
+    myai_config.toolbox = ToolBoxConfig(tools=[ToolConfig(name="sum_numbers")], max_concurrent=5, mcps=[])
+    handler = compiled_handler(myai_config, ToolCallingChatModel(), tools=[sum_numbers])
+
+    chat_history = ChatHistory()
+    for prompt in ["one", "two", "three"]:
+        await handler.ainvoke_agent("convo", "user", prompt, chat_history)
+
+    assert [message.content for message in chat_history.messages] == ["two", "sum is 3.0", "three", "sum is 3.0"]
+
+    # A reseeded conversation has no tool calls left without their results
+    handler.memory.delete_thread("convo")
+    assert await handler.ainvoke_agent("convo", "user", "four", chat_history) == "sum is 3.0"
+    state = await handler.graph.aget_state(handler.get_graph_config("convo"))
+    assert [message.type for message in state.values["messages"]] == ["human", "ai", "human", "ai", "human", "ai", "tool", "ai"]
+
+
+async def test_reseed_restores_the_summary(myai_config):
+    myai_config.summary = SummaryConfig(enabled=True, trigger_messages=6, keep_messages=2)
+    handler = compiled_handler(myai_config, EchoChatModel())
+
+    chat_history = ChatHistory()
+    for prompt in ["one", "two", "three"]:
+        await handler.ainvoke_agent("convo", "user", prompt, chat_history)
+    await asyncio.gather(*handler.background_tasks)
+    await handler.ainvoke_agent("convo", "user", "four", chat_history)
+
+    assert chat_history.summary.startswith("2:Existing summary")
+    assert [message.content for message in chat_history.messages] == ["three", "5:three", "four", "4:four"]
+
+    handler.memory.delete_thread("convo")
+    # The summary and the kept turns are sent ahead of the prompt, not the whole conversation
+    assert await handler.ainvoke_agent("convo", "user", "five", chat_history) == "6:five"
+    state = await handler.graph.aget_state(handler.get_graph_config("convo"))
+    assert state.values["summary"] == chat_history.summary
+
+
+class GatedEchoChatModel(EchoChatModel):
+    """Echo model that holds prompts of "slow" until the gate is set"""
+
+    gate: asyncio.Event
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if messages[-1].content == "slow":
+            await self.gate.wait()
+        return self._generate(messages, stop, run_manager, **kwargs)
+
+
+async def test_threads_with_a_turn_running_are_not_evicted(myai_config):
+    myai_config.checkpoint = CheckpointConfig(max_threads=1)
+    model = GatedEchoChatModel(gate=asyncio.Event())
+    handler = compiled_handler(myai_config, model)
+
+    config_a = handler.get_graph_config("convo-a")
+    await handler.chat("convo-a", "user", "hello")
+    await handler.graph.aupdate_state(config_a, {"summary": "earlier turns"})
+
+    slow_turn = asyncio.create_task(handler.chat("convo-a", "user", "slow"))
+    await asyncio.sleep(0.01)
+    # Over max_threads, but the thread of the running turn is kept
+    await handler.chat("convo-b", "user", "hello")
+    assert "convo-a" in handler.memory.last_access
+
+    model.gate.set()
+    await slow_turn
+    state = await handler.graph.aget_state(config_a)
+    assert state.values["summary"] == "earlier turns"
+    assert [message.content for message in state.values["messages"]] == ["hello", "1:hello", "slow", "4:slow"]
+    # Evicted once the turn has finished
+    assert list(handler.memory.last_access) == ["convo-a"]
+
+
+async def test_long_conversations_are_summarised_in_background(myai_config, registry):
+    myai_config.summary = SummaryConfig(enabled=True, trigger_messages=6, keep_messages=2)
+    handler = compiled_handler(myai_config, EchoChatModel(), registry)
+
+    for prompt in ["one", "two", "three"]:
+        await handler.chat("convo", "user", prompt)
+    await asyncio.gather(*handler.background_tasks)
+
+    state = await handler.graph.aget_state(handler.get_graph_config("convo"))
+    assert [message.content for message in state.values["messages"]] == ["three", "5:three"]
+    assert state.values["summary"].startswith("2:Existing summary")
+    assert registry.get_sample_value("conversation_summaries_total", {"result": "success"}) == 1
+
+    # The summary is sent to the model ahead of the remaining messages
+    assert await handler.chat("convo", "user", "four") == "4:four"
+
+
+async def test_ainvoke_agent_streams_tokens(myai_config, registry):
+    model = StreamingChatModel(messages=iter([AIMessage(content="streamed reply text")]))
+    handler = compiled_handler(myai_config, model, registry, llm_config=LangchainConfig(model="fake", streaming=True))
+
+    tokens = []
+    reply = await handler.ainvoke_agent("convo", "user", "hello", ChatHistory(), on_token=tokens.append)
+
+    assert reply == "streamed reply text"
+    assert len(tokens) > 1
+    assert "".join(tokens) == reply
+    assert registry.get_sample_value("llm_first_token_count") == 1
+
+
+async def test_reload_tools_swaps_graph_and_keeps_conversations(handler):
+    @tool
+    def get_customer(name: str) -> str:
+        """Look up a customer"""
+        return f"customer {name}"
+
+    assert await handler.chat("convo", "user", "hello") == "1:hello"
+    graph = handler.graph
+
+    context = ToolRegistrationContext(source="mcp", mcp_name="customers", mcp_mode=ToolModeEnum.dynamic, default_config=ToolConfig())
+    handler.reload_tools([get_customer], context=context)
+
+    assert handler.graph is not graph
+    assert "get_customer" in handler.toolnode.tools_by_name
+    # The conversation continues on the new graph
+    assert await handler.chat("convo", "user", "again") == "3:again"
+
+
+class RecordingChatModel(BaseChatModel):
+    """Chat model that records the messages of each call and reports part of the input as read from the prompt cache"""
+
+    calls: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls.append(messages)
+        usage = {"input_tokens": 100, "output_tokens": 5, "total_tokens": 105, "input_token_details": {"cache_read": 64}}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="reply", usage_metadata=usage))])
+
+
+async def test_instructions_lead_every_call_unchanged(myai_config, registry):
+    myai_config.system_instruction = [AIPromptConfig(text="You are a helpful assistant. "), AIPromptConfig(text="Be brief.")]
+    model = RecordingChatModel(calls=[])
+    handler = compiled_handler(myai_config, model, registry)
+    handler.set_instructions(["Customers are looked up by name."])
+
+    await handler.chat("convo-a", "user", "hello")
+    await handler.chat("convo-a", "user", "again")
+    await handler.chat("convo-b", "user", "hello")
+
+    prefixes = [call[0] for call in model.calls]
+    assert prefixes[0].content == "You are a helpful assistant.\n\nBe brief.\n\nCustomers are looked up by name."
+    assert all(prefix is prefixes[0] for prefix in prefixes)
+    assert [message.content for message in model.calls[1][1:]] == ["hello", "reply", "again"]
+
+    assert registry.get_sample_value("llm_input_tokens_total") == 300
+    assert registry.get_sample_value("llm_cached_input_tokens_total") == 192
+
+
+async def test_instructions_are_only_replaced_when_their_text_changes(myai_config):
+    myai_config.system_instruction = [AIPromptConfig(text="Be brief.")]
+    handler = LanggraphHandler(myai_config, EchoChatModel(), registry=CollectorRegistry())
+    instructions = handler.instructions
+
+    handler.set_instructions([])
+    assert handler.instructions is instructions
+
+    handler.set_instructions(["Customers are looked up by name."])
+    assert handler.instructions.content == "Be brief.\n\nCustomers are looked up by name."
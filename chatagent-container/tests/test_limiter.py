@@ -0,0 +1,146 @@
+from typing import Any
+import asyncio
+import logging
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.serde import jsonplus
+
+from chatbot.config import LangchainConfig
+from chatbot.langgraph.limiter import LlmLimiter, Priority
+from conftest import compiled_handler
+
+
+class GatedChatModel(BaseChatModel):
+    """Chat model whose calls wait on a gate, recording the prompt of each call as it starts"""
+
+    gate: asyncio.Event
+    started: list[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "gated"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.started.append(messages[-1].content)
+        await self.gate.wait()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=messages[-1].content))])
+
+
+async def hold(limiter: LlmLimiter, priority: Priority, order: list[str], name: str, release: asyncio.Event) -> None:
+    async with limiter.slot(priority):
+        order.append(name)
+        await release.wait()
+
+
+async def test_waiting_calls_are_served_by_priority_then_arrival(registry):
+    limiter = LlmLimiter(1, registry=registry)
+    order: list[str] = []
+    release = asyncio.Event()
+
+    first = asyncio.create_task(hold(limiter, Priority.background, order, "first", release))
+    await asyncio.sleep(0)
+    waiting = [asyncio.create_task(hold(limiter, priority, order, name, release)) for priority, name in [(Priority.background, "summary"), (Priority.interactive, "turn 1"), (Priority.interactive, "turn 2")]]
+    await asyncio.sleep(0)
+
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "interactive"}) == 2
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "background"}) == 1
+    assert registry.get_sample_value("llm_calls_in_flight", {"priority": "background"}) == 1
+
+    release.set()
+    await asyncio.gather(first, *waiting)
+
+    assert order == ["first", "turn 1", "turn 2", "summary"]
+    assert limiter.in_flight == 0
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "interactive"}) == 0
+    assert registry.get_sample_value("llm_queue_wait_seconds_count", {"priority": "interactive"}) == 2
+    assert registry.get_sample_value("llm_calls_in_flight", {"priority": "interactive"}) == 0
+
+
+async def test_cancelled_waiters_give_up_their_place(registry):
+    limiter = LlmLimiter(1, registry=registry)
+    order: list[str] = []
+    release = asyncio.Event()
+
+    first = asyncio.create_task(hold(limiter, Priority.interactive, order, "first", release))
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(hold(limiter, Priority.interactive, order, "cancelled", release))
+    after = asyncio.create_task(hold(limiter, Priority.background, order, "after", release))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "interactive"}) == 0
+
+    release.set()
+    await asyncio.gather(first, after)
+
+    assert order == ["first", "after"]
+    assert limiter.in_flight == 0
+    assert not limiter.waiting
+
+
+async def test_a_waiter_cancelled_as_the_slot_is_released_does_not_leak_it(registry):
+    limiter = LlmLimiter(1, registry=registry)
+    order: list[str] = []
+    release = asyncio.Event()
+    release.set()
+
+    await limiter.acquire(Priority.interactive)
+    cancelled = asyncio.create_task(hold(limiter, Priority.interactive, order, "cancelled", release))
+    await asyncio.sleep(0)
+
+    # The slot is released before the cancelled waiter has run
+    cancelled.cancel()
+    limiter.release(Priority.interactive)
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+    assert limiter.in_flight == 0
+    assert not limiter.waiting
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "interactive"}) == 0
+    await asyncio.wait_for(hold(limiter, Priority.interactive, order, "next", release), timeout=1)
+    assert order == ["next"]
+
+
+async def test_turns_are_limited_across_conversations(myai_config, registry):
+    model = GatedChatModel(gate=asyncio.Event(), started=[])
+    llm_config = LangchainConfig(model="fake", streaming=False, max_concurrent_calls=2)
+    handler = compiled_handler(myai_config, model, registry, llm_config=llm_config)
+
+    turns = [asyncio.create_task(handler.chat(f"convo-{n}", "user", f"prompt {n}", priority=priority)) for n, priority in enumerate([Priority.interactive, Priority.interactive, Priority.background, Priority.interactive])]
+    while len(model.started) < 2 or registry.get_sample_value("llm_queue_depth", {"priority": "interactive"}) != 1:
+        await asyncio.sleep(0.01)
+
+    assert model.started == ["prompt 0", "prompt 1"]
+    assert registry.get_sample_value("llm_queue_depth", {"priority": "background"}) == 1
+
+    model.gate.set()
+    assert await asyncio.gather(*turns) == ["prompt 0", "prompt 1", "prompt 2", "prompt 3"]
+    # The interactive turn was served ahead of the background one that arrived before it
+    assert model.started[2:] == ["prompt 3", "prompt 2"]
+
+
+async def test_priority_is_checkpointed_as_a_plain_value(caplog, monkeypatch, myai_config):
+    # The warning is only logged once per process, start from a clean slate
+    monkeypatch.setattr(jsonplus, "_warned_unregistered_types", set())
+    model = GatedChatModel(gate=asyncio.Event(), started=[])
+    model.gate.set()
+    handler = compiled_handler(myai_config, model, llm_config=LangchainConfig(model="fake", streaming=False))
+
+    with caplog.at_level(logging.WARNING):
+        for prompt in ["hello", "again"]:
+            assert await handler.chat("convo", "user", prompt, priority=Priority.background) == prompt
+
+    state = await handler.graph.aget_state(handler.get_graph_config("convo"))
+    assert type(state.metadata["priority"]) is int
+    assert "unregistered type" not in caplog.text
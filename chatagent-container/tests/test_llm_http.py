@@ -0,0 +1,70 @@
+import asyncio
+
+from aiohttp import web
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import LangchainConfig
+from chatbot.langgraph import llm_model
+from chatbot.langgraph.httpclient import LlmHttpClient
+
+
+def langchain_config(**kwargs) -> LangchainConfig:
+    return LangchainConfig(
+        model_provider="azure_openai",
+        model="gpt-test",
+        azure_endpoint="https://example.openai.azure.com",
+        azure_api_key="key",
+        azure_api_version="2024-10-21",
+        **kwargs,
+    )
+
+
+async def test_pool_utilisation_is_exported(aiohttp_server):
+    release = asyncio.Event()
+
+    async def slow(request):
+        await release.wait()
+        return web.Response(text="done")
+
+    app = web.Application()
+    app.router.add_get("/", slow)
+    server = await aiohttp_server(app)
+
+    registry = CollectorRegistry()
+    http_client = LlmHttpClient(langchain_config(max_connections=1), registry=registry)
+
+    def sample(name: str, **labels) -> float:
+        return registry.get_sample_value(name, {"provider": "azure_openai", **labels})
+
+    try:
+        requests = [asyncio.create_task(http_client.async_client.get(str(server.make_url("/")))) for _ in range(2)]
+        while sample("llm_http_requests_in_flight") < 2:
+            await asyncio.sleep(0.01)
+
+        # One request holds the only connection, the other queues for it
+        assert sample("llm_http_pool_max_connections") == 1
+        assert sample("llm_http_pool_connections", state="active") == 1
+
+        release.set()
+        responses = await asyncio.gather(*requests)
+        assert [response.text for response in responses] == ["done", "done"]
+
+        assert sample("llm_http_requests_in_flight") == 0
+        assert sample("llm_http_pool_connections", state="active") == 0
+        assert sample("llm_http_pool_connections", state="idle") == 1
+    finally:
+        await http_client.aclose()
+
+
+async def test_azure_model_calls_through_the_shared_client():
+    config = langchain_config(timeout=30, connect_timeout=2)
+    http_client = LlmHttpClient(config, registry=CollectorRegistry())
+
+    model = llm_model(config, http_client)
+
+    assert model.root_async_client._client is http_client.async_client
+    assert model.root_client._client is http_client.client
+    assert http_client.async_client.timeout == http_client.timeout
+    assert http_client.timeout.read == 30 and http_client.timeout.connect == 2
+
+    await http_client.aclose()
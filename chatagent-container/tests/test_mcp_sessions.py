@@ -0,0 +1,207 @@
+from contextlib import asynccontextmanager
+from datetime import timedelta
+import asyncio
+
+import pytest
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp.server.fastmcp import Context, FastMCP
+from mcp.shared.memory import create_connected_server_and_client_session
+from prometheus_client import CollectorRegistry, Summary
+
+from chatbot.config.tool import McpConfig, McpPoolConfig, ToolModeEnum, TransportEnum
+from chatbot.mcp_client import MCPObjects, discover_mcp, load_changed_tools, sessionpool, warm_start_mcp
+from chatbot.mcp_client.sessionpool import McpSessionPools
+from chatbot.mcp_client.toolsnapshot import ToolSnapshots
+
+
+@pytest.fixture
+def mcp_server(monkeypatch) -> FastMCP:
+    """In memory MCP server standing in for the configured MCP connection"""
+    server = FastMCP("customers")
+
+    @server.tool()
+    def get_customer(name: str) -> str:
+        """Look up a customer"""
+        return f"customer {name}"
+
+    @server.prompt()
+    def greeting() -> str:
+        """Greet the user"""
+        return "Hello"
+
+    @asynccontextmanager
+    async def memory_session(connection, **kwargs):
+        async with create_connected_server_and_client_session(server) as session:
+            yield session
+
+    monkeypatch.setattr(sessionpool, "create_session", memory_session)
+    return server
+
+
+def mcp_config(size: int = 2, name: str = "customers", **kwargs) -> McpConfig:
+    return McpConfig(
+        name=name,
+        url="http://localhost:8180/mcp",
+        transport=TransportEnum.streamable_http,
+        mode=ToolModeEnum.strict,
+        pool=McpPoolConfig(size=size),
+        **kwargs,
+    )
+
+
+async def test_tool_calls_reuse_pooled_sessions(mcp_server):
+    registry = CollectorRegistry()
+    sessions = McpSessionPools([mcp_config()], registry=registry)
+
+    tools = await load_mcp_tools(sessions.get("customers"), server_name="customers")
+    for name in ["alice", "bob", "carol"]:
+        assert await tools[0].ainvoke({"name": name}) == f"customer {name}"
+
+    assert registry.get_sample_value("mcp_sessions_opened_total", {"mcp_server": "customers"}) == 1
+    assert registry.get_sample_value("mcp_sessions_reused_total", {"mcp_server": "customers"}) == 3
+    assert registry.get_sample_value("mcp_sessions_open", {"mcp_server": "customers"}) == 1
+
+    await sessions.close()
+    assert registry.get_sample_value("mcp_sessions_open", {"mcp_server": "customers"}) == 0
+
+
+async def test_failed_session_is_replaced(mcp_server):
+    registry = CollectorRegistry()
+    sessions = McpSessionPools([mcp_config()], registry=registry)
+    pool = sessions.get("customers")
+
+    with pytest.raises(RuntimeError):
+        async with pool.session():
+            raise RuntimeError("transport failed")
+
+    tools = await load_mcp_tools(pool, server_name="customers")
+    assert await tools[0].ainvoke({"name": "alice"}) == "customer alice"
+
+    assert registry.get_sample_value("mcp_sessions_closed_total", {"mcp_server": "customers", "reason": "error"}) == 1
+    assert registry.get_sample_value("mcp_sessions_opened_total", {"mcp_server": "customers"}) == 2
+
+    await sessions.close()
+
+
+def discovery_metric(registry: CollectorRegistry) -> Summary:
+    return Summary("mcp_discovery", "Discovery phases", ["mcp_server", "phase"], registry=registry)
+
+
+async def test_mcp_servers_are_discovered_concurrently(mcp_server):
+    registry = CollectorRegistry()
+    mcps = [mcp_config(name="customers", prompts=["greeting"]), mcp_config(name="chasers")]
+    sessions = McpSessionPools(mcps, registry=registry)
+    phase_metric = discovery_metric(registry)
+
+    discovered = await asyncio.gather(*[discover_mcp(mcp, sessions.get(mcp.name), set(), phase_metric) for mcp in mcps])
+
+    tools, resources, prompts, timings = discovered[0]
+    assert [tool.name for tool in tools] == ["get_customer"]
+    assert resources == []
+    assert prompts["greeting"][0].content == "Hello"
+    assert set(timings) == {"tools", "resources", "prompts", "total"}
+    assert registry.get_sample_value("mcp_discovery_count", {"mcp_server": "chasers", "phase": "total"}) == 1
+
+    await sessions.close()
+
+
+async def test_discovery_fails_at_startup_timeout(monkeypatch):
+    @asynccontextmanager
+    async def hung_session(connection, **kwargs):
+        await asyncio.Event().wait()
+        yield
+
+    monkeypatch.setattr(sessionpool, "create_session", hung_session)
+    registry = CollectorRegistry()
+    mcp = mcp_config(startup_timeout=timedelta(milliseconds=50))
+    sessions = McpSessionPools([mcp], registry=registry)
+
+    with pytest.raises(RuntimeError, match="startup timeout"):
+        await discover_mcp(mcp, sessions.get(mcp.name), set(), discovery_metric(registry))
+
+    await sessions.close()
+
+
+async def test_tools_changed_notification_reloads_tools(monkeypatch):
+    server = FastMCP("customers")
+
+    @server.tool()
+    async def enable_deletes(ctx: Context) -> str:
+        """Add the delete tool, announcing the change to the client"""
+
+        @server.tool()
+        def delete_customer(name: str) -> str:
+            """Delete a customer"""
+            return f"deleted {name}"
+
+        await ctx.session.send_tool_list_changed()
+        return "enabled"
+
+    @asynccontextmanager
+    async def memory_session(connection, **kwargs):
+        # The pool's message handler receives the server notifications
+        async with create_connected_server_and_client_session(server, **connection["session_kwargs"]) as session:
+            yield session
+
+    monkeypatch.setattr(sessionpool, "create_session", memory_session)
+    mcp = mcp_config()
+    sessions = McpSessionPools([mcp], registry=CollectorRegistry())
+    pool = sessions.get("customers")
+    tools = await load_mcp_tools(pool, server_name="customers")
+    mcpObjects = MCPObjects(tools_by_mcp={"customers": tools}, sessions=sessions)
+
+    assert await load_changed_tools(mcpObjects, mcp) is None
+
+    assert await tools[0].ainvoke({}) == "enabled"
+    async with asyncio.timeout(1):
+        await pool.wait_tools_changed(timeout=None)
+
+    tools = await load_changed_tools(mcpObjects, mcp)
+    assert sorted(tool.name for tool in tools) == ["delete_customer", "enable_deletes"]
+
+    await sessions.close()
+
+
+async def test_discovered_tools_are_snapshotted_for_warm_starts(mcp_server, monkeypatch, tmp_path):
+    registry = CollectorRegistry()
+    mcp = mcp_config()
+    snapshots = ToolSnapshots(tmp_path)
+    sessions = McpSessionPools([mcp], registry=registry)
+
+    await discover_mcp(mcp, sessions.get(mcp.name), set(), discovery_metric(registry), snapshots)
+    await sessions.close()
+    assert (tmp_path / "customers.json").exists()
+
+    # A restart binds from the snapshot without waiting on the server
+    @asynccontextmanager
+    async def hung_session(connection, **kwargs):
+        await asyncio.Event().wait()
+        yield
+
+    monkeypatch.setattr(sessionpool, "create_session", hung_session)
+    registry = CollectorRegistry()
+    sessions = McpSessionPools([mcp], registry=registry)
+
+    async with asyncio.timeout(1):
+        tools, resources, prompts, timings = await warm_start_mcp(mcp, sessions.get(mcp.name), snapshots, discovery_metric(registry))
+
+    assert [tool.name for tool in tools] == ["get_customer"]
+    assert tools[0].args_schema["required"] == ["name"]
+    assert set(timings) == {"snapshot"}
+
+    await sessions.close()
+
+
+async def test_snapshot_of_another_server_is_ignored(mcp_server, tmp_path):
+    registry = CollectorRegistry()
+    mcp = mcp_config()
+    snapshots = ToolSnapshots(tmp_path)
+    sessions = McpSessionPools([mcp], registry=registry)
+    phase_metric = discovery_metric(registry)
+
+    await discover_mcp(mcp, sessions.get(mcp.name), set(), phase_metric, snapshots)
+
+    moved = mcp.model_copy(update={"url": "http://elsewhere:8180/mcp"})
+    assert await warm_start_mcp(moved, sessions.get(mcp.name), snapshots, phase_metric) is None
+
+    await sessions.close()
@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+from prometheus_client import CollectorRegistry
+
+from chatbot.chathistory import ChatHistory
+from chatbot.config import LangchainConfig, ResponseCacheConfig
+from chatbot.langgraph.responsecache import ResponseCache, tools_hash
+from conftest import CountingChatModel, compiled_handler
+
+
+def llm_config(temperature: float = 0, **kwargs) -> LangchainConfig:
+    return LangchainConfig(model="fake", temperature=temperature, streaming=True, response_cache=ResponseCacheConfig(enabled=True, **kwargs))
+
+
+async def test_identical_questions_are_answered_from_the_cache(myai_config, registry):
+    model = CountingChatModel()
+    handler = compiled_handler(myai_config, model, registry, llm_config=llm_config())
+
+    assert await handler.chat("convo-a", "user-a", "What chasers are active?") == "reply 1"
+    # Another user asking the same question, differing only in case and spacing
+    tokens = []
+    reply = await handler.ainvoke_agent("convo-b", "user-b", "  what chasers  are active? ", ChatHistory(), on_token=tokens.append)
+
+    assert reply == "reply 1"
+    assert tokens == ["reply 1"]
+    assert model.calls == 1
+    assert registry.get_sample_value("response_cache_lookups_total", {"result": "hit"}) == 1
+    assert registry.get_sample_value("response_cache_lookups_total", {"result": "miss"}) == 1
+    assert registry.get_sample_value("response_cache_saved_seconds_total") > 0
+
+
+async def test_repeat_within_a_conversation_is_appended(myai_config):
+    handler = compiled_handler(myai_config, CountingChatModel(), llm_config=llm_config())
+
+    await handler.chat("convo", "user", "hello")
+    # The history differs so the second hello is a miss
+    assert await handler.chat("convo", "user", "hello") == "reply 2"
+
+    state = await handler.graph.aget_state(handler.get_graph_config("convo"))
+    assert [message.content for message in state.values["messages"]] == ["hello", "reply 1", "hello", "reply 2"]
+
+
+async def test_nondeterministic_temperature_bypasses_the_cache(myai_config, registry):
+    model = CountingChatModel()
+    handler = compiled_handler(myai_config, model, registry, llm_config=llm_config(temperature=0.7))
+
+    await handler.chat("convo-a", "user", "hello")
+    await handler.chat("convo-b", "user", "hello")
+
+    assert model.calls == 2
+    assert registry.get_sample_value("response_cache_lookups_total", {"result": "bypass"}) == 2
+
+    model = CountingChatModel()
+    handler = compiled_handler(myai_config, model, llm_config=llm_config(temperature=0.7, allow_nondeterministic=True))
+    await handler.chat("convo-a", "user", "hello")
+    await handler.chat("convo-b", "user", "hello")
+    assert model.calls == 1
+
+
+def test_entries_expire_and_are_evicted_least_recently_used(clock, registry):
+    cache = ResponseCache(llm_config(max_entries=2, ttl=timedelta(seconds=10)), registry=registry, clock=clock)
+    keys = [cache.key([HumanMessage(content=prompt)], tools="") for prompt in ["a", "b", "c"]]
+
+    cache.put(keys[0], AIMessage(content="a"), latency=1)
+    cache.put(keys[1], AIMessage(content="b"), latency=1)
+    assert cache.get(keys[0]).content == "a"
+    cache.put(keys[2], AIMessage(content="c"), latency=1)
+
+    # b was least recently used
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]).content == "a"
+
+    clock.now = 10
+    assert cache.get(keys[0]) is None
+    assert len(cache.entries) == 1
+
+
+def test_key_covers_model_temperature_and_tools():
+    @tool
+    def lookup(name: str) -> str:
+        """Look up a name"""
+        return name
+
+    @tool
+    def search(query: str) -> str:
+        """Search"""
+        return query
+
+    messages = [HumanMessage(content="hello")]
+    cache = ResponseCache(llm_config(), registry=CollectorRegistry())
+    key = cache.key(messages, tools_hash([lookup]))
+
+    assert cache.key(messages, tools_hash([lookup, search])) != key
+    assert ResponseCache(llm_config(temperature=0.5), registry=CollectorRegistry()).key(messages, tools_hash([lookup])) != key
+    other_model = LangchainConfig(model="other", temperature=0, response_cache=ResponseCacheConfig(enabled=True))
+    assert ResponseCache(other_model, registry=CollectorRegistry()).key(messages, tools_hash([lookup])) != key
@@ -0,0 +1,197 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import LangchainConfig
+from chatbot.langgraph import llm_model
+from chatbot.langgraph.router import Deployment, LlmRouter
+from conftest import FakeClock
+
+
+def rate_limited(retry_after: str | None = None) -> openai.RateLimitError:
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://example.openai.azure.com"))
+    return openai.RateLimitError("Too many requests", response=response, body=None)
+
+
+def server_error(status: int = 503) -> openai.APIStatusError:
+    response = httpx.Response(status, request=httpx.Request("POST", "https://example.openai.azure.com"))
+    return openai.APIStatusError("Server error", response=response, body=None)
+
+
+def connection_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://example.openai.azure.com"))
+
+
+class FakeDeploymentModel(BaseChatModel):
+    """Replies with its name, after waiting on gate if set, throttling the first throttles calls then raising errors in turn"""
+
+    reply: str
+    gate: asyncio.Event | None = None
+    throttles: int = 0
+    errors: list = []
+    calls: int = 0
+    tools: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-deployment"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools": list(tools)})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.throttles:
+            self.throttles -= 1
+            raise rate_limited("5")
+        if self.errors:
+            raise self.errors.pop(0)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+def router(*deployments: Deployment, clock=None, max_retries: int = 2) -> tuple[LlmRouter, CollectorRegistry]:
+    registry = CollectorRegistry()
+    return LlmRouter(deployments, cooldown=30, registry=registry, clock=clock or FakeClock(), max_retries=max_retries, backoff=0), registry
+
+
+async def test_calls_go_to_the_deployment_with_the_lowest_latency(clock):
+    slow = FakeDeploymentModel(reply="slow")
+    fast = FakeDeploymentModel(reply="fast")
+    llm, registry = router(Deployment("slow", slow), Deployment("fast", fast), clock=clock)
+
+    # Each deployment is tried once to learn its latency
+    llm.deployments[0].latency = 2.0
+    assert (await llm.ainvoke("hi")).content == "fast"
+
+    for _ in range(3):
+        assert (await llm.ainvoke("hi")).content == "fast"
+
+    assert slow.calls == 0
+    assert registry.get_sample_value("llm_deployment_selections_total", {"deployment": "fast"}) == 4
+    assert registry.get_sample_value("llm_deployment_latency_seconds_count", {"deployment": "fast"}) == 4
+
+
+async def test_concurrent_calls_are_spread_by_outstanding_calls_and_weight():
+    gate = asyncio.Event()
+    heavy = FakeDeploymentModel(reply="heavy", gate=gate)
+    light = FakeDeploymentModel(reply="light", gate=gate)
+    llm, registry = router(Deployment("heavy", heavy, weight=2, latency=1.0), Deployment("light", light, latency=1.0))
+
+    calls = [asyncio.create_task(llm.ainvoke("hi")) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert registry.get_sample_value("llm_deployment_outstanding", {"deployment": "heavy"}) == 2
+    assert registry.get_sample_value("llm_deployment_outstanding", {"deployment": "light"}) == 1
+
+    gate.set()
+    replies = await asyncio.gather(*calls)
+    assert sorted(reply.content for reply in replies) == ["heavy", "heavy", "light"]
+    assert registry.get_sample_value("llm_deployment_outstanding", {"deployment": "heavy"}) == 0
+
+
+async def test_throttled_deployment_is_taken_out_until_retry_after(clock):
+    throttled = FakeDeploymentModel(reply="throttled", throttles=1)
+    spare = FakeDeploymentModel(reply="spare")
+    llm, registry = router(Deployment("throttled", throttled, weight=2), Deployment("spare", spare), clock=clock)
+
+    # The throttled call is retried on the other deployment
+    assert (await llm.ainvoke("hi")).content == "spare"
+    assert registry.get_sample_value("llm_deployment_throttles_total", {"deployment": "throttled"}) == 1
+
+    clock.now = 4.0
+    assert llm.select().name == "spare"
+
+    clock.now = 5.0
+    assert (await llm.ainvoke("hi")).content == "throttled"
+
+
+async def test_throttle_is_raised_when_every_deployment_throttles():
+    llm, registry = router(
+        Deployment("first", FakeDeploymentModel(reply="first", throttles=1)),
+        Deployment("second", FakeDeploymentModel(reply="second", throttles=1)),
+    )
+
+    with pytest.raises(openai.RateLimitError):
+        await llm.ainvoke("hi")
+
+    assert registry.get_sample_value("llm_deployment_throttles_total", {"deployment": "first"}) == 1
+    assert registry.get_sample_value("llm_deployment_throttles_total", {"deployment": "second"}) == 1
+
+
+async def test_transient_errors_fail_over_to_another_deployment():
+    failing = FakeDeploymentModel(reply="failing", errors=[connection_error()])
+    spare = FakeDeploymentModel(reply="spare")
+    llm, registry = router(Deployment("failing", failing, weight=2), Deployment("spare", spare))
+
+    assert (await llm.ainvoke("hi")).content == "spare"
+    assert registry.get_sample_value("llm_deployment_errors_total", {"deployment": "failing"}) == 1
+    # A transient error does not take the deployment out of routing
+    assert llm.deployments[0].throttled_until == 0
+
+
+async def test_transient_errors_are_retried_on_a_single_deployment():
+    only = FakeDeploymentModel(reply="only", errors=[server_error(502), connection_error()])
+    llm, registry = router(Deployment("only", only))
+
+    assert (await llm.ainvoke("hi")).content == "only"
+    assert only.calls == 3
+    assert registry.get_sample_value("llm_deployment_errors_total", {"deployment": "only"}) == 2
+
+
+async def test_retries_are_limited_and_other_errors_are_raised():
+    failing = FakeDeploymentModel(reply="failing", errors=[server_error(500), server_error(500)])
+    llm, _ = router(Deployment("failing", failing), max_retries=1)
+
+    with pytest.raises(openai.APIStatusError):
+        await llm.ainvoke("hi")
+    assert failing.calls == 2
+
+    rejected = FakeDeploymentModel(reply="rejected", errors=[server_error(400)])
+    llm, _ = router(Deployment("rejected", rejected), Deployment("spare", FakeDeploymentModel(reply="spare")))
+    llm.deployments[1].latency = 10.0
+    with pytest.raises(openai.APIStatusError):
+        await llm.ainvoke("hi")
+    assert rejected.calls == 1
+
+
+async def test_bound_router_shares_the_observations_of_the_deployments():
+    llm, registry = router(Deployment("only", FakeDeploymentModel(reply="only")))
+
+    bound = llm.bind_tools([])
+    await bound.ainvoke("hi")
+
+    assert bound.runnables["only"] is not llm.runnables["only"]
+    assert llm.deployments[0].latency is not None
+
+
+def test_llm_model_routes_across_configured_deployments():
+    config = LangchainConfig(
+        model_provider="azure_openai",
+        model="gpt-test",
+        azure_api_key="key",
+        azure_api_version="2024-10-21",
+        deployments=[
+            {"name": "east", "azure_endpoint": "https://east.openai.azure.com", "weight": 2},
+            {"name": "west", "azure_endpoint": "https://west.openai.azure.com", "azure_api_key": "west-key"},
+        ],
+    )
+
+    model = llm_model(config, registry=CollectorRegistry())
+
+    assert isinstance(model, LlmRouter)
+    assert [(deployment.name, deployment.weight) for deployment in model.deployments] == [("east", 2), ("west", 1)]
+    # The router retries transient errors in place of the clients
+    assert all(deployment.model.max_retries == 0 for deployment in model.deployments)
+    assert model.max_retries == config.deployment_retries == 2
+    assert model.deployments[1].model.openai_api_key.get_secret_value() == "west-key"
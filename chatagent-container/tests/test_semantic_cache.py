@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from chatbot.chathistory import ChatHistory
+from chatbot.config import LangchainConfig, SemanticCacheConfig
+from chatbot.langgraph.semanticcache import HashingEmbedder, SemanticCache
+from conftest import CountingChatModel, compiled_handler
+
+
+def llm_config(**kwargs) -> LangchainConfig:
+    return LangchainConfig(model="fake", streaming=True, semantic_cache=SemanticCacheConfig(enabled=True, **kwargs))
+
+
+def test_hashing_embedder_is_deterministic_and_scores_similar_wording_higher():
+    embedder = HashingEmbedder(dimensions=256)
+    question = np.array(embedder.embed_query("What chasers are active?"))
+
+    assert np.allclose(question, embedder.embed_query("What chasers are active?"))
+    assert np.isclose(np.linalg.norm(question), 1.0)
+
+    similar = question @ np.array(embedder.embed_query("what chasers are active right now"))
+    unrelated = question @ np.array(embedder.embed_query("Book a meeting room for Tuesday"))
+    assert similar > 0.7 > unrelated
+
+
+async def test_similar_first_questions_are_answered_from_the_cache(myai_config, registry):
+    model = CountingChatModel()
+    handler = compiled_handler(myai_config, model, registry, llm_config=llm_config(threshold=0.8))
+
+    assert await handler.chat("convo-a", "user-a", "What chasers are active?") == "reply 1"
+    tokens = []
+    reply = await handler.ainvoke_agent("convo-b", "user-b", "what chasers are active??", ChatHistory(), on_token=tokens.append)
+
+    assert reply == "reply 1"
+    assert tokens == ["reply 1"]
+    assert model.calls == 1
+    assert registry.get_sample_value("semantic_cache_lookups_total", {"result": "hit"}) == 1
+    assert registry.get_sample_value("semantic_cache_similarity_count") == 1
+
+    # A different question goes to the model
+    assert await handler.chat("convo-c", "user-c", "Book a meeting room for Tuesday") == "reply 2"
+    assert registry.get_sample_value("semantic_cache_lookups_total", {"result": "miss"}) == 2
+
+
+async def test_only_first_turns_are_cached(myai_config):
+    handler = compiled_handler(myai_config, CountingChatModel(), llm_config=llm_config(threshold=0.8))
+
+    await handler.chat("convo-a", "user", "hello")
+    # A later turn of another conversation is not answered from the cache
+    await handler.chat("convo-b", "user", "good morning")
+    assert await handler.chat("convo-b", "user", "hello") == "reply 3"
+    assert handler.semantic_cache.entries == 2
+
+
+async def test_answers_expire_and_can_be_cleared(clock, registry):
+    cache = SemanticCache(SemanticCacheConfig(enabled=True, ttl=timedelta(seconds=10), max_entries=2), registry=registry, clock=clock)
+
+    await cache.add("hello", AIMessage(content="hi"))
+    assert (await cache.lookup("hello")).content == "hi"
+
+    clock.now = 10
+    assert await cache.lookup("hello") is None
+
+    await cache.add("hello", AIMessage(content="hi again"))
+    cache.clear()
+    assert await cache.lookup("hello") is None
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+import asyncio
+
+from aiohttp import web
+from click.testing import CliRunner
+from prometheus_client import CollectorRegistry
+
+from chatbot import keys
+from chatbot.cli import cli
+from chatbot.hams import Hams
+from chatbot.langgraph import startup_in_background
+from chatbot.langgraph.handler import LanggraphHandler
+from chatbot.mcp_client import MCPObjects
+from chatbot.startup import StartupTimings, import_times
+from conftest import EchoChatModel
+
+
+async def test_ready_once_graph_compiled_in_background(myai_config):
+    app = web.Application()
+    app[keys.config] = SimpleNamespace(myai=myai_config)
+    app[keys.langgraph_handler] = LanggraphHandler(myai_config, EchoChatModel(), registry=CollectorRegistry())
+    hams = Hams(web.Application(), app, config=None, registry=CollectorRegistry())
+
+    # MCP discovery still running
+    discovery = asyncio.get_running_loop().create_future()
+    app[keys.mcp_discovery] = discovery
+
+    startup = startup_in_background(app)
+    await anext(startup)
+    await asyncio.sleep(0)
+    assert not hams.ready()
+
+    app[keys.mcpobjects] = MCPObjects()
+    discovery.set_result(None)
+    await app[keys.graph_startup]
+    assert hams.ready()
+
+    await anext(startup, None)
+
+
+def test_startup_phases_are_exported(registry):
+    timings = StartupTimings(origin=0)
+    timings.record("imports", 1.5)
+
+    timings.export(registry)
+    with timings.phase("config"):
+        pass
+
+    assert registry.get_sample_value("startup_phase_seconds", {"phase": "imports"}) == 1.5
+    assert registry.get_sample_value("startup_phase_seconds", {"phase": "config"}) >= 0
+
+
+def test_import_times_are_listed_as_a_tree():
+    imports = import_times("json")
+
+    assert imports[0].module == "json" and imports[0].depth == 0
+    assert {module.module for module in imports if module.depth == 1} >= {"json.decoder", "json.encoder"}
+    assert imports[0].cumulative_us >= max(module.cumulative_us for module in imports[1:])
+
+
+def test_profile_startup_command():
+    result = CliRunner().invoke(
+        cli,
+        ["profile-startup", "--config", "tests/test_data/config.yaml", "--secrets", "tests/test_data/secrets_sample"],
+    )
+
+    assert result.exit_code == 0, result.output
+    for phase in ["imports", "config", "app_init", "startup_hooks", "compile", "graph_ready"]:
+        assert phase in result.output
+
+
+# Cold import of the CLI takes about 0.5s, the budget only fails on a clear regression
+CLI_IMPORT_BUDGET_MS = 1500
+
+
+def test_cli_import_stays_within_budget():
+    imports = {module.module: module for module in import_times("chatbot.cli")}
+
+    assert imports["chatbot.cli"].cumulative_us < CLI_IMPORT_BUDGET_MS * 1000
+    # The subsystems are imported when the service starts them, not by the CLI
+    assert not {"langgraph", "langchain_mcp_adapters", "mcp", "microsoft_agents"} & {module.split(".")[0] for module in imports}
@@ -0,0 +1,39 @@
+from chatbot.azurebot.streaming import ThrottledStream
+from conftest import FakeClock
+
+
+class FakeStreamingResponse:
+    def __init__(self):
+        self.chunks = []
+        self.ended = False
+
+    def queue_text_chunk(self, text):
+        self.chunks.append(text)
+
+    async def end_stream(self):
+        self.ended = True
+
+
+async def test_tokens_are_batched_per_interval(clock):
+    response = FakeStreamingResponse()
+    stream = ThrottledStream(response, interval=1.0, clock=clock)
+
+    for token in ["a", "b", "c"]:
+        stream.write(token)
+    clock.now = 1.0
+    stream.write("d")
+    stream.write("e")
+    await stream.close("abcde")
+
+    assert response.chunks == ["abcd", "e"]
+    assert response.ended
+
+
+async def test_final_text_sent_when_nothing_streamed():
+    response = FakeStreamingResponse()
+    stream = ThrottledStream(response, interval=1.0, clock=FakeClock())
+
+    await stream.close("whole reply")
+
+    assert response.chunks == ["whole reply"]
+    assert response.ended
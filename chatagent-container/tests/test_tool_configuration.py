@@ -201,3 +201,32 @@ def test_local_tool_no_context_strict(registry):
     with pytest.raises(ValueError) as excinfo:
         registry.register_tool(tool_fail, context=None)
     assert "Local tools must always be explicitly configured" in str(excinfo.value)
+
+
+def test_replace_mcp_tools(registry):
+    """Test reloading the tools of an MCP keeps the limiter of unchanged tools and drops removed tools"""
+    context = ToolRegistrationContext(source="mcp", mcp_name="test_mcp", mcp_mode=ToolModeEnum.strict)
+    registry.register_tools([create_mock_tool("configured_tool_1")], context=context)
+    limiter = registry.registry["configured_tool_1"].limiter
+
+    registry.replace_mcp_tools([create_mock_tool("configured_tool_2")], context=context)
+    assert set(registry.registry) == {"configured_tool_2"}
+
+    registry.replace_mcp_tools([create_mock_tool("configured_tool_1"), create_mock_tool("configured_tool_2")], context=context)
+    registry.replace_mcp_tools([create_mock_tool("configured_tool_1")], context=context)
+    assert registry.registry["configured_tool_1"].limiter is not limiter
+
+    reloaded = registry.registry["configured_tool_1"]
+    registry.replace_mcp_tools([create_mock_tool("configured_tool_1")], context=context)
+    assert registry.registry["configured_tool_1"].limiter is reloaded.limiter
+
+
+def test_replace_mcp_tools_strict_failure(registry):
+    """Test a reload with an unconfigured tool in strict mode leaves the registered tools unchanged"""
+    context = ToolRegistrationContext(source="mcp", mcp_name="test_mcp", mcp_mode=ToolModeEnum.strict)
+    registry.register_tools([create_mock_tool("configured_tool_1")], context=context)
+
+    with pytest.raises(ValueError):
+        registry.replace_mcp_tools([create_mock_tool("configured_tool_2"), create_mock_tool("unconfigured_tool")], context=context)
+
+    assert set(registry.registry) == {"configured_tool_1"}
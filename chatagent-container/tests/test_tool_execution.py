@@ -0,0 +1,267 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode
+from prometheus_client import CollectorRegistry
+
+from chatbot.config.tool import ToolBoxConfig, ToolCacheConfig, ToolConfig
+from chatbot.langgraph.toolregistry import ToolRegistry
+
+
+class SlowTool:
+    """Tool body that records how many calls run at once and blocks until released"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.release = asyncio.Event()
+
+    async def run(self, value: int) -> str:
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.release.wait()
+        finally:
+            self.running -= 1
+        return f"done {value}"
+
+
+def create_registry(tool_config: ToolConfig, registry: CollectorRegistry) -> tuple[ToolRegistry, SlowTool]:
+    tool_registry = ToolRegistry(ToolBoxConfig(tools=[tool_config], max_concurrent=10, mcps=[]), registry=registry)
+    body = SlowTool()
+    tool_registry.register_tool(StructuredTool.from_function(coroutine=body.run, name=tool_config.name, description="Slow tool"))
+    return tool_registry, body
+
+
+def tool_node(tool_registry: ToolRegistry):
+    """Graph running only the tool node, wired to the registry as in LanggraphHandler.bind_tools"""
+    graph_builder = StateGraph(MessagesState)
+    graph_builder.add_node("my_tools", ToolNode(tools=tool_registry.all_tools(), awrap_tool_call=tool_registry.awrap_tool_call))
+    graph_builder.add_edge(START, "my_tools")
+    return graph_builder.compile()
+
+
+async def until(condition, timeout: float = 1) -> None:
+    """Wait for the condition to hold, rather than a fixed time that a loaded machine can overrun"""
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+def tool_call_message(name: str, call_id: str) -> dict:
+    return {"messages": [AIMessage(content="", tool_calls=[{"name": name, "args": {"value": 1}, "id": call_id}])]}
+
+
+async def test_max_instances_is_shared_across_conversations():
+    registry = CollectorRegistry()
+    tool_registry, body = create_registry(ToolConfig(name="slow", max_instances=2), registry)
+    node = tool_node(tool_registry)
+
+    # Each conversation calls the tool from its own turn
+    turns = [asyncio.create_task(node.ainvoke(tool_call_message("slow", f"call-{index}"))) for index in range(5)]
+    await until(lambda: body.running == 2 and registry.get_sample_value("tool_queue_depth", {"tool_name": "slow", "mcp_server": "local"}) == 3)
+    await asyncio.sleep(0.01)
+
+    assert body.running == 2
+    assert registry.get_sample_value("tool_queue_depth", {"tool_name": "slow", "mcp_server": "local"}) == 3
+
+    body.release.set()
+    results = await asyncio.gather(*turns)
+
+    assert body.peak == 2
+    assert all(result["messages"][-1].content == "done 1" for result in results)
+    assert registry.get_sample_value("tool_queue_depth", {"tool_name": "slow", "mcp_server": "local"}) == 0
+    assert registry.get_sample_value("tool_wait_count", {"tool_name": "slow", "mcp_server": "local"}) == 5
+
+
+async def test_calls_beyond_the_queue_are_rejected():
+    registry = CollectorRegistry()
+    tool_registry, body = create_registry(ToolConfig(name="slow", max_instances=1, max_queue=1), registry)
+    node = tool_node(tool_registry)
+
+    turns = [asyncio.create_task(node.ainvoke(tool_call_message("slow", f"call-{index}"))) for index in range(2)]
+    await asyncio.sleep(0.01)
+
+    rejected = await node.ainvoke(tool_call_message("slow", "call-rejected"))
+    assert rejected["messages"][-1].status == "error"
+    assert rejected["messages"][-1].tool_call_id == "call-rejected"
+    assert registry.get_sample_value("tool_rejected_total", {"tool_name": "slow", "mcp_server": "local"}) == 1
+
+    body.release.set()
+    results = await asyncio.gather(*turns)
+    assert [result["messages"][-1].status for result in results] == ["success", "success"]
+
+
+async def test_calls_are_cancelled_at_their_timeout():
+    registry = CollectorRegistry()
+    tool_registry, body = create_registry(ToolConfig(name="slow", timeout=timedelta(milliseconds=20)), registry)
+    node = tool_node(tool_registry)
+
+    result = await node.ainvoke(tool_call_message("slow", "call-hung"))
+
+    message = result["messages"][-1]
+    assert message.status == "error"
+    assert json.loads(message.content)["error"] == "timeout"
+    assert body.running == 0
+    assert registry.get_sample_value("tool_timeouts_total", {"tool_name": "slow", "mcp_server": "local"}) == 1
+
+    # The slot held by the cancelled call is released
+    assert not tool_registry.registry["slow"].limiter.semaphore.locked()
+
+
+async def test_max_concurrent_is_shared_fairly_between_conversations():
+    registry = CollectorRegistry()
+    tool_registry = ToolRegistry(ToolBoxConfig(tools=[ToolConfig(name="slow", max_instances=10)], max_concurrent=1, mcps=[]), registry=registry)
+    started = []
+    release = asyncio.Event()
+
+    async def slow(conversation: str) -> str:
+        started.append(conversation)
+        await release.wait()
+        return conversation
+
+    tool_registry.register_tool(StructuredTool.from_function(coroutine=slow, name="slow", description="Slow tool"))
+
+    def calls(conversation: str, count: int) -> list[dict]:
+        return [{"name": "slow", "args": {"conversation": conversation}, "id": f"{conversation}-{index}"} for index in range(count)]
+
+    # Conversation a asks for three tools at once just before b asks for one
+    busy = asyncio.create_task(tool_registry.perform_tool_actions(calls("a", 3), "a"))
+    await asyncio.sleep(0.01)
+    quiet = asyncio.create_task(tool_registry.perform_tool_actions(calls("b", 1), "b"))
+    await asyncio.sleep(0.01)
+
+    assert registry.get_sample_value("tool_scheduler_running") == 1
+    assert registry.get_sample_value("tool_scheduler_waiting") == 3
+
+    release.set()
+    await asyncio.gather(busy, quiet)
+
+    # b is served as soon as a slot frees rather than after all of the calls a queued first
+    assert started == ["a", "b", "a", "a"]
+    assert registry.get_sample_value("tool_scheduler_running") == 0
+
+
+def create_counting_registry(tool_config: ToolConfig, registry: CollectorRegistry) -> tuple[ToolRegistry, list[str]]:
+    tool_registry = ToolRegistry(ToolBoxConfig(tools=[tool_config], max_concurrent=10, mcps=[]), registry=registry)
+    calls = []
+
+    async def lookup(name: str) -> str:
+        calls.append(name)
+        return f"record {name} #{len(calls)}"
+
+    tool_registry.register_tool(StructuredTool.from_function(coroutine=lookup, name=tool_config.name, description="Lookup tool"))
+    return tool_registry, calls
+
+
+def lookup_call(name: str, call_id: str) -> dict:
+    return {"name": "lookup", "args": {"name": name}, "id": call_id}
+
+
+async def test_cached_results_are_shared_across_conversations():
+    registry = CollectorRegistry()
+    tool_registry, calls = create_counting_registry(ToolConfig(name="lookup", cache=ToolCacheConfig(ttl=timedelta(minutes=1))), registry)
+
+    first = await tool_registry.perform_tool_action(lookup_call("alice", "call-1"), "convo-a", "user-a")
+    second = await tool_registry.perform_tool_action(lookup_call("alice", "call-2"), "convo-b", "user-b")
+    other = await tool_registry.perform_tool_action(lookup_call("bob", "call-3"), "convo-b", "user-b")
+
+    assert calls == ["alice", "bob"]
+    assert second.content == first.content
+    assert second.tool_call_id == "call-2"
+    assert other.content == "record bob #2"
+    assert registry.get_sample_value("tool_cache_hits_total", {"tool_name": "lookup", "mcp_server": "local"}) == 1
+    assert registry.get_sample_value("tool_cache_misses_total", {"tool_name": "lookup", "mcp_server": "local"}) == 2
+
+
+async def test_cache_is_per_identity_when_configured():
+    registry = CollectorRegistry()
+    cache = ToolCacheConfig(ttl=timedelta(minutes=1), include_identity=True)
+    tool_registry, calls = create_counting_registry(ToolConfig(name="lookup", cache=cache), registry)
+
+    await tool_registry.perform_tool_action(lookup_call("alice", "call-1"), "convo-a", "user-a")
+    await tool_registry.perform_tool_action(lookup_call("alice", "call-2"), "convo-a", "user-b")
+    await tool_registry.perform_tool_action(lookup_call("alice", "call-3"), "convo-a", "user-a")
+
+    assert calls == ["alice", "alice"]
+
+
+async def test_cache_entries_expire_and_are_evicted_by_size():
+    registry = CollectorRegistry()
+    cache = ToolCacheConfig(ttl=timedelta(milliseconds=20), max_entries=1)
+    tool_registry, calls = create_counting_registry(ToolConfig(name="lookup", cache=cache), registry)
+
+    await tool_registry.perform_tool_action(lookup_call("alice", "call-1"))
+    await tool_registry.perform_tool_action(lookup_call("bob", "call-2"))
+    await asyncio.sleep(0.03)
+    await tool_registry.perform_tool_action(lookup_call("bob", "call-3"))
+
+    assert calls == ["alice", "bob", "bob"]
+    assert registry.get_sample_value("tool_cache_evictions_total", {"tool_name": "lookup", "mcp_server": "local", "reason": "size"}) == 1
+    assert registry.get_sample_value("tool_cache_evictions_total", {"tool_name": "lookup", "mcp_server": "local", "reason": "expired"}) == 1
+
+
+async def test_tool_node_results_are_cached():
+    registry = CollectorRegistry()
+    tool_registry, calls = create_counting_registry(ToolConfig(name="lookup", cache=ToolCacheConfig(ttl=timedelta(minutes=1))), registry)
+    node = tool_node(tool_registry)
+
+    for call_id in ["call-1", "call-2"]:
+        result = await node.ainvoke({"messages": [AIMessage(content="", tool_calls=[lookup_call("alice", call_id)])]})
+        assert result["messages"][-1].tool_call_id == call_id
+
+    assert calls == ["alice"]
+
+
+async def test_cached_results_are_distinct_messages():
+    registry = CollectorRegistry()
+    tool_registry, calls = create_counting_registry(ToolConfig(name="lookup", cache=ToolCacheConfig(ttl=timedelta(minutes=1))), registry)
+    node = tool_node(tool_registry)
+
+    message_ids = []
+    for call_id in ["call-1", "call-2", "call-3"]:
+        result = await node.ainvoke({"messages": [AIMessage(content="", tool_calls=[lookup_call("alice", call_id)])]})
+        message_ids.append(result["messages"][-1].id)
+
+    assert calls == ["alice"]
+    # The reducer gave each result its own id, so a RemoveMessage for one leaves the others
+    assert None not in message_ids
+    assert len(set(message_ids)) == 3
+
+
+async def test_identical_concurrent_calls_are_coalesced():
+    registry = CollectorRegistry()
+    tool_registry, body = create_registry(ToolConfig(name="slow", coalesce=True), registry)
+
+    calls = [{"name": "slow", "args": {"value": 1}, "id": f"call-{index}"} for index in range(3)]
+    calls.append({"name": "slow", "args": {"value": 2}, "id": "call-other"})
+    pending = asyncio.gather(*[tool_registry.perform_tool_action(call, f"convo-{index}") for index, call in enumerate(calls)])
+    await asyncio.sleep(0.01)
+
+    assert body.running == 2
+
+    body.release.set()
+    results = await pending
+
+    assert [result.content for result in results] == ["done 1", "done 1", "done 1", "done 2"]
+    assert [result.tool_call_id for result in results] == [call["id"] for call in calls]
+    assert registry.get_sample_value("tool_coalesced_total", {"tool_name": "slow", "mcp_server": "local"}) == 2
+    assert not tool_registry.inflight
+
+
+async def test_calls_are_not_coalesced_unless_configured():
+    registry = CollectorRegistry()
+    tool_registry, body = create_registry(ToolConfig(name="slow"), registry)
+
+    calls = [{"name": "slow", "args": {"value": 1}, "id": f"call-{index}"} for index in range(3)]
+    pending = asyncio.gather(*[tool_registry.perform_tool_action(call) for call in calls])
+    await asyncio.sleep(0.01)
+
+    assert body.running == 3
+
+    body.release.set()
+    await pending